@@ -56,9 +56,101 @@ def knot_argparser() -> argparse.ArgumentParser:
         help="skip using sage to disambiguate knots",
         action="store_true",
     )
+    parse.add_argument(
+        "--homfly",
+        help="how to compute HOMFLY polynomials. native falls back to sage for large knots, check runs both and reports mismatches",
+        choices=["native", "sage", "check"],
+        default="native",
+    )
+    parse.add_argument(
+        "--persistent",
+        help="keep workers alive between files, so sage, the KnotIDDB and caches are only loaded once",
+        action="store_true",
+    )
+    parse.add_argument(
+        "--max-worker-rss",
+        help="with --persistent, restart a worker once its memory use passes this many MB",
+        type=float,
+        default=4096,
+    )
     parse.set_defaults(func=main.run_catalog)
 
-    merge = subs.add_parser("merge", help="merge result files with this ID string")
+    stream = subs.add_parser(
+        "stream",
+        help="parse mosaics as mosaic-gen generates them, without storing mosaic files",
+    )
+    stream.add_argument("size", type=int, help="mosaic size")
+    stream.add_argument("type", choices=M.parser_types.keys(), help="type of mosaic")
+    stream.add_argument(
+        "--keep-existing",
+        action="store_true",
+        help="skip chunks that have existing results, restarting mosaic-gen at the first missing one",
+    )
+    stream.add_argument(
+        "-c",
+        "--cubic-version",
+        help="Type of cubic to generate, must match the folder path",
+        type=str,
+    )
+    stream.add_argument(
+        "-x",
+        "--no-clean-exit",
+        help="Don't run the watcher that allows clean partial exits. For scripting",
+        action="store_true",
+    )
+    stream.add_argument(
+        "-w",
+        "--workers",
+        help="Number of parallel worker-processes to spawn",
+        type=int,
+        default=6,
+    )
+    stream.add_argument(
+        "--input",
+        help="read mosaics from this file or FIFO ('-' for stdin) instead of running mosaic-gen",
+    )
+    stream.add_argument(
+        "--generator",
+        help="path of the mosaic-gen executable",
+        default="mosaic-gen/target/release/mosaic-gen",
+    )
+    stream.add_argument(
+        "--gen-args",
+        help="extra arguments for mosaic-gen, ex. '-r -d 0'",
+        default="",
+    )
+    stream.add_argument(
+        "-p",
+        "--packed",
+        help="have mosaic-gen stream packed records instead of text",
+        action="store_true",
+    )
+    stream.add_argument(
+        "--chunk-len",
+        help="mosaics in each result file, the default matches 3 files of mosaic-gen output",
+        type=int,
+        default=300_000,
+    )
+    stream.add_argument(
+        "--no-sage",
+        help="skip using sage to disambiguate knots",
+        action="store_true",
+    )
+    stream.add_argument(
+        "--homfly",
+        help="how to compute HOMFLY polynomials. native falls back to sage for large knots, check runs both and reports mismatches",
+        choices=["native", "sage", "check"],
+        default="native",
+    )
+    stream.add_argument(
+        "--max-worker-rss",
+        help="restart a worker once its memory use passes this many MB",
+        type=float,
+        default=4096,
+    )
+    stream.set_defaults(func=main.run_stream)
+
+    merge = subs.add_parser("merge", help="merge the results of every task of this type")
     merge.add_argument(
         "type", choices=M.parser_types.keys(), help="folder name in output & data"
     )
@@ -74,17 +166,35 @@ def knot_argparser() -> argparse.ArgumentParser:
         help="generate images in 'published' form - without frame, mobius/toric w/out added crossings, cubic as lower-case t",
         action="store_true",
     )
+    merge.add_argument(
+        "-w",
+        "--workers",
+        help="Number of parallel worker-processes to render images with",
+        type=int,
+        default=6,
+    )
     merge.set_defaults(func=main.combine_results)
 
     file = subs.add_parser("file", help="parse single file")
     file.add_argument("input_file", help="path of file to parse", type=Path)
     file.add_argument("output_file", help="path to ouput results to", type=Path)
-    file.add_argument("type", help="type of mosaic", type=str)
+    file.add_argument(
+        "type",
+        help="type of mosaic, read from the header if omitted for packed files",
+        nargs="?",
+        choices=M.parser_types.keys(),
+    )
     file.add_argument(
         "--no-sage",
         help="skip using sage to disambiguate knots",
         action="store_true",
     )
+    file.add_argument(
+        "--homfly",
+        help="how to compute HOMFLY polynomials. native falls back to sage for large knots, check runs both and reports mismatches",
+        choices=["native", "sage", "check"],
+        default="native",
+    )
     file.set_defaults(func=main.handle_file)
 
     return parser
@@ -0,0 +1,330 @@
+"""
+Benchmarks each stage of parsing mosaics, on small corpora that are the same every run.
+
+For each type of mosaic a fixed number of random, suitably connected mosaics with
+at least 3 crossings is generated from a fixed seed, along with the knots among them.
+Each stage is timed on these separately, reporting mosaics (or polynomials) per second
+and the peak memory allocated while it runs.
+
+Usage:
+    python benchmark.py                  compare against the stored baseline
+    python benchmark.py --save-baseline  store these results as the baseline
+
+Exits with status 1 if any stage is slower, or uses more memory, than the baseline
+allows, and 2 if there is no baseline to compare with. Rates depend on the machine,
+so the baseline isn't kept in the repo: store one on the machine that runs the checks,
+ex. from the commit being compared against. Nothing here needs sage: the corpora only hold knots whose HOMFLY polynomial
+is computed natively, and knots are never disambiguated with sage.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import random
+import sys
+import tempfile
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+from time import perf_counter
+from typing import Callable
+
+import homfly
+import mosaic_util as util
+import mosaics as M
+import polynomial_standardization as poly
+from main import catalog_files
+from pd_cache import PDCodeCache
+
+BASELINE_PATH = Path(__file__).parent / "data" / "benchmark_baseline.json"
+KNOT_LUT_PATH = Path(__file__).parent / "homflys" / "knotsToHOMFLY.txt"
+
+# size of the mosaics generated for each type. toric mosaics can't be traversed yet
+CORPUS_SIZES = {"flat": 5, "cyl": 4, "mobius": 4, "cubic": 3}
+# stop looking for knots after this many mosaics per mosaic in the corpus
+MAX_ATTEMPTS = 200
+# each stage is run repeatedly for at least this many seconds, as single runs are too short to time
+MIN_RUN_TIME = 0.2
+
+# sides with a strand on them, for each tile that can be generated
+_TILE_SIDES = [frozenset(conns) for conns in M.connections_dict[:11]]
+
+
+@dataclass
+class Corpus:
+    variant: str
+    size: int
+    mosaics: list[str]  # connected, with at least 3 crossings
+    knots: list[str]  # the mosaics that traverse to knots
+
+
+@dataclass
+class StageResult:
+    items: int
+    rate: float  # items per second, in the fastest run
+    peak_kib: float  # peak memory allocated while running
+
+
+def string_neighbors(variant: str, size: int) -> list[int]:
+    """The side (as `index * 4 + side`) each side of a tile in a mosaic string is
+    glued to, -1 for closed edges"""
+    if variant == "mobius":
+        # the right edge joins the left edge upside down, around the back of the band
+        neighbors = list(M.MosaicShape.get("flat", size).neighbors)
+        for y in range(size):
+            right = M.ind_from_xy(size - 1, y, size) * 4 + 0
+            left = M.ind_from_xy(0, size - 1 - y, size) * 4 + 2
+            neighbors[right], neighbors[left] = left, right
+        return neighbors
+
+    shape = M.MosaicShape.get(variant, size)
+    to_layout: list[int] = []
+    for to, _, length in shape.payload_slices or ((0, 0, shape.width * shape.height),):
+        to_layout.extend(range(to, to + length))
+    from_layout = {ind: i for i, ind in enumerate(to_layout)}
+    neighbors = [-1] * (len(to_layout) * 4)
+    for i, ind in enumerate(to_layout):
+        for side in range(4):
+            nxt = shape.neighbors[ind * 4 + side]
+            # cubic background tiles aren't part of the mosaic
+            if nxt >= 0 and nxt // 4 in from_layout:
+                neighbors[i * 4 + side] = from_layout[nxt // 4] * 4 + nxt % 4
+    return neighbors
+
+
+def random_mosaic(rng: random.Random, neighbors: list[int]) -> str:
+    """A random mosaic with every strand connected, picking tiles in order
+    and backing out of positions that no tile fits"""
+    tile_ct = len(neighbors) // 4
+    tiles = [-1] * tile_ct
+    options: list[list[int] | None] = [None] * tile_ct
+    ind = 0
+    while ind < tile_ct:
+        if options[ind] is None:
+            fits = [t for t in range(len(_TILE_SIDES)) if _tile_fits(t, ind, tiles, neighbors)]
+            rng.shuffle(fits)
+            options[ind] = fits
+        if choices := options[ind]:
+            tiles[ind] = choices.pop()
+            ind += 1
+        else:
+            options[ind] = None
+            tiles[ind] = -1
+            ind -= 1
+    return util.tiles2string(tiles)
+
+
+def _tile_fits(tile: int, ind: int, tiles: list[int], neighbors: list[int]) -> bool:
+    for side in range(4):
+        glued = neighbors[ind * 4 + side]
+        if glued < 0:
+            if side in _TILE_SIDES[tile]:
+                return False
+        elif (other := tiles[glued // 4]) >= 0:
+            if (side in _TILE_SIDES[tile]) != (glued % 4 in _TILE_SIDES[other]):
+                return False
+    return True
+
+
+def make_corpus(variant: str, size: int, count: int, seed: int) -> Corpus:
+    rng = random.Random(f"{seed}-{variant}-{size}")
+    neighbors = string_neighbors(variant, size)
+    builder = M.parser_types[variant]
+    corpus = Corpus(variant, size, [], [])
+    for _ in range(count * MAX_ATTEMPTS):
+        if len(corpus.mosaics) >= count and len(corpus.knots) >= count:
+            break
+        mosaic_str = random_mosaic(rng, neighbors)
+        if util.count_crossings(mosaic_str) < 3:
+            continue
+        if len(corpus.mosaics) < count:
+            corpus.mosaics.append(mosaic_str)
+        pd_codes = M.traverse_mosaic(builder(mosaic_str))
+        if type(pd_codes) is M.NotAKnot or homfly.homfly_from_pd(pd_codes) is None:
+            continue
+        if len(corpus.knots) < count:
+            corpus.knots.append(mosaic_str)
+    return corpus
+
+
+def clear_caches():
+    """So each run starts cold, like a new worker"""
+    homfly._evaluate.cache_clear()
+    poly._homfly_from_string.cache_clear()
+
+
+def measure(stage: Callable[[], int], repeat: int) -> StageResult:
+    """Runs `stage` (which returns its # of items) until `MIN_RUN_TIME` has passed,
+    `repeat` times, then once more to find its peak memory"""
+    best = 0.0
+    items = 0
+    for _ in range(repeat):
+        run_items = 0
+        elapsed = 0.0
+        while elapsed < MIN_RUN_TIME:
+            clear_caches()
+            start = perf_counter()
+            items = stage()
+            elapsed += perf_counter() - start
+            run_items += items
+        best = max(best, run_items / elapsed)
+    clear_caches()
+    tracemalloc.start()
+    stage()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return StageResult(items, best, peak / 1024)
+
+
+def corpus_stages(
+    corpus: Corpus, knot_db: poly.PackedKnotIDDB, work_dir: Path
+) -> dict[str, Callable[[], int]]:
+    """Each stage to time, which returns the number of items it handled"""
+    builder = M.parser_types[corpus.variant]
+    mosaics = [builder(s) for s in corpus.mosaics]
+    knots = [builder(s) for s in corpus.knots]
+    pd_codes = M.traverse_mosaics(knots)
+    polys = [homfly.homfly_from_pd(codes) for codes in pd_codes]  # type: ignore
+    poly_strs = [str(p) for p in polys]
+    corpus_path = work_dir / f"{corpus.variant}.txt"
+    corpus_path.write_text("".join(f"{s}\n" for s in corpus.mosaics))
+    pd_cache_path = work_dir / "pd_cache.sqlite"
+
+    def catalog() -> int:
+        # a new PD code cache each run, so every knot is worked out again
+        pd_cache_path.unlink(missing_ok=True)
+        pd_cache = PDCodeCache(knot_db.digest, pd_cache_path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            catalog_files(
+                [corpus_path],
+                work_dir / "results.txt",
+                builder,
+                skip_sage=True,
+                pd_code_cache=pd_cache,
+                knot_db=knot_db,
+            )
+        pd_cache.close()
+        return len(corpus.mosaics)
+
+    stages: dict[str, Callable[[], int]] = {
+        "string2tiles": lambda: len([util.string2tiles(s) for s in corpus.mosaics]),
+        "build": lambda: len([builder(s) for s in corpus.mosaics]),
+        "traverse_mosaic": lambda: len([M.traverse_mosaic(m) for m in mosaics]),
+        "traverse_mosaics": lambda: len(M.traverse_mosaics(mosaics)),
+    }
+    # cubic mosaics have no knots to work with
+    if knots:
+        stages |= {
+            "homfly_from_pd": lambda: len([homfly.homfly_from_pd(c) for c in pd_codes]),  # type: ignore
+            "HOMFLY.from_string": lambda: len([poly.HOMFLY.from_string(s) for s in poly_strs]),
+            "KnotIDDB.lookup": lambda: len([knot_db.lookup(p) for p in polys]),  # type: ignore
+        }
+    stages["catalog_files"] = catalog
+    return stages
+
+
+def knot_db_stages(work_dir: Path) -> dict[str, Callable[[], int]]:
+    """Opening the KnotIDDB as a pickle, and as the packed file that workers map.
+    Both return the # of polynomials in it. Both files are left in `work_dir`"""
+    pickle_path = work_dir / "knotIDDB.pkl"
+    packed_path = work_dir / "knotIDDB.bin"
+    knot_db = poly.KnotIDDB(KNOT_LUT_PATH)
+    knot_db.dump_to_file(pickle_path)
+    knot_db.dump_packed(packed_path)
+    return {
+        "load_pickle": lambda: len(poly.KnotIDDB.load_from_file(pickle_path).lookup_table),
+        "load_packed": lambda: len(poly.PackedKnotIDDB(packed_path)),
+    }
+
+
+def check_baseline(
+    results: dict[str, StageResult], baseline: dict, tolerance: float
+) -> list[str]:
+    """Stages that are slower or use more memory than the baseline allows"""
+    regressions = []
+    for name, res in results.items():
+        if (base := baseline.get(name)) is None:
+            continue
+        if res.rate < base["rate"] * (1 - tolerance):
+            regressions.append(f"{name}: {res.rate:,.0f}/s, baseline {base['rate']:,.0f}/s")
+        # small peaks are mostly noise
+        if res.peak_kib > base["peak_kib"] * (1 + tolerance) + 64:
+            regressions.append(
+                f"{name}: {res.peak_kib:,.0f} KiB peak, baseline {base['peak_kib']:,.0f} KiB"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--types",
+        nargs="+",
+        choices=CORPUS_SIZES.keys(),
+        default=list(CORPUS_SIZES),
+        help="types of mosaic to benchmark",
+    )
+    parser.add_argument("--count", type=int, default=500, help="mosaics in each corpus")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the corpora")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each stage, the fastest is kept")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH, help="baseline results file")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="fraction a stage can be slower, or use more memory, than its baseline",
+    )
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline.is_file() and not args.save_baseline:
+        stored = json.loads(args.baseline.read_text())
+        if (stored["count"], stored["seed"]) != (args.count, args.seed):
+            print(f"ERR: baseline was run with --count {stored['count']} --seed {stored['seed']}")
+            sys.exit(2)
+        baseline = stored["stages"]
+
+    results: dict[str, StageResult] = {}
+    print(f"{'stage':<28}{'items':>8}{'per sec':>14}{'peak KiB':>11}{'baseline':>14}")
+    # the knot DB and PD cache are made in here, rather than in data/
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = Path(tmp)
+
+        def run_stage(name: str, run: Callable[[], int]):
+            res = results[name] = measure(run, args.repeat)
+            base = baseline.get(name, {}).get("rate")
+            base_str = f"{base:,.0f}" if base else "-"
+            print(f"{name:<28}{res.items:>8}{res.rate:>14,.0f}{res.peak_kib:>11,.0f}{base_str:>14}")
+
+        for stage, run in knot_db_stages(work_dir).items():
+            run_stage(f"knot_db/{stage}", run)
+        knot_db = poly.PackedKnotIDDB(work_dir / "knotIDDB.bin")
+        for variant in args.types:
+            corpus = make_corpus(variant, CORPUS_SIZES[variant], args.count, args.seed)
+            for stage, run in corpus_stages(corpus, knot_db, work_dir).items():
+                run_stage(f"{corpus.size}_{variant}/{stage}", run)
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        stored = {
+            "count": args.count,
+            "seed": args.seed,
+            "stages": {name: vars(res) for name, res in results.items()},
+        }
+        args.baseline.write_text(json.dumps(stored, indent=2))
+        print(f"Saved baseline to {args.baseline}")
+        return
+    if not baseline:
+        print(f"No baseline at {args.baseline}, run with --save-baseline to store one")
+        sys.exit(2)
+    if regressions := check_baseline(results, baseline, args.tolerance):
+        print("REGRESSIONS:")
+        [print(f" - {r}") for r in regressions]
+        sys.exit(1)
+    print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
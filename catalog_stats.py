@@ -0,0 +1,90 @@
+"""
+Counts and times each stage of cataloging mosaics, see `catalog_mosaics` in main.py.
+Workers return the stats of each task, which the parent writes as a line of JSON
+and sums up into a status line while running.
+"""
+
+from dataclasses import asdict, dataclass, field
+import json
+from time import perf_counter, time
+from typing import TextIO
+
+# stages of catalog_mosaics, in the order they run
+STAGES = (
+    "parse_pd",  # reading PD codes written by `mosaic-gen --pd`
+    "build",
+    "traverse",
+    "cache",  # looking up and storing PD codes in the PDCodeCache
+    "sage_simplify",
+    "homfly",
+    "db_lookup",
+    "disambiguate",
+    "compare",  # comparing against the best result of each knot
+)
+
+
+@dataclass
+class CatalogStats:
+    """Stats of one catalog task, or the sum of several"""
+
+    source: str = ""
+    tasks: int = 1
+    mosaics: int = 0
+    seconds: float = 0  # total time of the task(s)
+    # seconds spent in each of STAGES
+    stage_seconds: dict[str, float] = field(default_factory=dict)
+    # how often things happened, ex. "cache_hit", "not_knot.LINK"
+    counts: dict[str, int] = field(default_factory=dict)
+
+    def lap(self, stage: str, start: float) -> float:
+        """Adds the time since `start` to `stage`, returning the time now to start the next one"""
+        now = perf_counter()
+        self.stage_seconds[stage] = self.stage_seconds.get(stage, 0) + now - start
+        return now
+
+    def count(self, name: str, n: int = 1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def merge(self, other: "CatalogStats"):
+        self.tasks += other.tasks
+        self.mosaics += other.mosaics
+        self.seconds += other.seconds
+        for stage, secs in other.stage_seconds.items():
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0) + secs
+        for name, n in other.counts.items():
+            self.count(name, n)
+
+    def stages_str(self) -> str:
+        """Share of the time spent in each stage, ex. `build 12%, traverse 40%, ...`"""
+        total = sum(self.stage_seconds.values()) or 1
+        return ", ".join(
+            f"{stage} {self.stage_seconds[stage] / total:.0%}"
+            for stage in STAGES
+            if stage in self.stage_seconds
+        )
+
+    def counts_str(self) -> str:
+        return ", ".join(f"{n:,} {name}" for name, n in sorted(self.counts.items()))
+
+
+class StatsLog:
+    """Writes the stats of each task to a JSON lines file, and keeps their sum"""
+
+    def __init__(self, out: TextIO):
+        self.out = out
+        self.total = CatalogStats(tasks=0)
+        self.start_t = time()
+
+    def add(self, index: int, stats: CatalogStats):
+        self.out.write(json.dumps({"index": index, **asdict(stats)}) + "\n")
+        self.out.flush()
+        self.total.merge(stats)
+
+    def status_str(self) -> str:
+        """One line summing up every task so far"""
+        total = self.total
+        wall_t = time() - self.start_t
+        return (
+            f"[{total.tasks} tasks, {total.mosaics:,} mosaics, {total.mosaics / wall_t:,.0f}/s]"
+            + f" {total.stages_str()} | {total.counts_str()}"
+        )
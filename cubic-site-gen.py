@@ -24,9 +24,10 @@ from typing import Iterable, Iterator
 
 
 import mosaic_util as util
-import mosaic_vis as mvis
+from mosaic_render import RenderJob, render_images
 import mosaics as M
 from polynomial_standardization import HOMFLY, KnotIDDB
+from results_store import ResultStore
 import sage_funcs
 
 
@@ -244,25 +245,35 @@ def combine_results_cubic() -> Iterable[CubicResult]:
 
     polynomial_results: dict[ResKey, CubicResult] = {}
 
-    # Build list of folders and sizes
-    cubic_res_dirs: list[tuple[Path, int]] = [(util.results_dir("flat"), 1)]
+    # Build list of result types and sizes
+    cubic_res_types: list[tuple[str, str | None, int]] = [("flat", None, 1)]
     for c_type in cubics:
-        cubic_res_dirs.append((util.results_dir("cubic", c_type), int(c_type[0])))
+        cubic_res_types.append(("cubic", c_type, int(c_type[0])))
 
     # Returns the best result for each polynomial, at each size
     # Best defined as lowest face ct, then lowest tile ct.
     def result_iterator() -> Iterator[CubicResult]:
-        """Iterate through all (intermediate, data/cubic_res) cubic result files, for each type of cubic result.
+        """Iterate through all cubic results in the ResultStore, and the older result files
+        keyed by polynomial (data/cubic_res), for each type of cubic result.
         Yeilds a cubic result for each result item."""
-        for res_dir, face_ct in cubic_res_dirs:
-            print(f"Parsing {res_dir}...")
-
+        store = ResultStore()
+        for variant, c_type, face_ct in cubic_res_types:
+            print(f"Parsing {variant} {c_type or ''}...")
+            store.import_result_files(variant, c_type)
+            for res in store.iter_results(variant, c_type):
+                yield CubicResult.from_result(res, face_ct)
+
+            # these have no knot IDs, so they can't go in the ResultStore
+            res_dir = util.results_dir(variant, c_type)
+            if res_dir.is_dir():
+                print(f"Parsing {res_dir}, from before knot IDs were stored...")
             for file in res_dir.glob("*"):
                 results, complete = util.load_result_file(file, use_dep=True)
                 if not complete:
                     print(f"WARN: {file} is incomplete")
                 for res in results:
                     yield CubicResult.from_result(res, face_ct)
+        store.close()
 
     for res in result_iterator():
         res_key = ResKey(res.polynomial, res.size)
@@ -296,6 +307,7 @@ def main():
 
     # Build table of the ones we care about and gen images
     rows = []
+    jobs: list[RenderJob] = []
     for knot in needed_knotIDs:
         values: list[TableEntry | None] = []
         for col in range(1, 7):
@@ -306,17 +318,14 @@ def main():
 
             # build mosaic image
             img_file = images_dir / f"{knot}_N{res.size}.png"
-            print(f"generating image: {img_file}")
-            if res.face_ct == 1:
-                mosaic = M.NormMosaic.build_flat(res.mosaic_str)
-            else:
-                mosaic = M.NormMosaic.build_cubic(res.mosaic_str, True)
-            mvis.gen_png(mosaic, res.mosaic_str, knot, img_file)
+            variant = "flat" if res.face_ct == 1 else "cubic"
+            jobs.append(RenderJob(res.mosaic_str, variant, False, knot, img_file))
 
             # build table entry
             values.append(TableEntry(knot, res, res.face_ct, img_file))
 
         rows.append(KnotRow(knot, values))
+    render_images(jobs)
     # results table is now a list of the best knot result, for every knot at every size (that's been generated)
 
     generate_html(
@@ -0,0 +1,207 @@
+"""
+Computes HOMFLY-PT polynomials from PD codes without sage.
+
+Uses the skein relation v^-1 P(L+) - v P(L-) = z P(L0), with P(unknot) = 1,
+which matches sage's normalization="vz" and the KnotInfo tables.
+Each diagram is traversed from a base point. The first crossing met on its
+under strand is switched (and smoothed for the L0 term), until the diagram is
+descending, which makes it an unlink.
+"""
+
+import functools
+
+from polynomial_standardization import HOMFLY, LaurentPoly
+
+# Above this many crossings (after removing kinks and bigons), leave it to sage.
+# Worst case is exponential, but 16 crossings still takes well under 0.1s
+MAX_NATIVE_CROSSINGS = 16
+
+# (sign, under in, under out, over in, over out), the ints are edge labels
+Crossing = tuple[int, int, int, int, int]
+
+
+def homfly_from_pd(
+    pd_codes: list[list[int]], max_crossings: int = MAX_NATIVE_CROSSINGS
+) -> HOMFLY | None:
+    """HOMFLY polynomial of the knot with these PD codes.
+    Returns None if the diagram has more than `max_crossings` crossings after
+    removing kinks and bigons, as this gets exponentially slower."""
+    # empty PD codes are the unknot
+    loops = 0 if pd_codes else 1
+    crossings, loops = _normalize(_from_pd_codes(pd_codes), loops)
+    if len(crossings) > max_crossings:
+        return None
+    return HOMFLY.from_poly(_evaluate(crossings, loops))
+
+
+def reduced_crossing_count(pd_codes: list[list[int]]) -> int:
+    """Number of crossings once all kinks and bigons are removed"""
+    crossings, _ = _normalize(_from_pd_codes(pd_codes), 0)
+    return len(crossings)
+
+
+def _from_pd_codes(pd_codes: list[list[int]]) -> list[Crossing]:
+    """PD codes start at the incoming under strand, and go counterclockwise"""
+    n_edges = 2 * len(pd_codes)
+    crossings = []
+    for a, b, c, d in pd_codes:
+        # over strand goes from d to b
+        if (b - d) % n_edges == 1:
+            crossings.append((1, a, c, d, b))
+        else:
+            crossings.append((-1, a, c, b, d))
+    return crossings
+
+
+def _normalize(crossings: list[Crossing], loops: int) -> tuple[tuple[Crossing, ...], int]:
+    """Removes kinks and bigons, then relabels edges in the order they are traversed.
+    Components are traversed one after another, so a diagram's traversal order
+    is just its edge labels in increasing order."""
+    # Reidemeister I and II moves, HOMFLY doesn't change
+    while (removed := _remove_kink(crossings)) or (removed := _remove_bigon(crossings)):
+        crossings, new_loops = removed
+        loops += new_loops
+
+    # where each edge goes to next, following its strand through the crossing
+    next_edge: dict[int, int] = {}
+    for _, ui, uo, oi, oo in crossings:
+        next_edge[ui] = uo
+        next_edge[oi] = oo
+    labels: dict[int, int] = {}
+    for start in sorted(next_edge):
+        edge = start
+        while edge not in labels:
+            labels[edge] = len(labels)
+            edge = next_edge[edge]
+    return tuple(sorted(_rename(crossings, labels))), loops
+
+
+def _remove_kink(crossings: list[Crossing]) -> tuple[list[Crossing], int] | None:
+    """Removes the first crossing whose strand loops straight back into it.
+    Returns the crossings left and # of loops created, or None if there are no kinks"""
+    for i, (_, ui, uo, oi, oo) in enumerate(crossings):
+        if uo == oi:
+            keep_in, keep_out = ui, oo
+        elif oo == ui:
+            keep_in, keep_out = oi, uo
+        else:
+            continue
+        return _join(crossings[:i] + crossings[i + 1 :], keep_in, keep_out)
+    return None
+
+
+def _remove_bigon(crossings: list[Crossing]) -> tuple[list[Crossing], int] | None:
+    """Removes the first pair of crossings where one strand passes over another and
+    straight back. Returns the crossings left and # of loops created, or None if there are none"""
+    # crossing each strand enters on the over strand
+    over_in = {oi: j for j, (_, _, _, oi, _) in enumerate(crossings)}
+    for i, (sign, ui, uo, oi, oo) in enumerate(crossings):
+        # the over strand leaves this crossing, and goes straight over the next one
+        j = over_in.get(oo, i)
+        sign_j, ui_j, uo_j, _, oo_j = crossings[j]
+        if j == i or sign_j == sign:
+            continue
+        # the under strand runs alongside, one way or the other
+        if uo == ui_j:
+            under_in, under_out = ui, uo_j
+        elif uo_j == ui:
+            under_in, under_out = ui_j, uo
+        else:
+            continue
+        rest = [c for k, c in enumerate(crossings) if k != i and k != j]
+        rest, loops = _join(rest, oi, oo_j)
+        if not loops:
+            # the under strand may carry on from the over strand, through the renamed edge
+            under_in, under_out = (oi if e == oo_j else e for e in (under_in, under_out))
+        rest, under_loops = _join(rest, under_in, under_out)
+        return rest, loops + under_loops
+    return None
+
+
+def _join(crossings: list[Crossing], edge_in: int, edge_out: int) -> tuple[list[Crossing], int]:
+    """Joins two ends of a strand whose crossings were removed.
+    Returns the crossings, and 1 if that closed it into a loop"""
+    if edge_in == edge_out:
+        return crossings, 1
+    return _rename(crossings, {edge_out: edge_in}), 0
+
+
+def _rename(crossings: list[Crossing], names: dict[int, int]) -> list[Crossing]:
+    return [
+        (s, *(names.get(e, e) for e in edges))  # type: ignore
+        for s, *edges in crossings
+    ]
+
+
+def _smooth(crossings: tuple[Crossing, ...], index: int) -> tuple[list[Crossing], int]:
+    """Oriented smoothing of one crossing. Returns the crossings, and # of loops created"""
+    _, ui, uo, oi, oo = crossings[index]
+    rest = list(crossings[:index] + crossings[index + 1 :])
+    # joining the under-in to over-out, and over-in to under-out edges
+    parent: dict[int, int] = {}
+
+    def find(e: int) -> int:
+        while e in parent:
+            e = parent[e]
+        return e
+
+    loops = 0
+    for e_in, e_out in ((ui, oo), (oi, uo)):
+        e_in, e_out = find(e_in), find(e_out)
+        if e_in == e_out:
+            loops += 1
+        else:
+            parent[e_out] = e_in
+    return _rename(rest, {e: find(e) for e in parent}), loops
+
+
+@functools.lru_cache(maxsize=50_000)
+def _evaluate(crossings: tuple[Crossing, ...], loops: int) -> LaurentPoly:
+    """HOMFLY of a normalized diagram, plus `loops` unlinked unknots"""
+    # which crossing each edge runs into, and whether it's on the under strand
+    heads: dict[int, tuple[int, bool]] = {}
+    for i, (_, ui, _, oi, _) in enumerate(crossings):
+        heads[ui] = (i, True)
+        heads[oi] = (i, False)
+
+    seen: set[int] = set()
+    components = 0
+    for edge in range(len(heads)):
+        # labels follow traversal order, so a new component starts whenever
+        # the previous edge didn't lead to this one
+        if edge == 0 or _next_edge(crossings, heads, edge - 1) != edge:
+            components += 1
+        index, under = heads[edge]
+        if index in seen:
+            continue
+        seen.add(index)
+        if not under:
+            continue
+        # first visit is on the under strand, use the skein relation here
+        sign, ui, uo, oi, oo = crossings[index]
+        switched = list(crossings)
+        switched[index] = (-sign, oi, oo, ui, uo)
+        switched_p = _evaluate(tuple(sorted(switched)), loops)
+        smoothed, new_loops = _smooth(crossings, index)
+        smoothed_p = _evaluate(*_normalize(smoothed, loops + new_loops))
+        if sign > 0:
+            # P(L+) = v^2 P(L-) + v z P(L0)
+            return switched_p.shift(1, 2, 0) + smoothed_p.shift(1, 1, 1)
+        # P(L-) = v^-2 P(L+) - v^-1 z P(L0)
+        return switched_p.shift(1, -2, 0) + smoothed_p.shift(-1, -1, 1)
+
+    # descending diagrams are unlinks
+    return _unlink(components + loops)
+
+
+def _next_edge(
+    crossings: tuple[Crossing, ...], heads: dict[int, tuple[int, bool]], edge: int
+) -> int:
+    index, under = heads[edge]
+    return crossings[index][2] if under else crossings[index][4]
+
+
+@functools.cache
+def _unlink(components: int) -> LaurentPoly:
+    """HOMFLY of an unlink, ((v^-1 - v) / z)^(n-1)"""
+    return LaurentPoly.parse("(v^-1 - v) * z^-1") ** (components - 1)
@@ -1,16 +1,38 @@
 #! /usr/bin/env python
 from concurrent.futures import Future, ProcessPoolExecutor
+import itertools
 from multiprocessing import current_process
 from pathlib import Path
+import shlex
+import subprocess
+import sys
 import threading
-from time import sleep, time
-from typing import Callable
+from time import perf_counter, sleep, time
+from typing import Callable, Iterable, Iterator
 
 import mosaics as M
 import mosaic_vis as mvis
 import mosaic_util as util
 import polynomial_standardization as poly
 import arg_parsing
+import homfly
+from catalog_stats import CatalogStats, StatsLog
+from mosaic_render import RenderJob, render_images
+from pd_cache import CachedKnot, PDCodeCache
+from results_store import ResultStore, ResultTask
+from worker_pool import PersistentPool, TaskResult
+
+# number of mosaics traversed at once by catalog_files
+TRAVERSE_BATCH_LEN = 4096
+
+# mosaic-gen's subcommand for each type of mosaic
+GEN_VARIANTS = {
+    "flat": "flat",
+    "cyl": "cylindrical",
+    "toric": "toric",
+    "mobius": "mobius",
+    "cubic": "cubic",
+}
 
 
 def main():
@@ -21,7 +43,14 @@ def main():
 
 def handle_file(args):
     # raise NotImplementedError("Implement for multi-type input")
-    catalog_files([args.input_file], args.output_file, M.parser_types[args.type],skip_sage=args.no_sage)
+    mosaic_type = args.type
+    if mosaic_type is None:
+        if not util.is_packed_file(args.input_file):
+            print("ERR: type is required for text mosaic files")
+            return
+        # packed files record their own variant
+        mosaic_type = util.read_packed_header(args.input_file).variant
+    catalog_files([args.input_file], args.output_file, M.parser_types[mosaic_type],skip_sage=args.no_sage, homfly_mode=args.homfly)
 
 
 def run_catalog(args):
@@ -30,8 +59,6 @@ def run_catalog(args):
     builder: Callable[[str], M.NormMosaic] = M.parser_types[type]
 
     inp_dir = util.mosaic_dir(type, size, args.cubic_version)
-    out_dir = util.results_dir_knotID(type, args.cubic_version)
-    out_dir.mkdir(parents=True, exist_ok=True)
 
     if not inp_dir.is_dir() or len(list(inp_dir.iterdir())) == 0:
         print(f"ERR: no mosaics to process for {inp_dir}")
@@ -41,23 +68,41 @@ def run_catalog(args):
         print("run with --ignore-incomplete to proceed anyway")
         return
 
-    # Thread to wait for user input without blocking main tasks
-    stop_event = threading.Event()  # will be set by keypress thread
-    if not args.no_clean_exit:
+    stop_event = watch_for_stop(args)
 
-        def wait_for_key():
-            input()
-            print("stopping...", flush=True)
-            stop_event.set()
-
-        print("Press Enter to stop submitting new tasks...\n")
-        key_thread = threading.Thread(target=wait_for_key, daemon=True)
-        key_thread.start()
+    # build the packed KnotIDDB once here, rather than in every worker
+    poly.load_knot_db()
 
     print(f"Parsing from {inp_dir}", flush=True)
-    inp_index = 0
-    out_index = 0
-    exit_flag = False
+    done = finished_tasks(type, args.cubic_version) if keep_existing_results else set()
+    tasks = iter_catalog_tasks(inp_dir, type, args.cubic_version, size, done)
+    metrics_path = util.catalog_metrics_path(type, size, args.cubic_version)
+    with metrics_path.open("a") as metrics:
+        stats_log = StatsLog(metrics)
+        if args.persistent:
+            run_persistent(tasks, builder, args, stop_event, stats_log)
+        else:
+            run_pool(tasks, builder, args, stop_event, stats_log)
+
+
+def run_pool(
+    tasks: Iterator[tuple[int, list[Path], ResultTask]],
+    builder: Callable[[str], M.NormMosaic],
+    args,
+    stop_event: threading.Event,
+    stats_log: StatsLog,
+):
+    """Runs tasks on a ProcessPoolExecutor, restarting workers every few tasks"""
+
+    def on_done(ind: int, res: Future):
+        if res.exception():
+            print(f"RESULT {ind} FAILS", flush=True)
+            return
+        if args.verbose:
+            print(f"Result {ind} done", flush=True)
+        stats_log.add(ind, res.result())
+        print(stats_log.status_str(), flush=True)
+
     max_queue = 8
     futures: dict[Future, int] = {}
     # spawning workers to parse files
@@ -71,40 +116,20 @@ def run_catalog(args):
             if done:
                 print(f"Oldest running file: #{min_ind}", flush=True)
             for res in done:
-                ind = futures.pop(res)
-                exp = res.exception()
-                if exp:
-                    print(f"RESULT {ind} FAILS", flush=True)
-                elif args.verbose:
-                    print(f"Result {ind} done", flush=True)
+                on_done(futures.pop(res), res)
 
             # Queueing new files
             if len(futures) < max_queue:
-                in_paths: list[Path] = []
-                # taking 3 files as input for each
-                for _ in range(3):
-                    if (f := inp_dir / f"pt{inp_index:04}.txt").is_file():
-                        in_paths.append(f)
-                        inp_index += 1
-                    else:
-                        exit_flag = True
-
-                out_path = out_dir / f"{size}_pt{out_index:04}.txt"
-                out_index += 1
-                # if output is already generated:
-                if out_path.is_file() and keep_existing_results:
-                    continue
-                # if we're done all the files in the folder, exit
+                # stops loop when out of inputs
+                if (task := next(tasks, None)) is None:
+                    break
+                out_index, in_paths, out_task = task
                 if args.verbose:
                     print(f"Queued {",".join(f.stem for f in in_paths)}", flush=True)
                 fut = executor.submit(
-                    catalog_files, in_paths, out_path, builder, args.no_sage
+                    catalog_files, in_paths, out_task, builder, args.no_sage, args.homfly
                 )
-                futures[fut] = out_index - 1
-
-                # stops loop when out of inputs
-                if exit_flag:
-                    break
+                futures[fut] = out_index
             else:
                 sleep(1)
 
@@ -114,117 +139,493 @@ def run_catalog(args):
             for fut, i in futures.items()
         ]
         executor.shutdown(wait=True, cancel_futures=False)
+        [on_done(i, fut) for fut, i in futures.items()]
         print("fully shutdown now")
 
 
+def watch_for_stop(args) -> threading.Event:
+    """Thread to wait for user input without blocking main tasks"""
+    stop_event = threading.Event()  # will be set by keypress thread
+    if not args.no_clean_exit:
+
+        def wait_for_key():
+            input()
+            print("stopping...", flush=True)
+            stop_event.set()
+
+        print("Press Enter to stop submitting new tasks...\n")
+        key_thread = threading.Thread(target=wait_for_key, daemon=True)
+        key_thread.start()
+    return stop_event
+
+
+def finished_tasks(variant: str, cubic_type: str | None) -> set[str]:
+    """Names of the tasks that already have results"""
+    store = ResultStore()
+    names = store.task_names(variant, cubic_type)
+    store.close()
+    return names
+
+
+def result_task(variant: str, cubic_type: str | None, size: int, index: int) -> ResultTask:
+    return ResultTask(variant, cubic_type, f"{size}_pt{index:04}")
+
+
+def iter_catalog_tasks(
+    inp_dir: Path, variant: str, cubic_type: str | None, size: int, done: set[str]
+) -> Iterator[tuple[int, list[Path], ResultTask]]:
+    """Groups the input files into tasks of (output index, input files, result task),
+    skipping tasks in `done`"""
+    inp_index = 0
+    out_index = 0
+    exit_flag = False
+    while not exit_flag:
+        in_paths: list[Path] = []
+        # taking 3 files as input for each
+        for _ in range(3):
+            if (f := util.mosaic_file(inp_dir, inp_index)) is not None:
+                in_paths.append(f)
+                inp_index += 1
+            else:
+                exit_flag = True
+
+        out_task = result_task(variant, cubic_type, size, out_index)
+        out_index += 1
+        # if output is already generated:
+        if out_task.name in done:
+            continue
+        yield out_index - 1, in_paths, out_task
+
+
+def run_stream(args):
+    """Catalogs mosaics while mosaic-gen generates them, without saving them to files.
+    The stream is cut into chunks that are numbered like the file groups of `parse`,
+    so with the default sizes both give the same results"""
+    builder: Callable[[str], M.NormMosaic] = M.parser_types[args.type]
+    if args.type == "cubic" and args.cubic_version is None:
+        print("ERR: cubic mosaics need a --cubic-version")
+        return
+
+    manifest_path = util.stream_manifest_path(args.type, args.size, args.cubic_version)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    done = finished_tasks(args.type, args.cubic_version)
+
+    def out_task(index: int) -> ResultTask:
+        return result_task(args.type, args.cubic_version, args.size, index)
+
+    # the first mosaic of each chunk from previous runs
+    chunk_starts: dict[int, str] = {}
+    if args.keep_existing and manifest_path.is_file():
+        with manifest_path.open() as f:
+            chunk_len = int(f.readline().removeprefix("chunk_len"))
+            if chunk_len != args.chunk_len:
+                print(f"ERR: previous stream used --chunk-len {chunk_len}")
+                return
+            for line in f:
+                index, mosaic_str = line.split()
+                chunk_starts[int(index)] = mosaic_str
+    else:
+        manifest_path.write_text(f"chunk_len {args.chunk_len}\n")
+
+    if args.input is None:
+        # restart from the last chunk start at or before the first missing result
+        first_missing = next(i for i in itertools.count() if out_task(i).name not in done)
+        start_index = max((i for i in chunk_starts if i <= first_missing), default=0)
+        cmd = [args.generator, "--stdout", "--max-lines", str(args.chunk_len)]
+        if args.packed:
+            cmd.append("--packed")
+        if start_index in chunk_starts:
+            print(f"Resuming from chunk {start_index}", flush=True)
+            cmd += ["--start-at", chunk_starts[start_index]]
+        cmd += shlex.split(args.gen_args)
+        cmd += [str(args.size), GEN_VARIANTS[args.type]]
+        if args.type == "cubic":
+            cmd.append(args.cubic_version)
+        # the generator's progress goes to stderr, which is shared with ours
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        stream = proc.stdout
+        assert stream is not None
+        print(f"Parsing from {" ".join(cmd)}", flush=True)
+    else:
+        # an outside stream can't be restarted part way, so finished chunks are just skipped
+        start_index = 0
+        proc = None
+        if args.input == "-":
+            stream = sys.stdin.buffer
+            # stdin is taken, so there's no keypress to stop with
+            args.no_clean_exit = True
+        else:
+            stream = open(args.input, "rb")
+        print(f"Parsing from {args.input}", flush=True)
+
+    stop_event = watch_for_stop(args)
+    # build the packed KnotIDDB once here, rather than in every worker
+    poly.load_knot_db()
+
+    tasks = iter_stream_tasks(
+        util.read_stream_chunks(stream, args.chunk_len),
+        start_index,
+        out_task,
+        done if args.keep_existing else set(),
+        manifest_path,
+        chunk_starts,
+        args,
+        proc,
+    )
+    metrics_path = util.catalog_metrics_path(args.type, args.size, args.cubic_version)
+    try:
+        with metrics_path.open("a") as metrics:
+            run_persistent(tasks, builder, args, stop_event, StatsLog(metrics))
+    finally:
+        tasks.close()
+        if proc is not None:
+            # still running if we stopped early
+            proc.terminate()
+            proc.wait()
+        stream.close()
+
+
+def iter_stream_tasks(
+    chunks: Iterator[util.MosaicChunk],
+    start_index: int,
+    out_task: Callable[[int], ResultTask],
+    done: set[str],
+    manifest_path: Path,
+    chunk_starts: dict[int, str],
+    args,
+    proc: subprocess.Popen | None,
+) -> Iterator[tuple[int, util.MosaicChunk, ResultTask]]:
+    """Numbers the chunks of a stream, recording where each one starts.
+    Chunks whose tasks are in `done` are skipped"""
+    index = start_index
+    with manifest_path.open("a") as manifest:
+        for index, chunk in enumerate(chunks, start_index):
+            # if the generator failed, its last chunk is missing mosaics
+            if len(chunk) < args.chunk_len and proc is not None and proc.wait() != 0:
+                break
+            if index not in chunk_starts:
+                manifest.write(f"{index} {chunk.first()}\n")
+                manifest.flush()
+            # if output is already generated:
+            if out_task(index).name in done:
+                continue
+            yield index, chunk, out_task(index)
+    if proc is not None and proc.wait() != 0:
+        print(f"ERR: mosaic-gen exited with code {proc.returncode}", flush=True)
+    else:
+        print(f"Stream finished after chunk {index}", flush=True)
+
+
+def run_persistent(
+    tasks: Iterator[tuple[int, list[Path] | util.MosaicChunk, ResultTask]],
+    builder: Callable[[str], M.NormMosaic],
+    args,
+    stop_event: threading.Event,
+    stats_log: StatsLog,
+):
+    """Runs tasks on long-lived workers, which load sage, the KnotIDDB and the PD cache once"""
+
+    def on_done(res: TaskResult):
+        if res.error:
+            print(f"RESULT {res.index} FAILS\n{res.error}", flush=True)
+        else:
+            if args.verbose:
+                print(f"Result {res.index} done ({res.rss_mb:.0f}MB)", flush=True)
+            stats_log.add(res.index, res.value)
+            print(stats_log.status_str(), flush=True)
+        if res.recycled:
+            print(f"Restarting {res.worker}, using {res.rss_mb:.0f}MB", flush=True)
+        print(f"Oldest running file: #{pool.oldest_pending()}", flush=True)
+
+    pool = PersistentPool(
+        args.workers,
+        _init_catalog_worker,
+        _catalog_task,
+        on_done,
+        max_rss_mb=args.max_worker_rss,
+    )
+    for out_index, source, out_task in tasks:
+        if stop_event.is_set():
+            break
+        if args.verbose:
+            print(f"Queued {_source_name(source, out_task)}", flush=True)
+        # blocks until there's room in the queue
+        pool.submit(out_index, source, out_task, builder, args.no_sage, args.homfly)
+
+    print("waiting for current workers to finish...", flush=True)
+    pool.close()
+    print("fully shutdown now")
+
+
+def _init_catalog_worker() -> PDCodeCache:
+    """Loads everything catalog_files needs, once per persistent worker"""
+    knot_db = poly.load_knot_db()
+    try:
+        # importing sage takes a while, so get it out of the way
+        import sage_funcs  # noqa: F401
+    except ImportError:
+        pass
+    return PDCodeCache(knot_db.digest)
+
+
+def _catalog_task(
+    pd_code_cache: PDCodeCache,
+    source: list[Path] | util.MosaicChunk,
+    out: ResultTask,
+    *args,
+) -> CatalogStats:
+    if isinstance(source, util.MosaicChunk):
+        return catalog_mosaics(
+            source.iter_strs(),
+            _source_name(source, out),
+            out,
+            *args,
+            pd_code_cache=pd_code_cache,
+        )
+    return catalog_files(source, out, *args, pd_code_cache=pd_code_cache)
+
+
+def _source_name(source: list[Path] | util.MosaicChunk, out: Path | ResultTask) -> str:
+    if isinstance(source, util.MosaicChunk):
+        return f"chunk {out.name if isinstance(out, ResultTask) else out.stem}"
+    return ", ".join(f.stem for f in source)
+
+
 def catalog_files(
-    in_files: list[Path], out_file: Path, builder: Callable, skip_sage: bool = False
+    in_files: list[Path],
+    out: Path | ResultTask,
+    builder: Callable,
+    skip_sage: bool = False,
+    homfly_mode: str = "native",
+    pd_code_cache: PDCodeCache | None = None,
+    knot_db: poly.PackedKnotIDDB | None = None,
 ):
-    """Finds all unique knots in a set of files"""
+    """Finds all unique knots in a set of files, returning the stats of each stage.
+    The results are saved to the ResultStore, or written to a text file if `out` is a path.
+    A PD code cache can be passed in to be reused between calls, and a KnotIDDB
+    to use instead of the one at `util.knot_db_path`"""
+
+    # Define an flattened iterator over mosaic strings
+    def iter_lines():
+        for f_name in in_files:
+            yield from util.iter_mosaic_strs(f_name)
+
+    return catalog_mosaics(
+        iter_lines(),
+        _source_name(in_files, out),
+        out,
+        builder,
+        skip_sage,
+        homfly_mode,
+        pd_code_cache,
+        knot_db,
+    )
 
-    from sage_funcs import make_knot
+
+def catalog_mosaics(
+    mosaic_strs: Iterable[str],
+    source_name: str,
+    out: Path | ResultTask,
+    builder: Callable,
+    skip_sage: bool = False,
+    homfly_mode: str = "native",
+    pd_code_cache: PDCodeCache | None = None,
+    knot_db: poly.PackedKnotIDDB | None = None,
+) -> CatalogStats:
+    """Finds all unique knots among some mosaics, saving them to the ResultStore,
+    or writing them to a text file if `out` is a path.
+    Returns the counts and times of each stage"""
 
     # maps knotID to a result object
     knot_res_byID: dict[str, util.KnotResult] = {}
 
     # maps polynomials to their knotID(s)
     # Contains all prime knots thru size 13, we don't care about above that
-    knotID_DB = poly.KnotIDDB.load_from_file(Path("data/knotIDDB.pkl"))
+    knotID_DB = poly.load_knot_db() if knot_db is None else knot_db
 
-    # dict Cache mapping all seen PD codes to their knotID.
+    # Cache mapping all seen PD codes to their knotID, shared with other workers/runs.
     # All knots with the same PD codes are the same knot.
-    pd_code_cache: dict[str, str] = {}
+    own_cache = pd_code_cache is None
+    if pd_code_cache is None:
+        pd_code_cache = PDCodeCache(knotID_DB.digest)
     # list of mosaics with bad connections
     bad_mosaics: list[str] = []
+    stats = CatalogStats(source_name)
 
-    # iterating over each line in each file in the dir
-    in_files_str = ", ".join(f.stem for f in in_files)
     print(
-        f"Starting {in_files_str} on {current_process().name}",
+        f"Starting {source_name} on {current_process().name}",
         flush=True,
     )
 
-    # Define an flattened iterator over mosaic strings
-    def iter_lines():
-        for f_name in in_files:
-            with f_name.open("r") as f:
-                for mosaic_str in f:
-                    yield mosaic_str
+    # Build mosaics from strings, traversing them in batches.
+    # Yields the mosaic's size and tile count, if already known
+    def iter_traversed():
+        for batch in itertools.batched(mosaic_strs, TRAVERSE_BATCH_LEN):
+            t = perf_counter()
+            # lines from `mosaic-gen --pd` hold knots that are already traversed
+            if " " in batch[0]:
+                parsed = [util.parse_pd_line(line) for line in batch]
+                stats.lap("parse_pd", t)
+                for mosaic_str, tile_ct, pd_codes in parsed:
+                    yield mosaic_str, util.nominal_size(mosaic_str), tile_ct, pd_codes
+                continue
+            mosaics: list[M.NormMosaic] = [builder(mosaic_str) for mosaic_str in batch]
+            t = stats.lap("build", t)
+            pd_codes = M.traverse_mosaics(mosaics, prune_unknots=False)
+            stats.lap("traverse", t)
+            for mosaic_str, mosaic, codes in zip(batch, mosaics, pd_codes):
+                yield mosaic_str, mosaic.nominal_size, None, codes
 
     # keep track of how many we've parsed
     line_ct = 0
+    # knots with a cached PD code, and those skipped as they can't beat the best result
+    cached_ct = 0
+    worse_ct = 0
     start_t = time()
-    for mosaic_str in iter_lines():
+    for mosaic_str, nominal_size, tile_ct, pd_codes in iter_traversed():
         line_ct += 1
 
-        # Build mosaic from string
-        mosaic_str = mosaic_str.strip()
-        mosaic: M.NormMosaic = builder(mosaic_str)
-        pd_codes = M.traverse_mosaic(mosaic, prune_unknots=False)
-        pd_codes_str = str(pd_codes)
-
         # discard non-knot mosaics
         if type(pd_codes) is M.NotAKnot:
+            stats.count(f"not_knot.{pd_codes.name}")
             match pd_codes:
                 case M.NotAKnot.BAD_CONNECTIONS:
-                    bad_mosaics.append(f"{pd_codes_str}, {mosaic_str}\n")
+                    bad_mosaics.append(f"{pd_codes}, {mosaic_str}\n")
             continue
 
         # If this PD code has been seen before, we already know the polynomial
-        knotID = pd_code_cache.get(pd_codes_str)
-        if knotID is None:
+        t = perf_counter()
+        cached = pd_code_cache.get(pd_codes)  # type: ignore
+        t = stats.lap("cache", t)
+        if cached is not None:
+            cached_ct += 1
+        else:
             # If there's no cached polynomial, calculate it
-            knot = make_knot(pd_codes)  # type: ignore
-            polynomial = poly.HOMFLY.from_knot(knot)
+            polynomial, max_crossings = compute_homfly(pd_codes, homfly_mode, stats)  # type: ignore
+            t = perf_counter()
             knotIDs = knotID_DB.lookup(polynomial)
+            t = stats.lap("db_lookup", t)
 
             if knotIDs is None:
                 # No entries in DB, so it's composite or >13 crossings
-                continue
+                knotID = None
             elif len(knotIDs) == 1:
                 # This polynomial can only be one knot
                 # TODO: Technically it could be a >13 crossing knot that collides
                 # with a low-crossing knot. No great way to filter for this
                 knotID = knotIDs[0]
             else:
-                knotID = disambiguate_knot(knotIDs, knot,skip_sage=skip_sage)
+                knotID = disambiguate_knot(
+                    knotIDs, pd_codes, max_crossings, skip_sage=skip_sage  # type: ignore
+                )
+                t = stats.lap("disambiguate", t)
             # cache this pd->knotID relation
-            pd_code_cache[pd_codes_str] = knotID
+            cached = CachedKnot(knotID, str(polynomial))
+            pd_code_cache.put(pd_codes, cached)  # type: ignore
+            t = stats.lap("cache", t)
+        if cached.knotID is None:
+            continue
+        knotID = cached.knotID
+
+        if tile_ct is None:
+            tile_ct = util.count_tiles(mosaic_str)
+        # A larger size or tile count can't be better, see `KnotResult.better_than`.
+        # Most knots are repeats, so this skips building and comparing their results
+        prev_best_res = knot_res_byID.get(knotID)
+        if prev_best_res is not None and (prev_best_res.size, prev_best_res.tile_ct) < (
+            nominal_size,
+            tile_ct,
+        ):
+            worse_ct += 1
+            stats.lap("compare", t)
+            continue
 
         # Build the new knot result
-        tile_ct = util.count_tiles(mosaic_str)
         new_res = util.KnotResult(
-            mosaic.nominal_size, mosaic_str, tile_ct, str(polynomial), knotID
+            nominal_size, mosaic_str, tile_ct, cached.polynomial, knotID
         )
         # replace the result for this knot if the new one is better
-        prev_best_res = knot_res_byID.get(knotID)
         if new_res.better_than(prev_best_res):
             knot_res_byID[knotID] = new_res
+        stats.lap("compare", t)
     d_time = time() - start_t
+    stats.mosaics = line_ct
+    stats.seconds = d_time
+    stats.count("cached", cached_ct)
+    stats.count("worse", worse_ct)
+    stats.count("knots", len(knot_res_byID))
+    if own_cache:
+        pd_code_cache.close()
+    else:
+        pd_code_cache.flush()
 
     # Warn about bad mosaics
     if len(bad_mosaics):
-        print(f"WARN: Bad Mosaics in {in_files_str}", flush=True)
+        print(f"WARN: Bad Mosaics in {source_name}", flush=True)
         [print(mos) for mos in bad_mosaics]
 
-    # write results to file
-    with out_file.open("w") as out:
-        lines = [(r.to_str() + "\n") for r in knot_res_byID.values()]
-        out.writelines(lines)
-        out.write("END_RESULT")  # confirms that result was not interrupted
+    # save results, in one transaction so an interrupted task saves nothing
+    if isinstance(out, ResultTask):
+        store = ResultStore()
+        store.save(out, knot_res_byID.values())
+        store.close()
+    else:
+        with out.open("w") as f:
+            lines = [(r.to_str() + "\n") for r in knot_res_byID.values()]
+            f.writelines(lines)
+            f.write("END_RESULT")  # confirms that result was not interrupted
 
     # print result to console
     print(
-        f"Parsed {line_ct:,} from {in_files_str} in {d_time:.0f}s"
-        + f" ({line_ct/d_time:.0f} lines/s)",
+        f"Parsed {line_ct:,} from {source_name} in {d_time:.0f}s"
+        + f" ({line_ct/d_time:.0f} lines/s)\n - {pd_code_cache.stats_str()}"
+        + f"\n - {cached_ct:,} cached knots, {worse_ct:,} skipped by size and tile count"
+        + f"\n - time in {stats.stages_str()}",
         flush=True,
     )
+    return stats
+
+
+def compute_homfly(
+    pd_codes: list[list[int]],
+    homfly_mode: str = "native",
+    stats: CatalogStats | None = None,
+) -> tuple[poly.HOMFLY, int]:
+    """Returns the HOMFLY polynomial, and the number of crossings of the simplified knot.
+    Small knots are computed natively, sage is used for large ones or if asked for.
+    In "check" mode, both are computed and any mismatch is reported.
+    The time taken is added to `stats`, if given"""
+    stats = stats or CatalogStats()
+    t = perf_counter()
+    native = None
+    if homfly_mode != "sage":
+        native = homfly.homfly_from_pd(pd_codes)
+        if native is not None and homfly_mode == "native":
+            max_crossings = homfly.reduced_crossing_count(pd_codes)
+            stats.lap("homfly", t)
+            return native, max_crossings
+        t = stats.lap("homfly", t)
 
+    from sage_funcs import make_knot
 
-def disambiguate_knot(knotIDs: tuple[str, ...], knot, skip_sage: bool = False) -> str:
-    # number of crossings of the simplified knot
+    knot = make_knot(pd_codes)
+    t = stats.lap("sage_simplify", t)
+    polynomial = poly.HOMFLY.from_knot(knot)
+    stats.lap("homfly", t)
+    stats.count("sage_homfly")
+    if native is not None and native != polynomial:
+        print(f"HOMFLY MISMATCH: native {native}, sage {polynomial}, for {pd_codes}", flush=True)
+    return polynomial, len(knot.pd_code())
+
+
+def disambiguate_knot(
+    knotIDs: tuple[str, ...],
+    pd_codes: list[list[int]],
+    max_crossings: int,
+    skip_sage: bool = False,
+) -> str:
+    # max_crossings is the number of crossings of the simplified knot
     # may still be > the minimum-crossing-number
-    max_crossings = len(knot.pd_code())
     valid = [id for id in knotIDs if util.knot_order_from_id(id) <= max_crossings]
     if len(valid) == 1:
         return valid[0]
@@ -232,10 +633,17 @@ def disambiguate_knot(knotIDs: tuple[str, ...], knot, skip_sage: bool = False) -
     if skip_sage:
         return ",".join(valid)
 
+    from sage_funcs import get_knotinfo_with_timeout, make_knot
+
+    # sage's simplification can find fewer crossings, which may be enough to tell them apart
+    knot = make_knot(pd_codes)
+    sage_crossings = len(knot.pd_code())
+    valid = [id for id in valid if util.knot_order_from_id(id) <= sage_crossings]
+    if len(valid) == 1:
+        return valid[0]
+
     print(f"Using sage to disambiguate: {",".join(valid)}", flush=True)
     # this can be *VERY* slow for some knots. Times out after 60 seconds
-    from sage_funcs import get_knotinfo_with_timeout
-
     knot_info = get_knotinfo_with_timeout(knot, 30)
     if knot_info is None:
         print(f"DISAMBIGUATION_FAILED, Timeout-{",".join(valid)}", flush=True)
@@ -259,62 +667,51 @@ def disambiguate_knot(knotIDs: tuple[str, ...], knot, skip_sage: bool = False) -
 
 
 def combine_results(args):
-    """Takes a dir of knot results and combines them, selecting the lowest tile # for each knot"""
+    """Combines the results of every task, selecting the lowest tile # for each knot.
+    Result files from before the ResultStore are imported into it first"""
     from natsort import natsorted
 
     mosaic_type = args.type
-    builder = M.parser_types[args.type]
+    store = ResultStore()
+    store.import_result_files(mosaic_type, args.cubic_version)
     # check that there are results to merge
-    results_folder = util.results_dir_knotID(mosaic_type, args.cubic_version)
-    if not results_folder.is_dir() or len(list(results_folder.iterdir())) == 0:
-        print(f"ERR: no results to merge for {results_folder}")
+    if not store.task_names(mosaic_type, args.cubic_version):
+        print(f"ERR: no results to merge for {mosaic_type} {args.cubic_version or ''}")
+        store.close()
         return
 
     # initialize output folders
     imgs_dir = util.img_dir(mosaic_type, args.cubic_version)
     out_file = util.output_path(mosaic_type, args.cubic_version)
-    # mapping from mosaic to knotID
-    if imgs_dir.exists():
-        [f.unlink() for f in imgs_dir.iterdir()]
-    else:
-        imgs_dir.mkdir(parents=True)
+    imgs_dir.mkdir(parents=True, exist_ok=True)
 
-    # maps knotID to knot result
-    all_results: dict[str, util.KnotResult] = {}
-
-    # merge results, keeping lowest tile number
+    # the store keeps the lowest tile number for each knot
     print("Merging results...")
-    for file in results_folder.iterdir():
-        results_list, complete = util.load_result_file(file)
-        if not complete:
-            print(f"{file} is incomplete")
-        for res in results_list:
-            # Only keep the better knot result
-            prev_best = all_results.get(res.knotID)
-            if res.better_than(prev_best):
-                all_results[res.knotID] = res
+    results = store.best_results(mosaic_type, args.cubic_version)
+    store.close()
 
     # generate output file
     print("Saving resuts file...")
-    results_sorted = natsorted(all_results.values(), key=lambda res: res.knotID)
+    results_sorted = natsorted(results, key=lambda res: res.knotID)
     with out_file.open("w") as out:
         text = "\n".join(res.to_str() for res in results_sorted)
         out.write(text)
 
     print("Saving images...")
-    count = len(all_results.values())
-
-    for progress, res in enumerate(results_sorted):
-        if progress % int(count / 20) == 0:
-            print(f"  {progress/count:.0%} - {progress}/{count}")
-        mosaic = builder(res.mosaic_str)
-        # generating and saving image
-        img_path = util.img_filepath(imgs_dir, res)
-        if args.publish:
-            img = mvis.build_img(mosaic.get_publish_mosaic())
-            img.save(img_path)
-        else:
-            mvis.gen_png(mosaic, res.mosaic_str, res.knotID, img_path)
+    jobs = [
+        RenderJob(
+            res.mosaic_str,
+            mosaic_type,
+            args.publish,
+            res.knotID,
+            util.img_filepath(imgs_dir, res),
+        )
+        for res in results_sorted
+    ]
+    # only images of results that are no longer the best are removed
+    keep = {job.out_path for job in jobs}
+    [f.unlink() for f in imgs_dir.iterdir() if f not in keep]
+    render_images(jobs, args.workers)
 
     print("Done merging")
 
@@ -22,6 +22,23 @@ pub const TILE_CONNECTION_SIDES: &[&[Conn]] = &[
     &[No, No, No, No],             // 12 (the 'locked 0' tile)
 ];
 
+/// Lookup Table: given the tile, the pairs of sides joined by each strand
+pub const TILE_ARCS: &[&[[u8; 2]]] = &[
+    &[],               // 0
+    &[[2, 3]],         // 1
+    &[[0, 3]],         // 2
+    &[[0, 1]],         // 3
+    &[[1, 2]],         // 4
+    &[[0, 2]],         // 5
+    &[[1, 3]],         // 6
+    &[[2, 3], [0, 1]], // 7
+    &[[0, 3], [1, 2]], // 8
+    &[[0, 2], [1, 3]], // 9
+    &[[0, 2], [1, 3]], // 10
+    &[],               // 11 (the 'unknown' tile)
+    &[],               // 12 (the 'locked 0' tile)
+];
+
 // For Cubic mosaics, it can be useful to generate mosaics only using a specific set
 // of sides. The sides are numbered as follows, for a 2D unrolling of a cube:
 //   ┌───┬───┬───┐
@@ -1,20 +1,26 @@
 mod conn_table;
 mod mosaics;
+mod parallel;
+mod pd;
 mod rolling_buff;
-use std::fs::File;
+mod symmetry;
 use std::io::{Error, ErrorKind};
 
 use clap::Parser;
 use format_num::format_num;
-use std::io::{BufRead, Result};
+use std::io::Result;
 use std::path::PathBuf;
+use std::sync::Arc;
 use std::time::Instant;
-use std::{fs::create_dir_all, io::BufReader};
+use std::fs::create_dir_all;
 
 use crate::{conn_table::CUBIC_TYPES, mosaics::Mosaic};
-use rolling_buff::{RollOver, RollingBufWriter};
+use parallel::Shard;
+use pd::{NotAKnot, PdCodes};
+use rolling_buff::{OutputFormat, PackedHeader, RollOver, RollingBufWriter};
+use symmetry::Symmetries;
 
-#[derive(PartialEq, clap::Subcommand, Debug)]
+#[derive(PartialEq, Clone, clap::Subcommand, Debug)]
 enum MosaicVariant {
     /// Mosaic with no edge connections
     Flat,
@@ -41,6 +47,19 @@ impl MosaicVariant {
             }
         }
     }
+    /// (variant, cubic type) codes stored in the header of packed output files
+    fn header_codes(&self) -> (u8, u8) {
+        match self {
+            MosaicVariant::Flat => (0, u8::MAX),
+            MosaicVariant::Cylindrical => (1, u8::MAX),
+            MosaicVariant::Toric => (2, u8::MAX),
+            MosaicVariant::Mobius => (3, u8::MAX),
+            MosaicVariant::Cubic { cubic_type } => {
+                let index = CUBIC_TYPES.iter().position(|c| c.name == cubic_type);
+                (4, index.unwrap() as u8)
+            }
+        }
+    }
 }
 impl std::fmt::Display for MosaicVariant {
     fn fmt(&self, f: &mut std::fmt::Formatter<'_>) -> std::fmt::Result {
@@ -57,6 +76,9 @@ struct Filters {
     /// discard mosaics that contain trivial loops
     #[arg(short, long)]
     remove_loops: bool,
+    /// keep mosaics that are sure to be links, as soon as a strand closes with another strand present
+    #[arg(long)]
+    keep_links: bool,
 }
 
 #[derive(Parser, Debug)]
@@ -76,6 +98,33 @@ struct CliArgs {
     /// Resume generation of partially complete results
     #[arg(long)]
     resume: bool,
+    /// Write packed binary files (4 bits per tile) instead of hex text
+    #[arg(short, long)]
+    packed: bool,
+    /// Stream mosaics to stdout instead of writing files, ex. into `main.py stream`
+    #[arg(long, conflicts_with = "resume")]
+    stdout: bool,
+    /// Start from this mosaic (inclusive) instead of the beginning, to resume a stream
+    #[arg(long, value_name = "MOSAIC", requires = "stdout")]
+    start_at: Option<String>,
+    /// Only output the smallest of the mosaics that are rotations/reflections/shifts of each other
+    #[arg(short, long)]
+    symmetry: bool,
+    /// Generate on this many threads, splitting the search into subtrees
+    #[arg(short = 'j', long, default_value_t = 1, conflicts_with = "stdout")]
+    threads: usize,
+    /// Number of leading tiles that pick a subtree when using more than one thread
+    #[arg(long, default_value_t = 4)]
+    split_depth: usize,
+    /// Only generate part I of N of the search, ex. `--shard 2/8` to split a run over 8 machines
+    #[arg(long, value_name = "I/N", value_parser = Shard::parse, conflicts_with = "stdout")]
+    shard: Option<Shard>,
+    /// Check that the N shards of a run cover it exactly once, and merge them into one run of files
+    #[arg(long, value_name = "N", conflicts_with_all = ["stdout", "resume", "shard"])]
+    merge_shards: Option<usize>,
+    /// Follow the strand of each mosaic, only writing knots along with their tile count and PD codes
+    #[arg(long, conflicts_with = "packed")]
+    pd: bool,
 
     #[command[flatten]]
     filters: Filters,
@@ -90,70 +139,216 @@ fn main() -> Result<()> {
     //     filters: Filters {
     //         discard_crossings_below: 0,
     //         remove_loops: true,
+    //         keep_links: false,
     //     },
     //     resume: false,
+    //     packed: false,
+    //     stdout: false,
+    //     start_at: None,
+    //     symmetry: false,
+    //     threads: 1,
+    //     split_depth: 4,
+    //     shard: None,
+    //     merge_shards: None,
+    //     pd: false,
     // };
     let args = CliArgs::parse();
     dbg!(&args);
     let size: usize = args.mosaic_size;
     let folder_name = format!("{size}_{}", args.mosaic_type.dir_code());
     let output_folder = args.base_dir.join(folder_name);
+    // each shard is kept in its own folder until they are merged
+    let output_folder = match &args.shard {
+        Some(shard) => output_folder.join(shard.dir_name()),
+        None => output_folder,
+    };
 
-    println!("generating ...");
+    // status goes to stderr, as stdout may be the mosaic stream
+    eprintln!("generating ...");
 
-    create_dir_all(&output_folder)?;
     let mosaic = Mosaic::new(size, args.mosaic_type);
-    let generator = if args.resume {
-        let g = Generator::resume_mosaic_gen(mosaic, &output_folder, args.max_lines)?;
-        println!(
-            "Resuming: {} complete",
-            format_num!(".2%", g.calc_progress())
-        );
-        g
+    let format = if args.packed {
+        let (variant, cubic_type) = mosaic.variant().header_codes();
+        OutputFormat::Packed(PackedHeader {
+            variant,
+            cubic_type,
+            size: size as u8,
+            tile_ct: mosaic.get_len() as u16,
+        })
+    } else {
+        OutputFormat::Text
+    };
+    if args.pd && PdCodes::new(&mosaic).is_none() {
+        return Err(Error::new(
+            ErrorKind::InvalidInput,
+            "--pd can't traverse toric mosaics, they need hidden crossings",
+        ));
+    }
+    if args.symmetry && mosaic.variant() == &MosaicVariant::Toric {
+        return Err(Error::new(
+            ErrorKind::InvalidInput,
+            "--symmetry isn't supported for toric mosaics yet, which of their symmetries keep the knot can't be checked",
+        ));
+    }
+    let symmetries = if args.symmetry {
+        let symmetries = Symmetries::of(&mosaic);
+        eprintln!("Using {} symmetries", symmetries.len() + 1);
+        Some(Arc::new(symmetries))
     } else {
-        let outbuf = RollingBufWriter::new(&output_folder, args.max_lines, mosaic.get_len())?;
-        Generator::new(outbuf, mosaic)
+        None
     };
-    generate(generator, args.filters)?;
+    if let Some(shard_ct) = args.merge_shards {
+        parallel::merge_shards(
+            mosaic,
+            &output_folder,
+            shard_ct,
+            args.max_lines,
+            format,
+            symmetries.as_deref(),
+            &args.filters,
+        )?;
+    } else if args.threads > 1 || args.shard.is_some() {
+        let split = parallel::Split {
+            threads: args.threads,
+            depth: args.split_depth,
+            max_lines: args.max_lines,
+            format,
+            shard: args.shard,
+            pd: args.pd,
+        };
+        split.generate(mosaic, &output_folder, args.resume, symmetries, &args.filters)?;
+    } else {
+        let mut generator = if args.stdout {
+            let outbuf = RollingBufWriter::stdout(args.max_lines, mosaic.get_len(), format)?;
+            match &args.start_at {
+                Some(mos_str) => {
+                    let g = Generator::start_at(mosaic, mos_str, outbuf, 0)?;
+                    eprintln!(
+                        "Resuming: {} complete",
+                        format_num!(".2%", g.calc_progress())
+                    );
+                    g
+                }
+                None => Generator::new(outbuf, mosaic),
+            }
+        } else if args.resume {
+            if parallel::Split::manifest_path(&output_folder).is_file() {
+                return Err(Error::other(
+                    "Generation was split into subtrees, resume it with --threads or --shard",
+                ));
+            }
+            let g = Generator::resume_mosaic_gen(mosaic, &output_folder, args.max_lines, format)?;
+            eprintln!(
+                "Resuming: {} complete",
+                format_num!(".2%", g.calc_progress())
+            );
+            g
+        } else {
+            create_dir_all(&output_folder)?;
+            let outbuf =
+                RollingBufWriter::new(&output_folder, args.max_lines, mosaic.get_len(), format)?;
+            Generator::new(outbuf, mosaic)
+        };
+        generator.symmetries = symmetries;
+        if args.pd {
+            generator.pd = PdCodes::new(&generator.mosaic);
+        }
+        let t_start = Instant::now();
+        generate(&mut generator, &args.filters)?;
+        print_summary(
+            generator.mosaic.description_str(),
+            &generator.stats,
+            generator.symmetries.is_some(),
+            t_start,
+        );
+    }
 
-    let path = output_folder.join("COMPLETED");
-    std::fs::File::create(path)?;
+    if !args.stdout {
+        let path = output_folder.join("COMPLETED");
+        std::fs::File::create(path)?;
+    }
     Ok(())
 }
 
+/// Counts kept while generating, summed over subtrees when generating on several threads
+#[derive(Default, Clone, Copy)]
+struct GenStats {
+    generated: u64,
+    trivial_pruned: u64, // partial mosaics caught by `Mosaic::is_trivial`
+    link_pruned: u64,    // partial mosaics that are sure to be links
+    link_rejected: u64,  // complete mosaics that are links
+    bad_rejected: u64,   // complete mosaics with strands that can't be followed, with `--pd`
+    sym_pruned: u64,     // partial mosaics skipped, with all of their completions
+    sym_rejected: u64,   // complete mosaics skipped
+}
+impl GenStats {
+    fn add(&mut self, other: &GenStats) {
+        self.generated += other.generated;
+        self.trivial_pruned += other.trivial_pruned;
+        self.link_pruned += other.link_pruned;
+        self.link_rejected += other.link_rejected;
+        self.bad_rejected += other.bad_rejected;
+        self.sym_pruned += other.sym_pruned;
+        self.sym_rejected += other.sym_rejected;
+    }
+}
+
 struct Generator {
     branches: Vec<Vec<u8>>,
     depth: usize,
+    /// Tiles before this index are fixed, so only the subtree below them is generated
+    floor: usize,
     mosaic: Mosaic,
     out_buff: RollingBufWriter,
     progress: Vec<(i32, i32)>, // (i,n) for each level, stores current index and total count of options
     start_ct: u64,
-    gen_ct: u64,
+    stats: GenStats,
+    symmetries: Option<Arc<Symmetries>>,
+    /// Writes the PD codes of each mosaic, discarding those that aren't knots
+    pd: Option<PdCodes>,
+    /// Set when resuming, as the mosaic generation resumes from is written first
+    write_first: bool,
+    /// Line written after each mosaic's tiles, with `pd`
+    fields: String,
+    /// Shown in status messages
+    name: String,
 }
 impl Generator {
     fn new(out_buff: RollingBufWriter, mosaic: Mosaic) -> Generator {
+        Self::subtree(out_buff, mosaic, 0)
+    }
+    /// Generates the mosaics that start with the first `floor` tiles of `mosaic`,
+    /// which must already be set
+    fn subtree(out_buff: RollingBufWriter, mosaic: Mosaic, floor: usize) -> Generator {
         let len = mosaic.get_len();
         let mut branches: Vec<Vec<u8>> = vec![vec![]; len];
         let mut progress = vec![(0, 1i32); len];
 
-        branches[0] = Vec::from(mosaic.get_valid_tiles(0));
-        branches[0].reverse(); // this preserves increasing numeric order of the output
-        progress[0] = (-1, branches[0].len() as i32);
+        branches[floor] = Vec::from(mosaic.get_valid_tiles(floor));
+        branches[floor].reverse(); // this preserves increasing numeric order of the output
+        progress[floor] = (-1, branches[floor].len() as i32);
         Generator {
             branches,
-            depth: 0,
+            depth: floor,
+            floor,
+            name: mosaic.description_str().to_string(),
             mosaic,
             out_buff,
             progress,
             start_ct: 0,
-            gen_ct: 0,
+            stats: GenStats::default(),
+            symmetries: None,
+            pd: None,
+            write_first: false,
+            fields: String::new(),
         }
     }
     /// `mosaic` should be an empty mosaic of the correct type.
     fn resume_mosaic_gen(
-        mut mosaic: Mosaic,
+        mosaic: Mosaic,
         output_folder: &PathBuf,
         lines_per_file: usize,
+        format: OutputFormat,
     ) -> Result<Generator> {
         // getting all existing files
         let names = std::fs::read_dir(output_folder)?
@@ -168,7 +363,7 @@ impl Generator {
             }
             let Some(num) = n
                 .strip_prefix("pt")
-                .and_then(|s| s.strip_suffix(".txt"))
+                .and_then(|s| s.strip_suffix(&format!(".{}", format.extension())))
                 .and_then(|s| s.parse::<usize>().ok())
             else {
                 continue;
@@ -177,10 +372,27 @@ impl Generator {
         }
 
         // get the mosaic string that starts that file
-        let mut mos_str = String::new();
-        let file = File::open(RollingBufWriter::path_from_index(output_folder, last_ind))?;
-        BufReader::new(file).read_line(&mut mos_str)?;
-        let mos_str = mos_str.trim();
+        let mos_str = rolling_buff::read_first_mosaic(
+            &RollingBufWriter::path_from_index(output_folder, last_ind, &format),
+            &format,
+        )?;
+        let out_buff = RollingBufWriter::resume_from(
+            &output_folder,
+            lines_per_file,
+            mosaic.get_len(),
+            last_ind,
+            format,
+        )?;
+        Self::start_at(mosaic, &mos_str, out_buff, (last_ind * lines_per_file) as u64)
+    }
+    /// Continues generation from `mos_str`, which `generate` writes first.
+    /// `start_ct` is the number of mosaics before it, for time estimates
+    fn start_at(
+        mut mosaic: Mosaic,
+        mos_str: &str,
+        out_buff: RollingBufWriter,
+        start_ct: u64,
+    ) -> Result<Generator> {
         if !mos_str.is_ascii() {
             return Err(Error::new(
                 ErrorKind::InvalidData,
@@ -214,40 +426,127 @@ impl Generator {
             }
         }
 
-        let mut out_buff = RollingBufWriter::resume_from(
-            &output_folder,
-            lines_per_file,
-            mosaic.get_len(),
-            last_ind,
-        )?;
-        out_buff.write_line(&mosaic.to_string())?;
-        out_buff.flush()?;
+        if mos_str.len() != mosaic.get_len() {
+            return Err(Error::new(
+                ErrorKind::InvalidData,
+                format!("Mosaic string should have {} tiles", mosaic.get_len()),
+            ));
+        }
         Ok(Generator {
             branches,
             depth: mosaic.get_len() - 1,
+            floor: 0,
+            name: mosaic.description_str().to_string(),
             mosaic,
             out_buff,
             progress,
-            start_ct: (last_ind * 100_000) as u64,
-            gen_ct: 0,
+            start_ct,
+            stats: GenStats::default(),
+            symmetries: None,
+            pd: None,
+            write_first: true,
+            fields: String::new(),
         })
     }
+    /// Stops the generator from changing the tiles before `floor`, as in `Generator::subtree`
+    fn within(mut self, floor: usize) -> Generator {
+        for i in 0..floor {
+            self.branches[i].clear();
+            self.progress[i] = (0, 1);
+        }
+        self.floor = floor;
+        self
+    }
+    /// True if the branch ending at the current tile should be skipped, see `prune`
+    fn prune(&mut self, filters: &Filters) -> bool {
+        prune(
+            &self.mosaic,
+            filters,
+            self.symmetries.as_deref(),
+            &mut self.stats,
+        )
+    }
+    /// True if a symmetry makes the mosaic so far smaller, so it isn't canonical
+    fn is_dominated(&self) -> bool {
+        self.symmetries
+            .as_ref()
+            .is_some_and(|s| s.is_dominated(self.mosaic.tiles()))
+    }
     fn calc_progress(&self) -> f64 {
-        let mut denom: f64 = 1.;
-        let mut sum: f64 = 0.;
-        // The amount of places used is arbitrary,
-        // 32 allows even huge grids to give some estimate of completion
-        for (i, n) in self.progress.iter().take(32) {
-            denom *= *n as f64;
-            sum += (*i as f64) / denom;
+        progress_fraction(&self.progress[self.floor..])
+    }
+    /// Writes the current mosaic, with its PD codes if using `pd`.
+    /// Returns None for mosaics `pd` finds aren't knots, which aren't written
+    fn write_mosaic(&mut self) -> Result<Option<RollOver>> {
+        let tiles = self.mosaic.tiles();
+        let Some(pd) = &mut self.pd else {
+            return self.out_buff.write_tiles(tiles).map(Some);
+        };
+        match pd.traverse(tiles) {
+            Ok(()) => {
+                self.fields.clear();
+                pd.write_fields(tiles, &mut self.fields);
+                self.out_buff.write_tiles_with(tiles, &self.fields).map(Some)
+            }
+            Err(NotAKnot::Link) => {
+                self.stats.link_rejected += 1;
+                Ok(None)
+            }
+            // the blank mosaic, only generated without a crossing filter
+            Err(NotAKnot::NoTiles) => Ok(None),
+            Err(NotAKnot::BadConnections) => {
+                self.stats.bad_rejected += 1;
+                Ok(None)
+            }
         }
-        sum
     }
 }
 
-fn generate(mut g: Generator, filters: Filters) -> Result<()> {
+/// True if no mosaic starting with the tiles set so far should be generated.
+/// Counts the reason in `stats`
+fn prune(
+    mosaic: &Mosaic,
+    filters: &Filters,
+    symmetries: Option<&Symmetries>,
+    stats: &mut GenStats,
+) -> bool {
+    // cheapest first, `is_link` is kept up to date as tiles are set
+    if !filters.keep_links && mosaic.is_link() {
+        stats.link_pruned += 1;
+        return true;
+    }
+    if mosaic.is_trivial(filters) {
+        stats.trivial_pruned += 1;
+        return true;
+    }
+    if symmetries.is_some_and(|s| s.is_dominated(mosaic.tiles())) {
+        stats.sym_pruned += 1;
+        return true;
+    }
+    false
+}
+
+/// Estimates the part of the search before a branch, from the (i,n) at each level,
+/// as if every branch at a level were the same size
+fn progress_fraction(progress: &[(i32, i32)]) -> f64 {
+    let mut denom: f64 = 1.;
+    let mut sum: f64 = 0.;
+    // The amount of places used is arbitrary,
+    // 32 allows even huge grids to give some estimate of completion
+    for (i, n) in progress.iter().take(32) {
+        denom *= *n as f64;
+        sum += (*i as f64) / denom;
+    }
+    sum
+}
+
+fn generate(g: &mut Generator, filters: &Filters) -> Result<()> {
     // let mut mosaic_ct: usize = 0;
     let t_start = Instant::now(); //Timing 
+    if std::mem::take(&mut g.write_first) {
+        g.write_mosaic()?;
+        g.out_buff.flush()?;
+    }
 
     'outer: loop {
         // moving to the next branch at <depth>
@@ -255,13 +554,13 @@ fn generate(mut g: Generator, filters: Filters) -> Result<()> {
             g.mosaic.set_tile(g.depth, first);
             g.progress[g.depth].0 += 1; // stepping over to next 'branch'
             // this does not hit at all for cubic?? Likely because the only metric is
-            if g.mosaic.is_trivial(&filters) {
+            if g.prune(filters) {
                 continue; // this will go to next branch at same depth
             }
             g.depth += 1;
         } else {
             // if all branches explored, back out a level
-            if g.depth == 0 {
+            if g.depth <= g.floor {
                 break; // exit if we explore all top-level branches
             }
             g.mosaic.set_tile(g.depth, 11);
@@ -276,7 +575,7 @@ fn generate(mut g: Generator, filters: Filters) -> Result<()> {
             if let Some(item) = g.branches[g.depth].pop() {
                 g.mosaic.set_tile(g.depth, item);
                 g.progress[g.depth] = (0, g.branches[g.depth].len() as i32 + 1);
-                if g.mosaic.is_trivial(&filters) {
+                if g.prune(filters) {
                     // this moves to the next branch at this depth.
                     continue 'outer;
                 }
@@ -292,21 +591,26 @@ fn generate(mut g: Generator, filters: Filters) -> Result<()> {
 
         g.depth -= 1;
         loop {
-            let res = g.out_buff.write_line(&g.mosaic.to_string())?;
-            g.gen_ct += 1;
-            if let RollOver::Rolled(index) = res {
-                let progress = g.calc_progress();
-                let est_t_remains =
-                    estimate_time_remaining(g.gen_ct, g.start_ct, t_start, progress);
-                println!(
-                    "{}: on pt{index} - {} generated, {}\n - Est {}:{}:{} remaining",
-                    g.mosaic.description_str(),
-                    format_num!(",.3s", g.gen_ct as f64),
-                    format_num!(".2%", progress),
-                    est_t_remains / 3600,
-                    (est_t_remains % 3600) / 60,
-                    est_t_remains % 60,
-                );
+            if !filters.keep_links && g.mosaic.is_link() {
+                g.stats.link_rejected += 1;
+            } else if g.is_dominated() {
+                g.stats.sym_rejected += 1;
+            } else if let Some(res) = g.write_mosaic()? {
+                g.stats.generated += 1;
+                if let RollOver::Rolled(index) = res {
+                    let progress = g.calc_progress();
+                    let est_t_remains =
+                        estimate_time_remaining(g.stats.generated, g.start_ct, t_start, progress);
+                    eprintln!(
+                        "{}: on pt{index} - {} generated, {}\n - Est {}:{}:{} remaining",
+                        g.name,
+                        format_num!(",.3s", g.stats.generated as f64),
+                        format_num!(".2%", progress),
+                        est_t_remains / 3600,
+                        (est_t_remains % 3600) / 60,
+                        est_t_remains % 60,
+                    );
+                }
             }
             if let Some(item) = g.branches[g.depth].pop() {
                 g.mosaic.set_tile(g.depth, item);
@@ -320,10 +624,28 @@ fn generate(mut g: Generator, filters: Filters) -> Result<()> {
         // the weird max here is to handle the case of a 1x1 mosaic
         g.depth = std::cmp::max(1, g.depth) - 1;
     }
-    g.out_buff.flush()?;
-    println!("Done - {} mosaics generated", g.gen_ct);
-    println!("- Completed in {:.6} s)", t_start.elapsed().as_secs_f64(),);
-    Ok(())
+    g.out_buff.flush()
+}
+
+fn print_summary(desc: &str, stats: &GenStats, symmetry: bool, t_start: Instant) {
+    eprintln!("Done - {} mosaics generated", stats.generated);
+    eprintln!(
+        "- {desc}: pruned {} branches by the filters, {} partial and {} complete links",
+        stats.trivial_pruned, stats.link_pruned, stats.link_rejected
+    );
+    if stats.bad_rejected > 0 {
+        eprintln!(
+            "- WARN: {} mosaics had strands that couldn't be followed",
+            stats.bad_rejected
+        );
+    }
+    if symmetry {
+        eprintln!(
+            "- Symmetry skipped {} partial and {} complete mosaics",
+            stats.sym_pruned, stats.sym_rejected
+        );
+    }
+    eprintln!("- Completed in {:.6} s)", t_start.elapsed().as_secs_f64(),);
 }
 
 fn estimate_time_remaining(gen_ct: u64, base_ct: u64, t_start: Instant, progress: f64) -> u64 {
@@ -31,11 +31,150 @@ impl ConnEntry {
         connected_to: u16::MAX - 1,
     };
 }
+/// The strands formed by the tiles set so far, as a union-find over the glued pairs of
+/// tile sides. Tiles are always cleared in the reverse order they were set, so instead
+/// of path compression every change is logged, to be undone when its tile is cleared
+#[derive(Clone)]
+struct Strands {
+    /// Union-find node of each tile side (`index * 4 + side`), shared by glued sides
+    node_of: Vec<u16>,
+    parent: Vec<u16>,
+    size: Vec<u16>,
+    /// Strand ends at each node, a node with one end is still open
+    ends: Vec<u8>,
+    /// Open nodes in each component, kept at its root
+    open: Vec<u16>,
+    /// Number of components with any strands, and of those that are closed loops
+    components: u32,
+    closed: u32,
+    history: Vec<Change>,
+    /// Where the changes made by each tile start in `history`
+    marks: Vec<usize>,
+}
+#[derive(Clone, Copy)]
+enum Change {
+    Parent(u16, u16),
+    Size(u16, u16),
+    Ends(u16, u8),
+    Open(u16, u16),
+    Counts(u32, u32),
+}
+impl Strands {
+    fn new(node_of: Vec<u16>, tile_ct: usize) -> Strands {
+        let node_ct = node_of.len();
+        Strands {
+            node_of,
+            parent: (0..node_ct as u16).collect(),
+            size: vec![1; node_ct],
+            ends: vec![0; node_ct],
+            open: vec![0; node_ct],
+            components: 0,
+            closed: 0,
+            history: vec![],
+            marks: vec![0; tile_ct],
+        }
+    }
+    fn find(&self, mut node: u16) -> u16 {
+        while self.parent[node as usize] != node {
+            node = self.parent[node as usize];
+        }
+        node
+    }
+    /// Only nodes with strand ends are ever joined, so a root with no ends is on its own
+    fn is_closed(&self, root: u16) -> bool {
+        self.ends[root as usize] > 0 && self.open[root as usize] == 0
+    }
+    fn set_tile(&mut self, index: usize, tile: u8) {
+        self.marks[index] = self.history.len();
+        for [a, b] in TILE_ARCS[tile as usize] {
+            let a = self.node_of[index * 4 + *a as usize];
+            let b = self.node_of[index * 4 + *b as usize];
+            self.add_end(a);
+            self.add_end(b);
+            self.join(a, b);
+        }
+    }
+    fn add_end(&mut self, node: u16) {
+        let root = self.find(node);
+        let was_closed = self.is_closed(root);
+        self.history.push(Change::Counts(self.components, self.closed));
+        self.history.push(Change::Ends(node, self.ends[node as usize]));
+        self.history.push(Change::Open(root, self.open[root as usize]));
+        if self.ends[node as usize] == 0 {
+            self.components += 1;
+            self.open[root as usize] += 1;
+        } else {
+            self.open[root as usize] -= 1;
+        }
+        self.ends[node as usize] += 1;
+        self.closed = self.closed + self.is_closed(root) as u32 - was_closed as u32;
+    }
+    fn join(&mut self, a: u16, b: u16) {
+        let (a, b) = (self.find(a), self.find(b));
+        if a == b {
+            return;
+        }
+        // union by size keeps the trees shallow without path compression
+        let (big, small) = if self.size[a as usize] >= self.size[b as usize] {
+            (a, b)
+        } else {
+            (b, a)
+        };
+        let was_closed = self.is_closed(big) as u32 + self.is_closed(small) as u32;
+        self.history.push(Change::Counts(self.components, self.closed));
+        self.history.push(Change::Parent(small, small));
+        self.history.push(Change::Size(big, self.size[big as usize]));
+        self.history.push(Change::Open(big, self.open[big as usize]));
+        self.parent[small as usize] = big;
+        self.size[big as usize] += self.size[small as usize];
+        self.open[big as usize] += self.open[small as usize];
+        self.components -= 1;
+        self.closed = self.closed + self.is_closed(big) as u32 - was_closed;
+    }
+    /// Undoes the changes made by the tile at `index`, which must be the last tile set
+    fn clear_tile(&mut self, index: usize) {
+        let mark = self.marks[index];
+        while self.history.len() > mark {
+            match self.history.pop().unwrap() {
+                Change::Parent(node, old) => self.parent[node as usize] = old,
+                Change::Size(node, old) => self.size[node as usize] = old,
+                Change::Ends(node, old) => self.ends[node as usize] = old,
+                Change::Open(node, old) => self.open[node as usize] = old,
+                Change::Counts(components, closed) => {
+                    self.components = components;
+                    self.closed = closed;
+                }
+            }
+        }
+    }
+}
+
+/// Running totals over the tiles, updated as each tile is set so `is_trivial` is O(1).
+/// They only depend on the current tiles, so clearing a tile undoes them
+#[derive(Clone, Default)]
+struct TileCounts {
+    /// Tiles 9 and 10
+    crossings: usize,
+    /// Tiles not yet set (11), which may still become crossings
+    unset: usize,
+    /// Tiles on each cube face that aren't blank, counting unset tiles
+    face_tiles: [usize; 6],
+    /// Tiles in the first column that may connect to the left edge (mobius)
+    left_conns: usize,
+    /// Tiles that a strand runs straight through, in each row (5, 9, 10) and column (6, 9, 10)
+    row_through: Vec<usize>,
+    col_through: Vec<usize>,
+    /// Rows and columns which are all straight through tiles, so form a trivial loop
+    full_rows: usize,
+    full_cols: usize,
+}
+
 struct XYSide {
     x: usize,
     y: usize,
     side: Side,
 }
+#[derive(Clone)]
 pub struct Mosaic {
     tiles: Vec<u8>,
     edges: Vec<ConnEntry>,
@@ -43,6 +182,10 @@ pub struct Mosaic {
     size: usize, // grid side length (aka the Mosaic #)
     len: usize,  // number of tiles
     desc_str: String,
+    strands: Strands,
+    counts: TileCounts,
+    /// Number of cube faces a cubic mosaic must use
+    cubic_faces: usize,
 }
 impl Mosaic {
     pub fn new(size: usize, variant: MosaicVariant) -> Mosaic {
@@ -62,6 +205,13 @@ impl Mosaic {
             size,
             len,
             desc_str,
+            strands: Strands::new(vec![], len),
+            counts: TileCounts {
+                row_through: vec![0; size],
+                col_through: vec![0; size],
+                ..Default::default()
+            },
+            cubic_faces: 0,
         };
         use MosaicVariant as MV;
         match mos.variant {
@@ -85,8 +235,19 @@ impl Mosaic {
                 mos.link_top_bottom(true);
             }
         };
+        let node_of = (0..len * 4)
+            .map(|slot| {
+                let glued = mos.glued_side(slot / 4, (slot % 4) as u8);
+                glued.map_or(slot, |other| other.min(slot)) as u16
+            })
+            .collect();
+        mos.strands = Strands::new(node_of, len);
+        for i in 0..len {
+            mos.count_tile(i, 11, true);
+        }
         if let MosaicVariant::Cubic { cubic_type } = &mos.variant {
             let non_zero_sides = cubic_from_name(cubic_type).unwrap().sides;
+            mos.cubic_faces = non_zero_sides.len();
             for i in 0..mos.tiles.len() {
                 let side_num = mos.cubic_get_side_num(i);
                 // for each tile not on the face for this cubic type
@@ -100,12 +261,25 @@ impl Mosaic {
     pub fn description_str(&self) -> &str {
         &self.desc_str
     }
+    pub fn variant(&self) -> &MosaicVariant {
+        &self.variant
+    }
+    pub fn tiles(&self) -> &[u8] {
+        &self.tiles
+    }
 
     pub fn set_tile(&mut self, index: usize, tile: u8) {
         // never change 'locked empty' tiles
         if self.tiles[index] == 12 {
             return;
         }
+        // tiles are only changed or cleared after every later tile is cleared
+        if self.tiles[index] != 11 {
+            self.strands.clear_tile(index);
+        }
+        self.strands.set_tile(index, tile);
+        self.count_tile(index, self.tiles[index], false);
+        self.count_tile(index, tile, true);
         self.tiles[index] = tile;
         for (i, conn) in TILE_CONNECTION_SIDES[tile as usize].iter().enumerate() {
             let edge_ind = index * 4 + i;
@@ -120,6 +294,48 @@ impl Mosaic {
             }
         }
     }
+    /// Adds or removes the tile at `index` from the running totals
+    fn count_tile(&mut self, index: usize, tile: u8, add: bool) {
+        let change = |n: &mut usize| {
+            if add {
+                *n += 1
+            } else {
+                *n -= 1
+            }
+        };
+        let counts = &mut self.counts;
+        match tile {
+            9 | 10 => change(&mut counts.crossings),
+            11 => change(&mut counts.unset),
+            _ => {}
+        }
+        if let MosaicVariant::Cubic { .. } = self.variant {
+            if !matches!(tile, 0 | 12) {
+                let face = self.cubic_get_side_num(index);
+                change(&mut self.counts.face_tiles[face]);
+            }
+            return;
+        }
+        let (col, row) = (index % self.size, index / self.size);
+        if col == 0 && TILE_CONNECTION_SIDES[tile as usize][Side::Left as usize] != Conn::No {
+            change(&mut counts.left_conns);
+        }
+        let full = self.size;
+        if matches!(tile, 5 | 9 | 10) {
+            let was_full = counts.row_through[row] == full;
+            change(&mut counts.row_through[row]);
+            if was_full != (counts.row_through[row] == full) {
+                change(&mut counts.full_rows);
+            }
+        }
+        if matches!(tile, 6 | 9 | 10) {
+            let was_full = counts.col_through[col] == full;
+            change(&mut counts.col_through[col]);
+            if was_full != (counts.col_through[col] == full) {
+                change(&mut counts.full_cols);
+            }
+        }
+    }
     pub fn get_valid_tiles(&self, index: usize) -> &'static [u8] {
         if self.tiles[index] == 12 {
             // will always be no connections, no matter what it's next to.
@@ -169,9 +385,6 @@ impl Mosaic {
         y -= self.size;
         self.size.pow(2) * 3 + y * self.size + x
     }
-    fn get_tile_xy(&self, x: usize, y: usize) -> u8 {
-        self.tiles[self.index_from_xy(x, y)]
-    }
     fn get_neighbor_conn(&self, index: usize, side: Side) -> Conn {
         // Check if this edge is on the border
         let edge_conn = self.edges[index * 4 + side as usize];
@@ -216,116 +429,83 @@ impl Mosaic {
         }
     }
 
+    /// The tile across `side` of this one, with the side it's entered from and
+    /// whether the join is twisted (mobius). None for closed edges and locked tiles
+    pub fn neighbor(&self, index: usize, side: u8) -> Option<(usize, (u8, bool))> {
+        let glued = self.glued_side(index, side)?;
+        let (next, entry_side) = (glued / 4, (glued % 4) as u8);
+        let edge_conn = self.edges[index * 4 + side as usize];
+        let twisted =
+            edge_conn != ConnEntry::NON_EDGE && matches!(self.variant, MosaicVariant::Mobius);
+        if self.tiles[next] == 12 {
+            return None;
+        }
+        Some((next, (entry_side, twisted)))
+    }
+    /// The side (as `index * 4 + side`) glued to this side of a tile, None for closed edges
+    fn glued_side(&self, index: usize, side: u8) -> Option<usize> {
+        let edge_conn = self.edges[index * 4 + side as usize];
+        if edge_conn == ConnEntry::NON_EDGE {
+            let (x, y) = self.index_to_xy(index);
+            let next = match side {
+                0 => self.index_from_xy(x + 1, y),
+                1 => self.index_from_xy(x, y - 1),
+                2 => self.index_from_xy(x - 1, y),
+                _ => self.index_from_xy(x, y + 1),
+            };
+            Some(next * 4 + (side as usize + 2) % 4)
+        } else if self.is_valid_edge(edge_conn.connected_to as usize) {
+            Some(edge_conn.connected_to as usize)
+        } else {
+            None
+        }
+    }
+    /// True once the tiles set so far are sure to make a link:
+    /// one strand is already a closed loop, and there is another strand
+    pub fn is_link(&self) -> bool {
+        self.strands.closed > 0 && self.strands.components > 1
+    }
+
     pub fn is_trivial(&self, filters: &Filters) -> bool {
         // Removes mosaics that are not important or not what is desired
         use MosaicVariant as MV;
-        let count_crossings = || {
-            self.tiles
-                .iter()
-                // unknown tile is counted so this can be used as a filter
-                .filter(|t| [9, 10, 11].contains(t))
-                .count()
-        };
+        // unknown tiles are counted so this can be used as a filter
+        // on incomplete mosaics, as they could become crossings
+        let crossings = self.counts.crossings + self.counts.unset;
         match &self.variant {
-            MV::Cubic { cubic_type } => {
+            MV::Cubic { .. } => {
                 // removes cubic mosaics using less sides than specified
-                let mut has_side = [false; 6];
-                let mut cross_ct = 0;
-                for i in 0..self.get_len() {
-                    // Note that tile 11, the 'not yet assigned' tile, is not included
-                    // Sides with undetermined tiles are considered occupied,
-                    // so that this works properly for in-progress mosaics
-                    let tile = &self.tiles[i];
-                    if !([0, 12].contains(tile)) {
-                        let side = self.cubic_get_side_num(i);
-                        has_side[side] = true;
-                    }
-                    if [9, 10, 11].contains(tile) {
-                        // because this is evaluated on incomplete mosaics, we must assume they could have a crossing
-                        cross_ct += 1;
-                    }
-                }
-                if cross_ct < filters.discard_crossings_below {
+                if crossings < filters.discard_crossings_below {
                     return true;
                 }
-                let ct = has_side.iter().filter(|s| **s).count();
-                ct < cubic_from_name(cubic_type).unwrap().sides.len()
+                // Sides with undetermined tiles are considered occupied,
+                // so that this works properly for in-progress mosaics
+                let ct = self.counts.face_tiles.iter().filter(|n| **n > 0).count();
+                ct < self.cubic_faces
             }
             MV::Cylindrical => {
-                if count_crossings() < filters.discard_crossings_below {
+                if crossings < filters.discard_crossings_below {
                     return true;
                 }
-                if filters.remove_loops {
-                    self.has_trivial_horz_loop()
-                } else {
-                    false
-                }
+                // a row that is a simple loop
+                filters.remove_loops && self.counts.full_rows > 0
             }
-            MV::Flat => count_crossings() < filters.discard_crossings_below,
+            MV::Flat => crossings < filters.discard_crossings_below,
             MV::Toric => {
-                if count_crossings() < filters.discard_crossings_below {
+                if crossings < filters.discard_crossings_below {
                     return true;
                 }
-                if filters.remove_loops {
-                    self.has_trivial_horz_loop() || self.has_trivial_vert_loop()
-                } else {
-                    false
-                }
+                filters.remove_loops && (self.counts.full_rows > 0 || self.counts.full_cols > 0)
             }
             MV::Mobius => {
-                let crossings = count_crossings();
-                // count tiles with possible connections on the left side
-                let left_conns:i64 = (0..self.size)
-                    .filter(|i| {
-                        let t = self.get_tile_xy(0, *i);
-                        TILE_CONNECTION_SIDES[t as usize][2] != Conn::No
-                    })
-                    .count().try_into().unwrap();
-                let hidden_crosses = left_conns * (left_conns - 1) / 2;
-                crossings as i64 + hidden_crosses < filters.discard_crossings_below as i64
+                // strands that leave through the left edge cross each other on the way around
+                let left_conns = self.counts.left_conns;
+                let hidden_crosses = left_conns * left_conns.saturating_sub(1) / 2;
+                crossings + hidden_crosses < filters.discard_crossings_below
             }
         }
     }
 
-    /// returns true for any mosaics with a row that is a simple loop.
-    fn has_trivial_horz_loop(&self) -> bool {
-        match self.variant {
-            MosaicVariant::Cubic { .. } => panic!("Horz loop not valid for cubic"),
-            MosaicVariant::Flat => panic!("Horz loop not valid for flat"),
-            _ => {
-                let sz = self.size;
-                'row_loop: for row in 0..sz {
-                    for col in 0..sz {
-                        let item = self.get_tile_xy(col, row);
-                        if !matches!(item, 5 | 9 | 10) {
-                            // contine to next row if any item doesn't have a horizontal connection
-                            continue 'row_loop;
-                        }
-                    }
-                    return true;
-                }
-                false
-            }
-        }
-    }
-    /// returns true for any (toric) mosaic with trivial
-    fn has_trivial_vert_loop(&self) -> bool {
-        if !matches!(self.variant, MosaicVariant::Toric) {
-            panic!("Vertical loops are only valid in toric mosiacs");
-        }
-        let sz = self.size;
-        'col_loop: for col in 0..sz {
-            for row in 0..sz {
-                let item = self.get_tile_xy(col, row);
-                if !matches!(item, 6 | 9 | 10) {
-                    // contine to next column if any item in this col doesn't have a vertical connection
-                    continue 'col_loop;
-                }
-            }
-            return true;
-        }
-        false
-    }
     fn cubic_get_side_num(&self, index: usize) -> usize {
         let (x, y) = self.index_to_xy(index);
         let (x, y) = (x / self.size, y / self.size);
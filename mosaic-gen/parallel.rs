@@ -0,0 +1,548 @@
+use std::collections::HashMap;
+use std::fs::{self, create_dir_all};
+use std::io::{Error, ErrorKind, Result};
+use std::path::{Path, PathBuf};
+use std::sync::atomic::{AtomicBool, AtomicUsize, Ordering};
+use std::sync::{Arc, Mutex};
+use std::time::Instant;
+
+use crate::mosaics::Mosaic;
+use crate::pd::PdCodes;
+use crate::rolling_buff::{self, OutputFormat, RollingBufWriter};
+use crate::symmetry::Symmetries;
+use crate::{Filters, GenStats, Generator, generate, print_summary, progress_fraction, prune};
+
+/// Folder inside the output folder holding the subtrees while they are generated
+const SPLIT_DIR: &str = "split";
+/// Written in a subtree's folder once it is complete, holding its number of files
+const DONE_FILE: &str = "DONE";
+/// Written in a shard's folder, listing its subtrees and their number of mosaics
+const SHARD_FILE: &str = "SHARD";
+
+/// Part `index` of `count` of a run, for splitting it over several machines.
+/// Holds the subtrees which start between `index/count` and `(index+1)/count`
+/// of the way through the search, as estimated by `Generator::calc_progress`
+#[derive(Clone, Copy, Debug)]
+pub struct Shard {
+    pub index: usize,
+    pub count: usize,
+}
+impl Shard {
+    /// Parses `I/N`, ex. `0/4` for the first of four shards
+    pub fn parse(s: &str) -> std::result::Result<Shard, String> {
+        let (index, count) = s.split_once('/').ok_or("shard should look like I/N")?;
+        let index: usize = index.parse().map_err(|_| "shard index is not a number")?;
+        let count: usize = count.parse().map_err(|_| "shard count is not a number")?;
+        if index >= count {
+            return Err(format!("shard index should be less than {count}"));
+        }
+        Ok(Shard { index, count })
+    }
+    pub fn dir_name(&self) -> String {
+        format!("shard{}of{}", self.index, self.count)
+    }
+    fn contains(&self, start: f64) -> bool {
+        let index = (start * self.count as f64) as usize;
+        index.min(self.count - 1) == self.index
+    }
+}
+
+/// Generates on several threads by splitting the search at `depth` tiles.
+/// Each valid choice of the first `depth` tiles is a subtree, and the subtrees are
+/// handed out to the threads in order, each writing its own files in `split/sNNNNN`.
+/// Once all are complete they are copied, in order, into the same `ptNNNN` files
+/// a single thread would have written.
+pub struct Split {
+    pub threads: usize,
+    pub depth: usize,
+    pub max_lines: usize,
+    pub format: OutputFormat,
+    /// Only generate this shard's subtrees
+    pub shard: Option<Shard>,
+    /// Write PD codes, see `Generator::pd`
+    pub pd: bool,
+}
+impl Split {
+    /// Lists the subtrees, so a resumed run can check that it splits the same way
+    pub fn manifest_path(output_folder: &Path) -> PathBuf {
+        output_folder.join(SPLIT_DIR).join("subtrees.txt")
+    }
+    fn subtree_dir(output_folder: &Path, index: usize) -> PathBuf {
+        output_folder.join(SPLIT_DIR).join(format!("s{index:05}"))
+    }
+
+    /// `mosaic` should be an empty mosaic of the correct type.
+    pub fn generate(
+        &self,
+        mosaic: Mosaic,
+        output_folder: &Path,
+        resume: bool,
+        symmetries: Option<Arc<Symmetries>>,
+        filters: &Filters,
+    ) -> Result<()> {
+        let t_start = Instant::now();
+        if self.depth >= mosaic.get_len() {
+            return Err(Error::new(
+                ErrorKind::InvalidInput,
+                format!("Split depth should be less than {}", mosaic.get_len()),
+            ));
+        }
+        let mut stats = GenStats::default();
+        let mut subtrees = vec![];
+        find_prefixes(
+            &mut mosaic.clone(),
+            0,
+            &mut vec![(0, 1); self.depth],
+            filters,
+            symmetries.as_deref(),
+            &mut subtrees,
+            &mut stats,
+        );
+        if let Some(shard) = &self.shard {
+            subtrees.retain(|s| shard.contains(s.start));
+        }
+        let prefixes: Vec<Vec<u8>> = subtrees.into_iter().map(|s| s.prefix).collect();
+        let manifest = manifest_str(self.depth, &prefixes);
+        let manifest_path = Self::manifest_path(output_folder);
+        if resume {
+            if output_folder.join("COMPLETED").is_file() {
+                return Err(Error::other("Generation Already Complete!"));
+            }
+            let existing = fs::read_to_string(&manifest_path)
+                .map_err(|_| Error::other("No split generation to resume"))?;
+            if existing != manifest {
+                return Err(Error::new(
+                    ErrorKind::InvalidInput,
+                    "Subtrees differ from the partial results, use the same --split-depth, filters and --symmetry",
+                ));
+            }
+        } else {
+            let split_dir = output_folder.join(SPLIT_DIR);
+            if split_dir.is_dir() {
+                fs::remove_dir_all(&split_dir)?;
+            }
+            create_dir_all(&split_dir)?;
+            fs::write(&manifest_path, &manifest)?;
+        }
+        eprintln!(
+            "Split into {} subtrees at depth {}, using {} threads",
+            prefixes.len(),
+            self.depth,
+            self.threads
+        );
+
+        let next = AtomicUsize::new(0);
+        let complete = AtomicUsize::new(0);
+        let failed = AtomicBool::new(false);
+        let totals = Mutex::new(stats);
+        std::thread::scope(|scope| {
+            let workers: Vec<_> = (0..self.threads)
+                .map(|worker| {
+                    let (mosaic, prefixes, symmetries) = (&mosaic, &prefixes, &symmetries);
+                    let (next, complete, failed, totals) = (&next, &complete, &failed, &totals);
+                    scope.spawn(move || -> Result<()> {
+                        // subtrees are taken in order, so the threads stay close
+                        // together and a stopped run leaves few partial subtrees
+                        while !failed.load(Ordering::Relaxed) {
+                            let index = next.fetch_add(1, Ordering::Relaxed);
+                            let Some(prefix) = prefixes.get(index) else {
+                                break;
+                            };
+                            let name = format!(
+                                "{} s{index:05}/{} (thread {worker})",
+                                mosaic.description_str(),
+                                prefixes.len()
+                            );
+                            let res = self.run_subtree(
+                                mosaic,
+                                prefix,
+                                index,
+                                name,
+                                output_folder,
+                                resume,
+                                symmetries,
+                                filters,
+                            );
+                            let ct = complete.fetch_add(1, Ordering::Relaxed) + 1;
+                            match res {
+                                Ok(Some(sub_stats)) => {
+                                    totals.lock().unwrap().add(&sub_stats);
+                                    // only report each percent of the subtrees
+                                    if ct * 100 / prefixes.len() != (ct - 1) * 100 / prefixes.len() {
+                                        eprintln!(
+                                            "Subtree {index} done on thread {worker}, {ct}/{} complete",
+                                            prefixes.len()
+                                        );
+                                    }
+                                }
+                                Ok(None) => {} // finished in an earlier run
+                                Err(e) => {
+                                    failed.store(true, Ordering::Relaxed);
+                                    return Err(e);
+                                }
+                            }
+                        }
+                        Ok(())
+                    })
+                })
+                .collect();
+            workers
+                .into_iter()
+                .map(|w| w.join().expect("generator thread panicked"))
+                .collect::<Result<()>>()
+        })?;
+
+        let (file_ct, counts) = self.merge(output_folder, mosaic.get_len(), prefixes.len())?;
+        if let Some(shard) = &self.shard {
+            let mut info = format!(
+                "shard {}/{}\ndepth {}\n",
+                shard.index, shard.count, self.depth
+            );
+            for (prefix, ct) in prefixes.iter().zip(counts) {
+                info.push_str(&format!("{} {ct}\n", prefix_str(prefix)));
+            }
+            fs::write(output_folder.join(SHARD_FILE), info)?;
+        }
+        fs::remove_dir_all(output_folder.join(SPLIT_DIR))?;
+        eprintln!("Merged subtrees into {file_ct} files");
+        print_summary(
+            mosaic.description_str(),
+            &totals.into_inner().unwrap(),
+            symmetries.is_some(),
+            t_start,
+        );
+        Ok(())
+    }
+
+    /// Generates one subtree, returning `None` if it was already complete
+    #[allow(clippy::too_many_arguments)]
+    fn run_subtree(
+        &self,
+        mosaic: &Mosaic,
+        prefix: &[u8],
+        index: usize,
+        name: String,
+        output_folder: &Path,
+        resume: bool,
+        symmetries: &Option<Arc<Symmetries>>,
+        filters: &Filters,
+    ) -> Result<Option<GenStats>> {
+        let dir = Self::subtree_dir(output_folder, index);
+        if dir.join(DONE_FILE).is_file() {
+            return Ok(None);
+        }
+        let mut g = if resume && drop_unstarted_files(&dir, mosaic.get_len(), &self.format)? {
+            Generator::resume_mosaic_gen(mosaic.clone(), &dir, self.max_lines, self.format)?
+                .within(self.depth)
+        } else {
+            create_dir_all(&dir)?;
+            let mut mosaic = mosaic.clone();
+            for (i, tile) in prefix.iter().enumerate() {
+                mosaic.set_tile(i, *tile);
+            }
+            let out_buff =
+                RollingBufWriter::new(&dir, self.max_lines, mosaic.get_len(), self.format)?;
+            Generator::subtree(out_buff, mosaic, self.depth)
+        };
+        g.name = name;
+        g.symmetries = symmetries.clone();
+        if self.pd {
+            g.pd = PdCodes::new(mosaic);
+        }
+        generate(&mut g, filters)?;
+
+        let file_ct = g.out_buff.file_ct();
+        if file_ct == 0 {
+            fs::remove_file(RollingBufWriter::path_from_index(&dir, 0, &self.format))?;
+        }
+        fs::write(dir.join(DONE_FILE), file_ct.to_string())?;
+        Ok(Some(g.stats))
+    }
+
+    /// Copies the mosaics of every subtree, in order, into one run of files in `output_folder`.
+    /// These are the same files a single thread would write.
+    /// Returns the number of files, and of mosaics in each subtree
+    fn merge(
+        &self,
+        output_folder: &Path,
+        tile_ct: usize,
+        subtree_ct: usize,
+    ) -> Result<(usize, Vec<usize>)> {
+        let mut out_buff =
+            RollingBufWriter::new(&output_folder, self.max_lines, tile_ct, self.format)?;
+        let mut counts = Vec::with_capacity(subtree_ct);
+        for index in 0..subtree_ct {
+            let dir = Self::subtree_dir(output_folder, index);
+            let done = fs::read_to_string(dir.join(DONE_FILE))?;
+            let file_ct: usize = done.trim().parse().map_err(|_| {
+                Error::new(
+                    ErrorKind::InvalidData,
+                    format!("Bad file count in {}", dir.display()),
+                )
+            })?;
+            let mut ct = 0;
+            for i in 0..file_ct {
+                let path = RollingBufWriter::path_from_index(&dir, i, &self.format);
+                ct += out_buff.copy_from(&path, |_| Ok(()))?;
+            }
+            counts.push(ct);
+        }
+        out_buff.flush()?;
+        Ok((out_buff.file_ct(), counts))
+    }
+}
+
+/// Checks that the shards in `output_folder` together hold every subtree of the search once,
+/// with the mosaics each shard listed for them, and copies them in order into one run of files.
+/// The shards are left in place
+pub fn merge_shards(
+    mosaic: Mosaic,
+    output_folder: &Path,
+    shard_ct: usize,
+    max_lines: usize,
+    format: OutputFormat,
+    symmetries: Option<&Symmetries>,
+    filters: &Filters,
+) -> Result<()> {
+    let mut shards = vec![];
+    let mut depth = None;
+    for index in 0..shard_ct {
+        let shard = Shard {
+            index,
+            count: shard_ct,
+        };
+        let dir = output_folder.join(shard.dir_name());
+        if !dir.join("COMPLETED").is_file() {
+            return Err(Error::other(format!("{} is not complete", dir.display())));
+        }
+        let (shard_depth, subtrees) = read_shard_info(&dir, &shard)?;
+        if depth.is_some_and(|d| d != shard_depth) {
+            return Err(Error::new(
+                ErrorKind::InvalidData,
+                "Shards were split at different depths",
+            ));
+        }
+        depth = Some(shard_depth);
+        shards.push((dir, subtrees));
+    }
+    let Some(depth) = depth else {
+        return Err(Error::new(ErrorKind::InvalidInput, "No shards to merge"));
+    };
+
+    // every subtree of the whole search should be in exactly one shard, in order
+    let mut expected = vec![];
+    find_prefixes(
+        &mut mosaic.clone(),
+        0,
+        &mut vec![(0, 1); depth],
+        filters,
+        symmetries,
+        &mut expected,
+        &mut GenStats::default(),
+    );
+    let listed: Vec<&Vec<u8>> = shards
+        .iter()
+        .flat_map(|(_, s)| s.iter().map(|(p, _)| p))
+        .collect();
+    if listed.len() != expected.len() || listed.iter().zip(&expected).any(|(p, s)| **p != s.prefix)
+    {
+        let mut seen: HashMap<&[u8], usize> = HashMap::new();
+        for prefix in &listed {
+            *seen.entry(prefix.as_slice()).or_default() += 1;
+        }
+        let missing = expected
+            .iter()
+            .filter(|s| !seen.contains_key(s.prefix.as_slice()))
+            .count();
+        let repeated: usize = seen.values().map(|ct| ct - 1).sum();
+        return Err(Error::new(
+            ErrorKind::InvalidData,
+            format!(
+                "Shards don't cover the search once: {missing} subtrees missing, {repeated} repeated, {} listed of {}. Check that all shards used the same filters and --symmetry",
+                listed.len(),
+                expected.len()
+            ),
+        ));
+    }
+
+    let mut out_buff = RollingBufWriter::new(&output_folder, max_lines, mosaic.get_len(), format)?;
+    let mut last: Vec<u8> = vec![];
+    let mut total = 0;
+    for (dir, subtrees) in &shards {
+        let mut subtrees = subtrees.iter().filter(|(_, ct)| *ct > 0);
+        let mut current: Option<&Vec<u8>> = None;
+        let mut remaining = 0;
+        let mut file_index = 0;
+        loop {
+            let path = RollingBufWriter::path_from_index(dir, file_index, &format);
+            if !path.is_file() {
+                break;
+            }
+            total += out_buff.copy_from(&path, |record| {
+                // mosaics are generated in increasing order, so this also finds repeats
+                if record <= last.as_slice() {
+                    return Err(Error::new(
+                        ErrorKind::InvalidData,
+                        format!("{} is out of order", path.display()),
+                    ));
+                }
+                last.clear();
+                last.extend_from_slice(record);
+                if remaining == 0 {
+                    let Some((prefix, ct)) = subtrees.next() else {
+                        return Err(Error::new(
+                            ErrorKind::InvalidData,
+                            format!("{} has more mosaics than it lists", dir.display()),
+                        ));
+                    };
+                    current = Some(prefix);
+                    remaining = *ct;
+                }
+                let prefix = current.unwrap();
+                if (0..depth).any(|i| rolling_buff::record_tile(record, &format, i) != prefix[i]) {
+                    return Err(Error::new(
+                        ErrorKind::InvalidData,
+                        format!(
+                            "{} has a mosaic outside subtree {}",
+                            path.display(),
+                            prefix_str(prefix)
+                        ),
+                    ));
+                }
+                remaining -= 1;
+                Ok(())
+            })?;
+            file_index += 1;
+        }
+        if remaining > 0 || subtrees.next().is_some() {
+            return Err(Error::new(
+                ErrorKind::InvalidData,
+                format!("{} has fewer mosaics than it lists", dir.display()),
+            ));
+        }
+    }
+    out_buff.flush()?;
+    eprintln!(
+        "Merged {shard_ct} shards covering {} subtrees: {total} mosaics in {} files",
+        expected.len(),
+        out_buff.file_ct()
+    );
+    Ok(())
+}
+
+/// Reads the split depth, and each subtree's prefix and number of mosaics, from a shard's folder
+fn read_shard_info(dir: &Path, shard: &Shard) -> Result<(usize, Vec<(Vec<u8>, usize)>)> {
+    let bad_info = || {
+        Error::new(
+            ErrorKind::InvalidData,
+            format!("Bad {SHARD_FILE} file in {}", dir.display()),
+        )
+    };
+    let info = fs::read_to_string(dir.join(SHARD_FILE))?;
+    let mut lines = info.lines();
+    let shard_line = format!("shard {}/{}", shard.index, shard.count);
+    if lines.next() != Some(shard_line.as_str()) {
+        return Err(bad_info());
+    }
+    let depth: usize = lines
+        .next()
+        .and_then(|l| l.strip_prefix("depth "))
+        .and_then(|d| d.parse().ok())
+        .ok_or_else(bad_info)?;
+    let mut subtrees = vec![];
+    for line in lines {
+        let (prefix, ct) = line.split_once(' ').ok_or_else(bad_info)?;
+        let prefix: Option<Vec<u8>> = prefix
+            .chars()
+            .map(|c| c.to_digit(16).map(|t| t as u8))
+            .collect();
+        let prefix = prefix.filter(|p| p.len() == depth).ok_or_else(bad_info)?;
+        subtrees.push((prefix, ct.parse().map_err(|_| bad_info())?));
+    }
+    Ok((depth, subtrees))
+}
+
+struct Subtree {
+    /// The first tiles of every mosaic in the subtree
+    prefix: Vec<u8>,
+    /// Estimated part of the search before this subtree
+    start: f64,
+}
+
+/// Lists the subtrees below each valid choice of the first `progress.len()` tiles,
+/// in the order they are generated.
+/// Prunes the same way `generate` does, so no subtree is empty because of its prefix
+fn find_prefixes(
+    mosaic: &mut Mosaic,
+    index: usize,
+    progress: &mut [(i32, i32)],
+    filters: &Filters,
+    symmetries: Option<&Symmetries>,
+    subtrees: &mut Vec<Subtree>,
+    stats: &mut GenStats,
+) {
+    let depth = progress.len();
+    if index == depth {
+        subtrees.push(Subtree {
+            prefix: mosaic.tiles()[..depth].to_vec(),
+            start: progress_fraction(progress),
+        });
+        return;
+    }
+    let valid = mosaic.get_valid_tiles(index);
+    for (i, &tile) in valid.iter().enumerate() {
+        progress[index] = (i as i32, valid.len() as i32);
+        mosaic.set_tile(index, tile);
+        if prune(mosaic, filters, symmetries, stats) {
+            continue;
+        }
+        find_prefixes(
+            mosaic,
+            index + 1,
+            progress,
+            filters,
+            symmetries,
+            subtrees,
+            stats,
+        );
+    }
+    mosaic.set_tile(index, 11);
+}
+
+fn prefix_str(prefix: &[u8]) -> String {
+    prefix
+        .iter()
+        .map(|t| char::from_digit(*t as u32, 16).unwrap())
+        .collect()
+}
+
+fn manifest_str(depth: usize, prefixes: &[Vec<u8>]) -> String {
+    let mut out = format!("depth {depth}\n");
+    for prefix in prefixes {
+        out.push_str(&prefix_str(prefix));
+        out.push('\n');
+    }
+    out
+}
+
+/// Removes files at the end of a subtree's folder that don't start with a whole mosaic,
+/// as `Generator::resume_mosaic_gen` restarts from the first mosaic of the last file.
+/// Returns false if there is nothing to resume from
+fn drop_unstarted_files(dir: &Path, tile_ct: usize, format: &OutputFormat) -> Result<bool> {
+    let mut file_ct = 0;
+    while RollingBufWriter::path_from_index(dir, file_ct, format).is_file() {
+        file_ct += 1;
+    }
+    while file_ct > 0 {
+        let path = RollingBufWriter::path_from_index(dir, file_ct - 1, format);
+        match rolling_buff::read_first_mosaic(&path, format) {
+            Ok(mos_str) if mos_str.len() == tile_ct => return Ok(true),
+            Ok(_) => {}
+            Err(e) if e.kind() == ErrorKind::UnexpectedEof => {}
+            Err(e) => return Err(e),
+        }
+        fs::remove_file(path)?;
+        file_ct -= 1;
+    }
+    Ok(false)
+}
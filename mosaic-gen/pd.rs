@@ -0,0 +1,204 @@
+use std::fmt::Write;
+
+use crate::MosaicVariant;
+use crate::conn_table::TILE_ARCS;
+use crate::mosaics::Mosaic;
+
+/// The side each tile is first entered from, the first key of its
+/// `connections_dict` entry in mosaics.py, so the edges are numbered the same
+const START_SIDE: [u8; 11] = [0, 2, 0, 0, 2, 2, 1, 2, 0, 0, 0];
+/// Marks a closed edge in `PdCodes::glue`
+const CLOSED: u32 = u32::MAX;
+
+/// Why a complete mosaic has no PD codes, as `NotAKnot` in mosaics.py
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub enum NotAKnot {
+    NoTiles,
+    BadConnections,
+    Link,
+}
+
+/// Finds the PD codes of complete mosaics by following the strand around them,
+/// giving the same codes as `traverse_mosaic` in mosaics.py.
+/// Mobius mosaics are laid out as `NormMosaic.build_mobius` does, with the hidden
+/// crossings on the back of the band
+pub struct PdCodes {
+    /// Size of a mobius mosaic, which is laid out twice as wide
+    mobius_size: Option<usize>,
+    /// The tiles being traversed, in the layout the edges are numbered in
+    tiles: Vec<u8>,
+    /// Side (as `index * 4 + side`) entered after leaving through each side
+    glue: Vec<u32>,
+    under: Vec<(u32, u32)>, // (side entered from, edge) of each under crossing
+    over: Vec<(u8, u32)>,   // (side entered from, edge) of the over crossing at each tile
+    codes: Vec<[u32; 4]>,
+}
+impl PdCodes {
+    /// `mosaic` should be empty, None for toric mosaics, which mosaics.py can't traverse
+    /// either as they need hidden crossings that aren't worked out
+    pub fn new(mosaic: &Mosaic) -> Option<PdCodes> {
+        let len = mosaic.get_len();
+        let (mobius_size, glue) = match mosaic.variant() {
+            MosaicVariant::Toric => return None,
+            MosaicVariant::Mobius => {
+                let size = (len as f64).sqrt().round() as usize;
+                (Some(size), mobius_glue(size))
+            }
+            _ => {
+                let glue = (0..len * 4)
+                    .map(|slot| match mosaic.neighbor(slot / 4, (slot % 4) as u8) {
+                        Some((next, (entry_side, _))) => (next * 4 + entry_side as usize) as u32,
+                        None => CLOSED,
+                    })
+                    .collect();
+                (None, glue)
+            }
+        };
+        let tile_ct = glue.len() / 4;
+        Some(PdCodes {
+            mobius_size,
+            tiles: vec![0; tile_ct],
+            glue,
+            under: vec![],
+            over: vec![(0, 0); tile_ct],
+            codes: vec![],
+        })
+    }
+
+    /// Follows the strand from the first tile, keeping the PD codes if it is a knot.
+    /// Like `traverse_mosaic(prune_unknots=False)`, there are no codes for under 3 crossings
+    pub fn traverse(&mut self, tiles: &[u8]) -> Result<(), NotAKnot> {
+        self.layout(tiles);
+        self.under.clear();
+        self.codes.clear();
+        let Some(start) = self.tiles.iter().position(|t| !matches!(t, 0 | 12)) else {
+            return Err(NotAKnot::NoTiles);
+        };
+        // a knot passes through every arc of every tile once
+        let exp_moves: usize = self
+            .tiles
+            .iter()
+            .map(|t| TILE_ARCS[*t as usize].len())
+            .sum();
+
+        let start_slot = (start * 4) as u32 + START_SIDE[self.tiles[start] as usize] as u32;
+        let mut slot = start_slot;
+        let mut move_ct = 0;
+        let mut edge_ct = 0;
+        loop {
+            move_ct += 1;
+            if move_ct > exp_moves {
+                return Err(NotAKnot::BadConnections);
+            }
+            let (index, side) = ((slot / 4) as usize, (slot % 4) as u8);
+            let tile = self.tiles[index];
+            if tile == 9 || tile == 10 {
+                edge_ct += 1;
+                if (tile == 10) ^ (side % 2 == 0) {
+                    self.under.push((slot, edge_ct));
+                } else {
+                    self.over[index] = (side, edge_ct);
+                }
+            }
+            let Some(arc) = TILE_ARCS[tile as usize].iter().find(|a| a.contains(&side)) else {
+                return Err(NotAKnot::BadConnections);
+            };
+            let out_side = if arc[0] == side { arc[1] } else { arc[0] };
+            slot = self.glue[index * 4 + out_side as usize];
+            if slot == CLOSED {
+                return Err(NotAKnot::BadConnections);
+            }
+            if slot == start_slot {
+                break;
+            }
+        }
+        if move_ct != exp_moves {
+            return Err(NotAKnot::Link);
+        }
+        if self.under.len() < 3 {
+            return Ok(());
+        }
+
+        // see https://katlas.org/wiki/Planar_Diagrams
+        let max_edge = 2 * self.under.len() as u32;
+        let wrap = |e: u32| if e > max_edge { 1 } else { e };
+        for (u_slot, u_edge) in &self.under {
+            let (o_side, o_edge) = self.over[(u_slot / 4) as usize];
+            // check if the over crossing starts from left or right
+            let code = if o_side as u32 == (u_slot % 4 + 1) % 4 {
+                [*u_edge, o_edge, u_edge + 1, o_edge + 1]
+            } else {
+                [*u_edge, o_edge + 1, u_edge + 1, o_edge]
+            };
+            self.codes.push(code.map(wrap));
+        }
+        Ok(())
+    }
+
+    /// Appends ` <tile count> <PD codes>` for the last mosaic traversed to `out`,
+    /// with the codes written as `1,4,2,5;3,6,4,1;...`
+    pub fn write_fields(&self, tiles: &[u8], out: &mut String) {
+        let tile_ct = tiles.iter().filter(|t| !matches!(t, 0 | 12)).count();
+        // writing to a String can't fail
+        let _ = write!(out, " {tile_ct} ");
+        for (i, [a, b, c, d]) in self.codes.iter().enumerate() {
+            if i > 0 {
+                out.push(';');
+            }
+            let _ = write!(out, "{a},{b},{c},{d}");
+        }
+    }
+
+    fn layout(&mut self, tiles: &[u8]) {
+        let Some(size) = self.mobius_size else {
+            self.tiles.copy_from_slice(tiles);
+            return;
+        };
+        let width = size * 2;
+        self.tiles.fill(0);
+        for (y, row) in tiles.chunks(size).enumerate() {
+            self.tiles[y * width..y * width + size].copy_from_slice(row);
+        }
+        // filling in the crossings on the back of the band, for each strand leaving
+        // the right edge it turns at a corner and goes up to the top edge
+        for y in 0..size {
+            let tile = self.tiles[y * width + size - 1];
+            if !TILE_ARCS[tile as usize].iter().any(|a| a.contains(&0)) {
+                continue;
+            }
+            let corner_x = width - 1 - y;
+            self.tiles[y * width + corner_x] = 4;
+            self.tiles[y * width + size..y * width + corner_x].fill(5);
+            for y2 in 0..y {
+                let t = &mut self.tiles[y2 * width + corner_x];
+                *t = if *t != 0 { 10 } else { 6 };
+            }
+        }
+    }
+}
+
+/// Edges of the `2 * size` wide layout of a mobius mosaic, the left edge is glued
+/// to the top of the back of the band
+fn mobius_glue(size: usize) -> Vec<u32> {
+    let width = size * 2;
+    let slot = |x: usize, y: usize, side: usize| ((y * width + x) * 4 + side) as u32;
+    let mut glue = vec![CLOSED; width * size * 4];
+    for y in 0..size {
+        for x in 0..width {
+            if x + 1 < width {
+                glue[slot(x, y, 0) as usize] = slot(x + 1, y, 2);
+                glue[slot(x + 1, y, 2) as usize] = slot(x, y, 0);
+            }
+            if y + 1 < size {
+                glue[slot(x, y, 3) as usize] = slot(x, y + 1, 1);
+                glue[slot(x, y + 1, 1) as usize] = slot(x, y, 3);
+            }
+        }
+    }
+    for i in 0..size {
+        let (left, top) = (slot(0, size - 1 - i, 2), slot(width - 1 - i, 0, 1));
+        glue[left as usize] = top;
+        glue[top as usize] = left;
+    }
+    glue
+}
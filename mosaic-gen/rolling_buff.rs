@@ -1,14 +1,89 @@
 use std::fs::File;
-use std::io::{self, BufWriter, Write};
+use std::io::{self, BufReader, BufWriter, Read, Write};
 use std::path::{Path, PathBuf};
 
+/// Identifies a packed mosaic file
+pub const PACKED_MAGIC: &[u8; 4] = b"KMOS";
+pub const PACKED_VERSION: u8 = 1;
+/// Size of the header at the start of every packed file
+pub const PACKED_HEADER_LEN: usize = 16;
+
+/// Header written at the start of each packed file. Layout (little-endian):
+/// ```text
+///  0..4   magic "KMOS"
+///  4      format version
+///  5      variant code (flat, cyl, toric, mobius, cubic)
+///  6      index into CUBIC_TYPES, 0xFF for non-cubic mosaics
+///  7      mosaic size
+///  8..10  number of tiles per mosaic
+///  10..12 bytes per record
+///  12..16 reserved
+/// ```
+/// Each record stores 2 tiles per byte, the first tile in the high nibble.
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub struct PackedHeader {
+    pub variant: u8,
+    pub cubic_type: u8,
+    pub size: u8,
+    pub tile_ct: u16,
+}
+impl PackedHeader {
+    pub fn record_len(&self) -> usize {
+        (self.tile_ct as usize).div_ceil(2)
+    }
+    pub fn to_bytes(&self) -> [u8; PACKED_HEADER_LEN] {
+        let mut out = [0u8; PACKED_HEADER_LEN];
+        out[0..4].copy_from_slice(PACKED_MAGIC);
+        out[4] = PACKED_VERSION;
+        out[5] = self.variant;
+        out[6] = self.cubic_type;
+        out[7] = self.size;
+        out[8..10].copy_from_slice(&self.tile_ct.to_le_bytes());
+        out[10..12].copy_from_slice(&(self.record_len() as u16).to_le_bytes());
+        out
+    }
+    pub fn from_bytes(bytes: &[u8; PACKED_HEADER_LEN]) -> io::Result<PackedHeader> {
+        if &bytes[0..4] != PACKED_MAGIC || bytes[4] != PACKED_VERSION {
+            return Err(io::Error::new(
+                io::ErrorKind::InvalidData,
+                "Not a packed mosaic file",
+            ));
+        }
+        Ok(PackedHeader {
+            variant: bytes[5],
+            cubic_type: bytes[6],
+            size: bytes[7],
+            tile_ct: u16::from_le_bytes([bytes[8], bytes[9]]),
+        })
+    }
+}
+
+#[derive(Clone, Copy)]
+pub enum OutputFormat {
+    /// One hex string per line
+    Text,
+    /// Fixed-length records of 4 bits per tile, after a `PackedHeader`
+    Packed(PackedHeader),
+}
+impl OutputFormat {
+    pub fn extension(&self) -> &'static str {
+        match self {
+            OutputFormat::Text => "txt",
+            OutputFormat::Packed(_) => "bin",
+        }
+    }
+}
+
 pub struct RollingBufWriter {
-    output_dir: PathBuf,
+    /// `None` when streaming to stdout
+    output_dir: Option<PathBuf>,
     pub max_lines: usize,
     current_lines: usize,
     file_index: usize,
     buf_size: usize,
-    writer: BufWriter<File>,
+    format: OutputFormat,
+    record: Vec<u8>,
+    writer: BufWriter<Box<dyn Write>>,
 }
 pub enum RollOver {
     Rolled(usize),
@@ -20,71 +95,213 @@ impl RollingBufWriter {
         base_path: &P,
         max_lines: usize,
         line_len: usize,
+        format: OutputFormat,
     ) -> io::Result<Self> {
-        let base_path = base_path.as_ref().to_path_buf();
-        let buf_size = line_len * 2000;
-        let writer = Self::open_file(&base_path, 0, buf_size)?;
-        Ok(Self {
-            output_dir: base_path,
-            max_lines,
-            current_lines: 0,
-            file_index: 0,
-            buf_size,
-            writer,
-        })
+        Self::resume_from(base_path, max_lines, line_len, 0, format)
     }
     pub fn resume_from<P: AsRef<Path>>(
         base_path: &P,
         max_lines: usize,
         line_len: usize,
         start_file_ind: usize,
+        format: OutputFormat,
     ) -> io::Result<Self> {
         let base_path = base_path.as_ref().to_path_buf();
         let buf_size = line_len * 2000;
-        let writer = Self::open_file(&base_path, start_file_ind, buf_size)?;
+        let writer = Self::open_file(&base_path, start_file_ind, buf_size, &format)?;
 
         Ok(Self {
-            output_dir: base_path,
+            output_dir: Some(base_path),
             max_lines,
             current_lines: 0,
             file_index: start_file_ind,
             buf_size,
+            format,
+            record: Vec::with_capacity(line_len + 1),
             writer,
         })
     }
-    
-    pub fn path_from_index(base_path: &Path, index: usize)->PathBuf{
-        base_path.join(format!("pt{index:04}.txt"))
+
+    /// Writes all mosaics to stdout, with packed files only having one header.
+    /// Still counts `max_lines` chunks, so progress is reported the same way
+    pub fn stdout(max_lines: usize, line_len: usize, format: OutputFormat) -> io::Result<Self> {
+        let buf_size = line_len * 2000;
+        let mut writer: BufWriter<Box<dyn Write>> =
+            BufWriter::with_capacity(buf_size, Box::new(io::stdout().lock()));
+        if let OutputFormat::Packed(header) = format {
+            writer.write_all(&header.to_bytes())?;
+        }
+        Ok(Self {
+            output_dir: None,
+            max_lines,
+            current_lines: 0,
+            file_index: 0,
+            buf_size,
+            format,
+            record: Vec::with_capacity(line_len + 1),
+            writer,
+        })
+    }
+
+    pub fn path_from_index(base_path: &Path, index: usize, format: &OutputFormat) -> PathBuf {
+        base_path.join(format!("pt{index:04}.{}", format.extension()))
     }
 
-    fn open_file(base_path: &Path, index: usize, buf_size: usize) -> io::Result<BufWriter<File>> {
-        let path = Self::path_from_index(base_path, index);
+    fn open_file(
+        base_path: &Path,
+        index: usize,
+        buf_size: usize,
+        format: &OutputFormat,
+    ) -> io::Result<BufWriter<Box<dyn Write>>> {
+        let path = Self::path_from_index(base_path, index, format);
         let file = File::create(path)?;
-        Ok(BufWriter::with_capacity(buf_size, file))
+        let mut writer: BufWriter<Box<dyn Write>> =
+            BufWriter::with_capacity(buf_size, Box::new(file));
+        if let OutputFormat::Packed(header) = format {
+            writer.write_all(&header.to_bytes())?;
+        }
+        Ok(writer)
     }
 
     fn roll(&mut self) -> io::Result<()> {
         self.writer.flush()?;
         self.file_index += 1;
         self.current_lines = 0;
-        self.writer = Self::open_file(&self.output_dir, self.file_index, self.buf_size)?;
+        if let Some(dir) = &self.output_dir {
+            self.writer = Self::open_file(dir, self.file_index, self.buf_size, &self.format)?;
+        }
         Ok(())
     }
 
-    pub fn write_line(&mut self, line: &str) -> io::Result<RollOver> {
-        let rolled = if self.current_lines >= self.max_lines {
+    fn start_line(&mut self) -> io::Result<RollOver> {
+        if self.current_lines >= self.max_lines {
             self.roll()?;
-            RollOver::Rolled(self.file_index)
+            Ok(RollOver::Rolled(self.file_index))
         } else {
-            RollOver::NoRollover
-        };
+            Ok(RollOver::NoRollover)
+        }
+    }
+
+    /// Writes one mosaic, in whichever format this writer was created with
+    pub fn write_tiles(&mut self, tiles: &[u8]) -> io::Result<RollOver> {
+        self.write_tiles_with(tiles, "")
+    }
+    /// Writes one mosaic followed by `fields` on the same line, for text output
+    pub fn write_tiles_with(&mut self, tiles: &[u8], fields: &str) -> io::Result<RollOver> {
+        let rolled = self.start_line()?;
 
-        writeln!(self.writer, "{}", line)?;
+        self.record.clear();
+        match self.format {
+            OutputFormat::Text => {
+                self.record
+                    .extend(tiles.iter().map(|t| HEX_DIGITS[*t as usize]));
+                self.record.extend_from_slice(fields.as_bytes());
+                self.record.push(b'\n');
+            }
+            OutputFormat::Packed(_) => {
+                self.record.extend(
+                    tiles
+                        .chunks(2)
+                        .map(|c| (c[0] << 4) | c.get(1).copied().unwrap_or(0)),
+                );
+            }
+        }
+        self.writer.write_all(&self.record)?;
 
         self.current_lines += 1;
         Ok(rolled)
     }
+    /// Copies every mosaic of a file written in the same format, passing each record
+    /// to `inspect` before it is written. Returns the number of mosaics copied
+    pub fn copy_from(
+        &mut self,
+        path: &Path,
+        mut inspect: impl FnMut(&[u8]) -> io::Result<()>,
+    ) -> io::Result<usize> {
+        let mut reader = BufReader::new(File::open(path)?);
+        let mut record = vec![];
+        if let OutputFormat::Packed(header) = self.format {
+            let mut head = [0u8; PACKED_HEADER_LEN];
+            reader.read_exact(&mut head)?;
+            if PackedHeader::from_bytes(&head)? != header {
+                return Err(io::Error::new(
+                    io::ErrorKind::InvalidData,
+                    format!("{} holds a different type of mosaic", path.display()),
+                ));
+            }
+            record.resize(header.record_len(), 0);
+        }
+        let mut ct = 0;
+        loop {
+            let found = match self.format {
+                OutputFormat::Text => {
+                    record.clear();
+                    io::BufRead::read_until(&mut reader, b'\n', &mut record)? > 0
+                }
+                OutputFormat::Packed(_) => match reader.read_exact(&mut record) {
+                    Ok(()) => true,
+                    Err(e) if e.kind() == io::ErrorKind::UnexpectedEof => false,
+                    Err(e) => return Err(e),
+                },
+            };
+            if !found {
+                return Ok(ct);
+            }
+            inspect(&record)?;
+            self.start_line()?;
+            self.writer.write_all(&record)?;
+            self.current_lines += 1;
+            ct += 1;
+        }
+    }
+    /// Number of files with mosaics in them, `0` if nothing has been written
+    pub fn file_ct(&self) -> usize {
+        if self.file_index == 0 && self.current_lines == 0 {
+            0
+        } else {
+            self.file_index + 1
+        }
+    }
     pub fn flush(&mut self) -> io::Result<()> {
         self.writer.flush()
     }
 }
+
+const HEX_DIGITS: &[u8; 16] = b"0123456789abcdef";
+
+/// Tile `index` of a record as written by `RollingBufWriter::write_tiles`
+pub fn record_tile(record: &[u8], format: &OutputFormat, index: usize) -> u8 {
+    match format {
+        OutputFormat::Text => (record[index] as char).to_digit(16).unwrap_or(u32::MAX) as u8,
+        OutputFormat::Packed(_) => {
+            let byte = record[index / 2];
+            if index % 2 == 0 { byte >> 4 } else { byte & 0xF }
+        }
+    }
+}
+
+/// Reads the first mosaic of an output file as a hex string,
+/// without any fields written after it
+pub fn read_first_mosaic(path: &Path, format: &OutputFormat) -> io::Result<String> {
+    let mut reader = BufReader::new(File::open(path)?);
+    match format {
+        OutputFormat::Text => {
+            let mut line = String::new();
+            io::BufRead::read_line(&mut reader, &mut line)?;
+            Ok(line.split_whitespace().next().unwrap_or("").to_string())
+        }
+        OutputFormat::Packed(_) => {
+            let mut head = [0u8; PACKED_HEADER_LEN];
+            reader.read_exact(&mut head)?;
+            let header = PackedHeader::from_bytes(&head)?;
+            let mut record = vec![0u8; header.record_len()];
+            reader.read_exact(&mut record)?;
+            Ok(record
+                .iter()
+                .flat_map(|b| [b >> 4, b & 0xF])
+                .take(header.tile_ct as usize)
+                .map(|t| HEX_DIGITS[t as usize] as char)
+                .collect())
+        }
+    }
+}
@@ -0,0 +1,390 @@
+use crate::MosaicVariant;
+use crate::conn_table::TILE_ARCS;
+use crate::mosaics::Mosaic;
+
+/// Tiles that stay the same under any symmetry: blank, unknown, locked blank
+const FIXED_TILES: [u8; 3] = [0, 11, 12];
+/// Crossings, by which way the strand on top runs: 9 horizontal, 10 vertical
+const HORZ_OVER: u8 = 9;
+const VERT_OVER: u8 = 10;
+
+/// An element of the symmetry group of a square, acting on side numbers.
+/// Side `s` goes to `k + s`, or `k - s` for reflections (mod 4).
+#[derive(Clone, Copy, PartialEq, Debug)]
+struct Frame {
+    k: u8,
+    reflect: bool,
+}
+impl Frame {
+    const IDENTITY: Frame = Frame {
+        k: 0,
+        reflect: false,
+    };
+    fn all() -> impl Iterator<Item = Frame> {
+        (0..8).map(|i| Frame {
+            k: i % 4,
+            reflect: i >= 4,
+        })
+    }
+    fn index(&self) -> usize {
+        self.k as usize + if self.reflect { 4 } else { 0 }
+    }
+    fn apply(&self, side: u8) -> u8 {
+        if self.reflect {
+            (self.k + 4 - side) % 4
+        } else {
+            (self.k + side) % 4
+        }
+    }
+    /// `self` after `other`
+    fn compose(&self, other: &Frame) -> Frame {
+        Frame {
+            k: self.apply(other.k),
+            reflect: self.reflect != other.reflect,
+        }
+    }
+    fn inverse(&self) -> Frame {
+        if self.reflect {
+            *self
+        } else {
+            Frame {
+                k: (4 - self.k) % 4,
+                reflect: false,
+            }
+        }
+    }
+    /// The tile that `tile` becomes when its sides are moved by this frame.
+    /// Reflections also switch crossings, so the knot is rotated in 3D rather than mirrored
+    fn tile_map(&self) -> [u8; 13] {
+        let mut map: [u8; 13] = std::array::from_fn(|t| t as u8);
+        // crossings have the same arcs either way up, so they are handled below
+        for (tile, arcs) in TILE_ARCS[..HORZ_OVER as usize].iter().enumerate() {
+            let moved: Vec<[u8; 2]> = arcs
+                .iter()
+                .map(|[a, b]| sorted([self.apply(*a), self.apply(*b)]))
+                .collect();
+            map[tile] = TILE_ARCS[..HORZ_OVER as usize]
+                .iter()
+                .position(|other| {
+                    other.len() == moved.len() && other.iter().all(|arc| moved.contains(arc))
+                })
+                .unwrap() as u8;
+        }
+        // a horizontal strand stays horizontal if side 0 goes to 0 or 2
+        let keeps_axis = self.apply(0) % 2 == 0;
+        let (horz, vert) = if keeps_axis != self.reflect {
+            (HORZ_OVER, VERT_OVER)
+        } else {
+            (VERT_OVER, HORZ_OVER)
+        };
+        map[HORZ_OVER as usize] = horz;
+        map[VERT_OVER as usize] = vert;
+        for t in FIXED_TILES {
+            map[t as usize] = t;
+        }
+        map
+    }
+}
+fn sorted([a, b]: [u8; 2]) -> [u8; 2] {
+    if a < b { [a, b] } else { [b, a] }
+}
+
+/// One symmetry of a mosaic: tile `i` of the image is
+/// `tile_maps[frames[i]][tiles[sources[i]]]`
+struct Symmetry {
+    sources: Vec<u16>,
+    frames: Vec<u8>,
+}
+
+/// The symmetries of a type of mosaic which keep the knot the same.
+/// Only the smallest mosaic of each orbit (as a hex string) is kept, which is
+/// also the mosaic the catalog would prefer, so no results are lost.
+pub struct Symmetries {
+    group: Vec<Symmetry>,
+    tile_maps: [[u8; 13]; 8],
+}
+impl Symmetries {
+    /// Finds all ways to map the tiles of `mosaic` onto themselves so that
+    /// neighbors stay neighbors, then keeps those that don't mirror the knot
+    pub fn of(mosaic: &Mosaic) -> Symmetries {
+        let mut tile_maps = [[0; 13]; 8];
+        for frame in Frame::all() {
+            tile_maps[frame.index()] = frame.tile_map();
+        }
+        let free: Vec<usize> = (0..mosaic.get_len())
+            .filter(|i| mosaic.tiles()[*i] != 12)
+            .collect();
+        let mut group = vec![];
+        if let Some(&start) = free.first() {
+            for &target in &free {
+                for frame in Frame::all() {
+                    if target == start && frame == Frame::IDENTITY {
+                        continue;
+                    }
+                    if !keeps_knot(mosaic.variant(), &frame) {
+                        continue;
+                    }
+                    if let Some(sym) = map_from(mosaic, start, target, frame) {
+                        group.push(sym);
+                    }
+                }
+            }
+        }
+        Symmetries { group, tile_maps }
+    }
+    /// Number of symmetries, not counting the identity
+    pub fn len(&self) -> usize {
+        self.group.len()
+    }
+    /// True if some symmetry is sure to give a smaller mosaic, whatever the unset tiles (11) are.
+    /// Exact for complete mosaics
+    pub fn is_dominated(&self, tiles: &[u8]) -> bool {
+        'sym: for sym in &self.group {
+            for i in 0..tiles.len() {
+                let tile = tiles[i];
+                let source = tiles[sym.sources[i] as usize];
+                if tile == 11 || source == 11 {
+                    continue 'sym;
+                }
+                let image = self.tile_maps[sym.frames[i] as usize][source as usize];
+                if image != tile {
+                    if image < tile {
+                        return true;
+                    }
+                    continue 'sym;
+                }
+            }
+        }
+        false
+    }
+}
+
+/// Whether a symmetry with this frame (at any tile) keeps the knot the same
+fn keeps_knot(variant: &MosaicVariant, _frame: &Frame) -> bool {
+    match variant {
+        // Which symmetries of the torus keep the knot can't be checked against
+        // the catalog yet, as it can't traverse toric mosaics. So none are used
+        MosaicVariant::Toric => false,
+        // Flat, cylindrical and cubic mosaics lie on a sphere, and the mobius
+        // band's symmetries are rotations of its core circle
+        _ => true,
+    }
+}
+
+/// Extends `start -> target` with `frame` to a map of the whole mosaic, if it keeps neighbors
+fn map_from(mosaic: &Mosaic, start: usize, target: usize, frame: Frame) -> Option<Symmetry> {
+    let len = mosaic.get_len();
+    // for each tile, where it goes and how it's turned
+    let mut images: Vec<Option<(usize, Frame)>> = vec![None; len];
+    let mut used = vec![false; len];
+    images[start] = Some((target, frame));
+    used[target] = true;
+    let mut stack = vec![start];
+    while let Some(a) = stack.pop() {
+        let (b, frame) = images[a].unwrap();
+        for side in 0..4 {
+            let b_side = frame.apply(side);
+            let (next_a, glue_a, next_b, glue_b) =
+                match (mosaic.neighbor(a, side), mosaic.neighbor(b, b_side)) {
+                    (None, None) => continue,
+                    (Some((na, ga)), Some((nb, gb))) => (na, ga, nb, gb),
+                    _ => return None,
+                };
+            let next_frame = glue_to_frame(b_side, glue_b)
+                .compose(&frame)
+                .compose(&glue_to_frame(side, glue_a).inverse());
+            match images[next_a] {
+                Some(image) if image == (next_b, next_frame) => {}
+                Some(_) => return None,
+                None => {
+                    if used[next_b] {
+                        return None;
+                    }
+                    used[next_b] = true;
+                    images[next_a] = Some((next_b, next_frame));
+                    stack.push(next_a);
+                }
+            }
+        }
+    }
+    let mut sources: Vec<u16> = (0..len as u16).collect();
+    let mut frames = vec![Frame::IDENTITY.index() as u8; len];
+    for (a, image) in images.iter().enumerate() {
+        if let Some((b, frame)) = image {
+            sources[*b] = a as u16;
+            frames[*b] = frame.index() as u8;
+        } else if mosaic.tiles()[a] != 12 {
+            // can't reach every tile, so it's not a symmetry
+            return None;
+        }
+    }
+    Some(Symmetry { sources, frames })
+}
+
+/// How sides are renamed when moving out of `side` into a neighbor
+fn glue_to_frame(side: u8, glue: (u8, bool)) -> Frame {
+    let (entry_side, twisted) = glue;
+    // leaving through `side` is the same direction as leaving the neighbor opposite its entry
+    let dir = (entry_side + 2) % 4;
+    if twisted {
+        Frame {
+            k: (dir + side) % 4,
+            reflect: true,
+        }
+    } else {
+        Frame {
+            k: (dir + 4 - side) % 4,
+            reflect: false,
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn cubic(size: usize, cubic_type: &str) -> Mosaic {
+        Mosaic::new(
+            size,
+            MosaicVariant::Cubic {
+                cubic_type: cubic_type.to_string(),
+            },
+        )
+    }
+
+    /// The mosaic a symmetry maps `tiles` to
+    fn image(syms: &Symmetries, sym: &Symmetry, tiles: &[u8]) -> Vec<u8> {
+        (0..tiles.len())
+            .map(|i| {
+                syms.tile_maps[sym.frames[i] as usize][tiles[sym.sources[i] as usize] as usize]
+            })
+            .collect()
+    }
+
+    /// xorshift, so the tests don't need a rand crate
+    struct Rng(u64);
+    impl Rng {
+        fn below(&mut self, n: u64) -> u64 {
+            self.0 ^= self.0 << 13;
+            self.0 ^= self.0 >> 7;
+            self.0 ^= self.0 << 17;
+            self.0 % n
+        }
+    }
+
+    #[test]
+    fn group_sizes() {
+        let len = |mosaic: &Mosaic| Symmetries::of(mosaic).len();
+        for size in 2..6 {
+            // the square's rotations and reflections
+            assert_eq!(len(&Mosaic::new(size, MosaicVariant::Flat)), 7);
+            // shifts around the cylinder, times flipping it either way
+            assert_eq!(
+                len(&Mosaic::new(size, MosaicVariant::Cylindrical)),
+                4 * size - 1
+            );
+            // going around the band twice is the identity, times flipping it end to end
+            assert_eq!(len(&Mosaic::new(size, MosaicVariant::Mobius)), 4 * size - 1);
+            // not supported yet, see keeps_knot
+            assert_eq!(len(&Mosaic::new(size, MosaicVariant::Toric)), 0);
+        }
+        for size in 2..4 {
+            // the cube's rotations and reflections
+            assert_eq!(len(&cubic(size, "6")), 47);
+            // the square's, around the axis through the missing face
+            assert_eq!(len(&cubic(size, "5")), 7);
+            // a corner of the cube, whose faces can be rotated or swapped
+            assert_eq!(len(&cubic(size, "3_bent")), 5);
+            // swapping the ends of the row, and flipping it across its middle
+            assert_eq!(len(&cubic(size, "3_line")), 3);
+            assert_eq!(len(&cubic(size, "2")), 3);
+            // a tube of 4 faces, which can be shifted by single tiles like a cylinder
+            assert_eq!(len(&cubic(size, "4_line")), 16 * size - 1);
+        }
+    }
+
+    #[test]
+    fn frames_form_a_group() {
+        for a in Frame::all() {
+            assert_eq!(a.compose(&a.inverse()), Frame::IDENTITY);
+            assert_eq!(a.inverse().compose(&a), Frame::IDENTITY);
+            for b in Frame::all() {
+                for side in 0..4 {
+                    assert_eq!(a.compose(&b).apply(side), a.apply(b.apply(side)));
+                }
+            }
+        }
+    }
+
+    #[test]
+    fn tile_maps() {
+        for frame in Frame::all() {
+            let map = frame.tile_map();
+            let inverse = frame.inverse().tile_map();
+            for tile in 0..13 {
+                assert_eq!(inverse[map[tile] as usize] as usize, tile, "{frame:?}");
+            }
+            // the strand on top is horizontal after turning a quarter, or after reflecting,
+            // but not both, as a reflection also switches which strand is on top
+            let quarter_turn = frame.apply(0) % 2 == 1;
+            let expected = if quarter_turn != frame.reflect {
+                VERT_OVER
+            } else {
+                HORZ_OVER
+            };
+            assert_eq!(map[HORZ_OVER as usize], expected, "{frame:?}");
+        }
+        // reflecting left to right keeps both strands where they are, switching the crossing
+        let mirror = Frame {
+            k: 2,
+            reflect: true,
+        };
+        assert_eq!(mirror.tile_map()[HORZ_OVER as usize], VERT_OVER);
+        assert_eq!(mirror.tile_map()[VERT_OVER as usize], HORZ_OVER);
+    }
+
+    /// Checks is_dominated against the orbits of random complete mosaics, and that it's
+    /// only true for partial mosaics if the mosaic they are part of isn't the smallest
+    fn check_dominated(mosaic: &Mosaic, seed: u64) {
+        let syms = Symmetries::of(mosaic);
+        let free: Vec<usize> = (0..mosaic.get_len())
+            .filter(|i| mosaic.tiles()[*i] != 12)
+            .collect();
+        let mut rng = Rng(seed);
+        for _ in 0..2000 {
+            let mut tiles = mosaic.tiles().to_vec();
+            // few different tiles, so some mosaics are their own images
+            let tile_ct = 2 + rng.below(10);
+            for &i in &free {
+                tiles[i] = rng.below(tile_ct) as u8;
+            }
+            let orbit_min = syms.group.iter().map(|s| image(&syms, s, &tiles)).min();
+            let smallest = orbit_min.is_none_or(|min| min >= tiles);
+            assert_eq!(syms.is_dominated(&tiles), !smallest, "{tiles:?}");
+
+            // tiles are set in order while generating, and any can be unset while checking
+            for k in 0..=free.len() {
+                let mut partial = tiles.clone();
+                free[k..].iter().for_each(|&i| partial[i] = 11);
+                assert!(!syms.is_dominated(&partial) || !smallest, "{partial:?}");
+            }
+            let mut partial = tiles.clone();
+            free.iter()
+                .filter(|_| rng.below(3) == 0)
+                .for_each(|&i| partial[i] = 11);
+            assert!(!syms.is_dominated(&partial) || !smallest, "{partial:?}");
+        }
+    }
+
+    #[test]
+    fn is_dominated_matches_orbits() {
+        for size in 2..5 {
+            check_dominated(&Mosaic::new(size, MosaicVariant::Flat), 1);
+            check_dominated(&Mosaic::new(size, MosaicVariant::Cylindrical), 2);
+            check_dominated(&Mosaic::new(size, MosaicVariant::Mobius), 3);
+        }
+        for name in ["2", "3_bent", "4_line", "6"] {
+            check_dominated(&cubic(2, name), 4);
+        }
+    }
+}
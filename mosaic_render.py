@@ -0,0 +1,114 @@
+"""
+Renders images of many mosaics at once, for `main.py merge` and cubic-site-gen.py.
+Images are rendered on a process pool into a cache keyed on everything that changes
+them, and hard linked (or copied) from there to where they are wanted, so images
+that haven't changed are never rendered again.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import hashlib
+import os
+from pathlib import Path
+import shutil
+
+from PIL import Image, ImageDraw, ImageFont
+
+import mosaic_util as util
+import mosaic_vis as mvis
+import mosaics as M
+
+# change this when the rendering changes, so cached images aren't reused
+RENDER_VERSION = 1
+
+
+@dataclass(frozen=True)
+class RenderJob:
+    mosaic_str: str
+    variant: str  # key of `parser_types`
+    publish: bool  # without frame or added crossings, and without a caption
+    caption: str  # shown under the mosaic, usually the knot ID
+    out_path: Path
+
+    def cache_path(self, cache_dir: Path) -> Path:
+        key = f"{RENDER_VERSION}|{self.mosaic_str}|{self.variant}|{self.publish}|{self.caption}"
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return cache_dir / digest[:2] / f"{digest}.png"
+
+
+def render_images(
+    jobs: list[RenderJob], workers: int = 6, cache_dir: Path = util.img_cache_dir
+) -> int:
+    """Saves the image of each job to its `out_path`, returning the number rendered.
+    Images already in the cache are only linked to their `out_path`"""
+    missing = {job.cache_path(cache_dir): job for job in jobs}
+    missing = {path: job for path, job in missing.items() if not path.is_file()}
+    count = len(missing)
+    if count:
+        print(f"Rendering {count:,} of {len(jobs):,} images...", flush=True)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            done = executor.map(_render_to, missing.values(), missing.keys(), chunksize=16)
+            for progress, _ in enumerate(done, 1):
+                if progress % max(count // 20, 1) == 0:
+                    print(f"  {progress/count:.0%} - {progress}/{count}", flush=True)
+    for job in jobs:
+        _link(job.cache_path(cache_dir), job.out_path)
+    return count
+
+
+def render_image(job: RenderJob) -> Image.Image:
+    mosaic = M.parser_types[job.variant](job.mosaic_str)
+    if job.publish:
+        return mvis.build_img(mosaic.get_publish_mosaic())
+    return caption_img(
+        mvis.build_img(mosaic),
+        job.mosaic_str,
+        f"ID: {job.caption} Tile #: {util.count_tiles(job.mosaic_str)}",
+    )
+
+
+def caption_img(img: Image.Image, title: str, caption: str) -> Image.Image:
+    """Adds a title above and a caption below the image, like `mosaic_vis.gen_png`
+    but drawn with PIL, which is much faster than starting a matplotlib figure"""
+    # text scales with the image, with long mosaic strings shrunk to fit
+    font_size = max(img.width // 16, 12)
+    title_size = min(font_size, int(img.width / (0.6 * max(len(title), 1))))
+    title_font = ImageFont.load_default(size=title_size)
+    caption_font = ImageFont.load_default(size=font_size)
+    margin = font_size // 2
+    title_h = _text_height(title_font, title) + 2 * margin
+    caption_h = _text_height(caption_font, caption) + 2 * margin
+
+    out = Image.new("RGBA", (img.width + 2 * margin, title_h + img.height + caption_h), "white")
+    out.alpha_composite(img, (margin, title_h))
+    draw = ImageDraw.Draw(out)
+    center = out.width // 2
+    draw.text((center, title_h // 2), title, fill="black", font=title_font, anchor="mm")
+    draw.text((center, out.height - caption_h // 2), caption, fill="black", font=caption_font, anchor="mm")
+    return out
+
+
+def _text_height(font: ImageFont.FreeTypeFont | ImageFont.ImageFont, text: str) -> int:
+    _, top, _, bottom = font.getbbox(text)
+    return int(bottom - top)
+
+
+def _render_to(job: RenderJob, cache_path: Path):
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    # written under another name first, so an interrupted render isn't cached
+    tmp_path = cache_path.with_name(f"{cache_path.stem}.{os.getpid()}.tmp")
+    render_image(job).save(tmp_path, format="PNG")
+    tmp_path.replace(cache_path)
+
+
+def _link(cache_path: Path, out_path: Path):
+    """Puts the cached image at `out_path`, unless it is already there"""
+    if out_path.is_file():
+        if out_path.samefile(cache_path):
+            return
+        out_path.unlink()
+    try:
+        os.link(cache_path, out_path)
+    except OSError:
+        # ex. on another file system
+        shutil.copyfile(cache_path, out_path)
@@ -1,19 +1,225 @@
 from dataclasses import dataclass
 import functools
+import itertools
+import math
 from pathlib import Path
-from typing import Callable
+from typing import BinaryIO, Callable, Iterator, Sequence, overload
+
+import numpy as np
+
+
+# maps ascii hex digits to their value, used by string2tiles
+_HEX_TABLE = bytes.maketrans(
+    b"0123456789abcdefABCDEF", bytes(range(16)) + bytes(range(10, 16))
+)
 
 
 def string2tiles(string: str) -> list[int]:
     """convert each char in the string to an int,
     using hex conversion to properly convert 'a' to 10"""
-    return [int(elem, base=16) for elem in string.strip()]
+    return list(string2bytes(string))
+
+
+def string2bytes(string: str) -> bytes:
+    """Same as string2tiles, with one byte per tile"""
+    tiles = string.strip().encode("ascii").translate(_HEX_TABLE)
+    if tiles and max(tiles) > 15:
+        raise ValueError(f"invalid mosaic string: {string}")
+    return tiles
 
 
 def tiles2string(matrix: list[int]) -> str:
     return "".join(f"{t:x}" for t in matrix)
 
 
+# ---- Packed mosaic files, written by `mosaic-gen --packed` ----
+# See `PackedHeader` in mosaic-gen/rolling_buff.rs for the layout
+PACKED_MAGIC = b"KMOS"
+PACKED_HEADER_LEN = 16
+# order matches the codes written by mosaic-gen
+PACKED_VARIANTS = ("flat", "cyl", "toric", "mobius", "cubic")
+PACKED_CUBIC_TYPES = ("2", "3_line", "3_bent", "4_line", "4_t", "5", "6")
+_HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+
+@dataclass(frozen=True)
+class PackedHeader:
+    variant: str
+    cubic_type: str | None
+    size: int
+    tile_ct: int
+    record_len: int
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "PackedHeader":
+        if data[0:4] != PACKED_MAGIC or data[4] != 1:
+            raise ValueError("Not a packed mosaic file")
+        cubic_ind = data[6]
+        return PackedHeader(
+            PACKED_VARIANTS[data[5]],
+            PACKED_CUBIC_TYPES[cubic_ind] if cubic_ind != 0xFF else None,
+            data[7],
+            int.from_bytes(data[8:10], "little"),
+            int.from_bytes(data[10:12], "little"),
+        )
+
+
+def is_packed_file(path: Path) -> bool:
+    with path.open("rb") as f:
+        return f.read(len(PACKED_MAGIC)) == PACKED_MAGIC
+
+
+def read_packed_header(path: Path) -> PackedHeader:
+    with path.open("rb") as f:
+        return PackedHeader.from_bytes(f.read(PACKED_HEADER_LEN))
+
+
+def load_packed_tiles(path: Path) -> tuple[PackedHeader, np.ndarray]:
+    """Memory-maps a packed file, returning a (mosaic #, tile #) array of tiles"""
+    header = read_packed_header(path)
+    return header, unpack_tiles(_packed_records(path, header), header.tile_ct)
+
+
+def _packed_records(path: Path, header: PackedHeader) -> np.ndarray:
+    # np.memmap can't map a zero-length region
+    if path.stat().st_size <= PACKED_HEADER_LEN:
+        return np.empty((0, header.record_len), dtype=np.uint8)
+    packed = np.memmap(path, dtype=np.uint8, mode="r", offset=PACKED_HEADER_LEN)
+    return packed.reshape(-1, header.record_len)
+
+
+def unpack_tiles(packed: np.ndarray, tile_ct: int) -> np.ndarray:
+    """Splits each byte of packed records into 2 tiles, high nibble first"""
+    tiles = np.empty((packed.shape[0], packed.shape[1] * 2), dtype=np.uint8)
+    tiles[:, 0::2] = packed >> 4
+    tiles[:, 1::2] = packed & 0xF
+    return tiles[:, :tile_ct]
+
+
+def iter_mosaic_strs(path: Path, chunk_len: int = 10_000) -> Iterator[str]:
+    """Iterate over the mosaic strings in a text or packed mosaic file"""
+    if not is_packed_file(path):
+        with path.open("r") as f:
+            for line in f:
+                yield line.strip()
+        return
+
+    header = read_packed_header(path)
+    yield from _iter_packed_strs(_packed_records(path, header), header.tile_ct, chunk_len)
+
+
+def _iter_packed_strs(
+    packed: np.ndarray, tile_ct: int, chunk_len: int = 10_000
+) -> Iterator[str]:
+    for start in range(0, len(packed), chunk_len):
+        tiles = unpack_tiles(packed[start : start + chunk_len], tile_ct)
+        # converting all strings in the chunk at once, then splitting
+        text = _HEX_DIGITS[tiles].tobytes().decode("ascii")
+        for i in range(0, len(text), tile_ct):
+            yield text[i : i + tile_ct]
+
+
+class MosaicFile(Sequence[str]):
+    """Random access to the mosaic strings of a text or packed file, without reading it all.
+    Text files are memory-mapped with the offset of each line, packed files by record"""
+
+    def __init__(self, path: Path):
+        self.header: PackedHeader | None = None
+        if is_packed_file(path):
+            self.header = read_packed_header(path)
+            self.records = _packed_records(path, self.header)
+            return
+        if path.stat().st_size == 0:
+            self.text = np.empty(0, dtype=np.uint8)
+        else:
+            self.text = np.memmap(path, dtype=np.uint8, mode="r")
+        ends = np.flatnonzero(self.text == ord("\n"))
+        # a last line without a newline still counts
+        if len(self.text) and self.text[-1] != ord("\n"):
+            ends = np.append(ends, len(self.text))
+        self.starts = np.concatenate(([0], ends[:-1] + 1))
+        self.ends = ends
+
+    def __len__(self) -> int:
+        if self.header is not None:
+            return len(self.records)
+        return len(self.ends)
+
+    @overload
+    def __getitem__(self, index: int) -> str: ...
+    @overload
+    def __getitem__(self, index: slice) -> list[str]: ...
+    def __getitem__(self, index: int | slice) -> str | list[str]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if not -len(self) <= index < len(self):
+            raise IndexError(index)
+        index %= len(self)
+        if self.header is not None:
+            return next(_iter_packed_strs(self.records[index : index + 1], self.header.tile_ct))
+        line = self.text[self.starts[index] : self.ends[index]].tobytes()
+        # leaving off the fields written by `mosaic-gen --pd`
+        return line.split(b" ", 1)[0].strip().decode("ascii")
+
+
+@dataclass(frozen=True)
+class MosaicChunk:
+    """Mosaics read from a stream, left as text lines or packed records
+    so they are cheap to send to another process"""
+
+    data: bytes
+    header: PackedHeader | None  # None for text
+
+    def __len__(self) -> int:
+        if self.header is None:
+            return self.data.count(b"\n")
+        return len(self.data) // self.header.record_len
+
+    def _records(self) -> np.ndarray:
+        assert self.header is not None
+        packed = np.frombuffer(self.data, dtype=np.uint8)
+        return packed.reshape(-1, self.header.record_len)
+
+    def first(self) -> str:
+        if self.header is None:
+            # leaving off the fields written by `mosaic-gen --pd`
+            return self.data.split(b"\n", 1)[0].split(b" ", 1)[0].decode("ascii")
+        return next(_iter_packed_strs(self._records()[:1], self.header.tile_ct))
+
+    def iter_strs(self) -> Iterator[str]:
+        if self.header is None:
+            yield from self.data.decode("ascii").splitlines()
+        else:
+            yield from _iter_packed_strs(self._records(), self.header.tile_ct)
+
+
+def read_stream_chunks(stream: BinaryIO, chunk_len: int) -> Iterator[MosaicChunk]:
+    """Splits the mosaics written by `mosaic-gen --stdout` into chunks of `chunk_len`.
+    Either format works, packed streams start with a single header"""
+    head = stream.read(len(PACKED_MAGIC))
+    if head == PACKED_MAGIC:
+        header = PackedHeader.from_bytes(head + stream.read(PACKED_HEADER_LEN - len(head)))
+        record_len = header.record_len
+        while data := stream.read(chunk_len * record_len):
+            # a stream that was cut off may end part way through a record
+            yield MosaicChunk(data[: len(data) - len(data) % record_len], header)
+        return
+
+    # the bytes read to check for a header are the start of the first line
+    first = [head + stream.readline()] if head else []
+    lines = itertools.chain(first, stream)
+    while batch := list(itertools.islice(lines, chunk_len)):
+        yield MosaicChunk(b"".join(batch), None)
+
+
+def mosaic_file(dir: Path, index: int) -> Path | None:
+    """The text or packed mosaic file with this index, if it exists"""
+    for ext in ("txt", "bin"):
+        if (path := dir / f"pt{index:04}.{ext}").is_file():
+            return path
+    return None
+
+
 def count_crossings(mosaic: str | list[int]) -> int:
     if type(mosaic) is str:
         return len([t for t in mosaic if t in ["9", "a"]])
@@ -26,6 +232,24 @@ def count_tiles(mosaic: str | list[int]) -> int:
     return len([t for t in mosaic if (t not in [0, 12])])
 
 
+def nominal_size(mosaic_str: str) -> int:
+    """Size of a mosaic from its string, cubic mosaics have 6 faces of size^2 tiles"""
+    size = math.isqrt(len(mosaic_str))
+    if size * size == len(mosaic_str):
+        return size
+    return math.isqrt(len(mosaic_str) // 6)
+
+
+def parse_pd_line(line: str) -> tuple[str, int, list[list[int]]]:
+    """Splits a line written by `mosaic-gen --pd` into the mosaic string,
+    its tile count and its PD codes, written as `1,4,2,5;3,6,4,1;...`"""
+    mosaic_str, tile_ct, *codes = line.split(" ")
+    pd_codes = []
+    if codes and codes[0]:
+        pd_codes = [[int(e) for e in code.split(",")] for code in codes[0].split(";")]
+    return mosaic_str, int(tile_ct), pd_codes
+
+
 def knot_order_from_id(knot_id: str) -> int:
     return int(knot_id[0:2].removesuffix("_"))
 
@@ -38,6 +262,18 @@ def mosaic_dir(type: str, size: int, cubic_type: str | None = None) -> Path:
     return path
 
 
+def stream_manifest_path(type: str, size: int, cubic_type: str | None = None) -> Path:
+    """Records the first mosaic of each chunk catalogued by `main.py stream`, for resuming.
+    Kept with the mosaics, as every file in the results folder is read as results"""
+    return mosaic_dir(type, size, cubic_type) / "stream_chunks.txt"
+
+
+def catalog_metrics_path(type: str, size: int, cubic_type: str | None = None) -> Path:
+    """JSON lines of the stats of each task of `main.py parse` and `main.py stream`.
+    Kept with the mosaics, like the stream manifest"""
+    return mosaic_dir(type, size, cubic_type) / "catalog_metrics.jsonl"
+
+
 def results_dir(type: str, cubic_type: str | None = None) -> Path:
     """Get the output folder of intermediate results"""
     path = Path(f"data/{type}_res")
@@ -57,6 +293,17 @@ def results_dir_knotID(type: str, cubic_type: str | None = None) -> Path:
 # dir of final results
 output_dir = Path(f"output/")
 
+# PD code -> knotID cache, shared between runs
+pd_cache_path = Path("data/pd_cache.sqlite")
+
+# HOMFLY -> knotID lookup table, as a pickle and as the packed file that's used for lookups
+knot_db_pickle_path = Path("data/knotIDDB.pkl")
+knot_db_path = Path("data/knotIDDB.bin")
+# results of every catalog task, see results_store.py
+results_db_path = Path("data/results.sqlite")
+# rendered images of mosaics, see mosaic_render.py
+img_cache_dir = Path("data/img_cache")
+
 
 def output_path(type: str, cubic_type: str | None = None) -> Path:
     cub_str = cubic_type + "_" if (cubic_type is not None and type == "cubic") else ""
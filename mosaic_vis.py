@@ -1,7 +1,14 @@
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import math
 from pathlib import Path
+import queue
 import tkinter as tk
+from tkinter import font as tkfont
 from tkinter import ttk
+from typing import Callable, Sequence
+import numpy as np
 from PIL import Image, ImageTk
 from tkinter.filedialog import askopenfilename
 from mosaics import BaseMosaic, NormMosaic, parser_types
@@ -49,23 +56,46 @@ def gen_png(mosaic: BaseMosaic, mosaic_str: str, id: str, img_path: Path):
     plt.close(fig)
 
 
-def build_img(mosaic: BaseMosaic) -> Image.Image:
-    """Builds a PIL image from a set of mosaic tiles"""
-    if not hasattr(build_img, "tiles"):
-        build_img.tiles = load_tile_imgs()
-
-    tiles = build_img.tiles
-    tile_size = tiles[0].width
-
-    out_img = Image.new(
-        "RGBA", (tile_size * mosaic.width, tile_size * mosaic.height), (255, 0, 0, 0)
-    )
-        
-    for i, tile in enumerate(mosaic.tiles):
-        x, y = index_to_xy(i, mosaic.width)
-        out_img.paste(tiles[tile], (x * tile_size, y * tile_size))
-
-    return out_img
+def build_img(mosaic: BaseMosaic, tile_px: int | None = None) -> Image.Image:
+    """Builds a PIL image from a set of mosaic tiles.
+    `tile_px` scales each tile to that many pixels, ex. for thumbnails"""
+    atlas = tile_atlas(tile_px)
+    tiles = np.asarray(mosaic.tiles, dtype=np.uint8).reshape(1, mosaic.height, mosaic.width)
+    return Image.fromarray(_composite(atlas, tiles)[0], "RGBA")
+
+
+def build_contact_sheet(
+    mosaics: list[BaseMosaic], columns: int = 8, tile_px: int | None = 32
+) -> Image.Image:
+    """Lays out images of many mosaics in a grid, each in a cell as big as the largest mosaic"""
+    atlas = tile_atlas(tile_px)
+    tile_size = atlas.shape[1]
+    cell_w = max(m.width for m in mosaics) * tile_size
+    cell_h = max(m.height for m in mosaics) * tile_size
+    rows = math.ceil(len(mosaics) / columns)
+    sheet = np.zeros((rows * cell_h, columns * cell_w, 4), dtype=np.uint8)
+
+    # mosaics of the same shape are composited all at once
+    by_shape: dict[tuple[int, int], list[int]] = defaultdict(list)
+    for i, mosaic in enumerate(mosaics):
+        by_shape[(mosaic.width, mosaic.height)].append(i)
+    for (width, height), inds in by_shape.items():
+        tiles = np.array([mosaics[i].tiles for i in inds], dtype=np.uint8)
+        imgs = _composite(atlas, tiles.reshape(len(inds), height, width))
+        for i, img in zip(inds, imgs):
+            row, col = divmod(i, columns)
+            x, y = col * cell_w, row * cell_h
+            sheet[y : y + img.shape[0], x : x + img.shape[1]] = img
+    return Image.fromarray(sheet, "RGBA")
+
+
+def _composite(atlas: np.ndarray, tiles: np.ndarray) -> np.ndarray:
+    """Images of a batch of mosaics of one shape, from their (batch, height, width) tiles"""
+    batch, height, width = tiles.shape
+    tile_size = atlas.shape[1]
+    # (batch, height, width, tile y, tile x, RGBA) -> rows of pixels
+    pixels = atlas[tiles].transpose(0, 1, 3, 2, 4, 5)
+    return pixels.reshape(batch, height * tile_size, width * tile_size, 4)
 
 
 def show_img(img: Image.Image):
@@ -76,26 +106,43 @@ def show_img(img: Image.Image):
     ax.axis("off")
 
 
-def index_to_xy(index: int, width: int) -> tuple[int, int]:
-    col = index % width
-    row = math.floor(index / width)
-    return (col, row)
-
-
-def load_tile_imgs() -> dict[int, Image.Image]:
-    tile_images = {}
+@functools.cache
+def tile_atlas(tile_px: int | None = None) -> np.ndarray:
+    """The RGBA pixels of every tile, indexed by tile number.
+    Tiles are scaled to `tile_px` pixels, or kept at their full size"""
+    tile_images: dict[int, Image.Image] = {}
     for file in Path("tiles/").glob("t*.png"):
         try:
             tile_images[int(file.stem[1:])] = Image.open(file).convert("RGBA")
         except FileNotFoundError:
             print(f"Failed to load image {file}")
             exit(-1)
-    return tile_images
+    if tile_px is not None:
+        tile_images = {
+            t: img.resize((tile_px, tile_px), Image.Resampling.LANCZOS)
+            for t, img in tile_images.items()
+        }
+    return np.stack([np.asarray(tile_images[t]) for t in range(len(tile_images))])
 
 
 # ---- DOES NOT run well in WSL2 (text doesn't scale) ----
 class ImageBrowser(tk.Tk):
-    def __init__(self, image_names: list[str], getter):
+    """Browses the images of a list of names, which can be as long as a whole mosaic file.
+    Only the visible names are put in the listbox, and images are rendered on background
+    threads, along with the ones next to the selected image"""
+
+    # rendered images to keep, and how many on each side of the selected one to render ahead
+    cache_len = 256
+    prefetch = 4
+    # used until the window is shown
+    default_size = (800, 800)
+
+    def __init__(
+        self,
+        image_names: Sequence[str],
+        getter: Callable[[str, tuple[int, int]], Image.Image],
+    ):
+        """`getter(name, size)` returns the image of a name, which is shrunk to fit `size`"""
         super().__init__()
 
         self.title("Image Browser")
@@ -105,13 +152,25 @@ class ImageBrowser(tk.Tk):
         except:
             pass
         self.get_img = getter
-        self.image_names: list[str] = image_names
+        self.image_names = image_names
         self.current_index = 0
+        self.top_index = 0  # first name shown in the listbox
+        self.visible_rows = 1
         self.tk_image = None  # keep reference!
+        # (index, size) -> image, oldest used first
+        self.images: OrderedDict[tuple[int, tuple[int, int]], Image.Image] = OrderedDict()
+        # the image that should be shown, and images being rendered
+        self.wanted: tuple[int, tuple[int, int]] | None = None
+        self.pending: set[tuple[int, tuple[int, int]]] = set()
+        # rendered images are handed back to the Tk thread through here
+        self.rendered: queue.SimpleQueue = queue.SimpleQueue()
+        self.executor = ThreadPoolExecutor(max_workers=2)
         self._build_ui()
+        self.protocol("WM_DELETE_WINDOW", self._close)
+        self.after(30, self._poll_rendered)
 
         if self.image_names:
-            self.show_image(0)
+            self.after_idle(self.show_image, 0)
 
     def _build_ui(self):
         paned = ttk.Panedwindow(self, orient=tk.HORIZONTAL)
@@ -121,22 +180,34 @@ class ImageBrowser(tk.Tk):
         left_frame = ttk.Frame(paned, width=250)
         paned.add(left_frame, weight=1)
 
-        scrollbar = ttk.Scrollbar(left_frame)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        # the listbox only holds the visible rows, so the scrollbar is driven by hand
+        self.scrollbar = ttk.Scrollbar(left_frame, command=self.on_scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
+        list_font = tkfont.Font(family="TKDefaultFont", size=16)
         self.listbox = tk.Listbox(
             left_frame,
-            yscrollcommand=scrollbar.set,
             activestyle="dotbox",
-            font=("TKDefaultFont", 16),
+            font=list_font,
+            exportselection=False,
         )
         self.listbox.pack(fill=tk.BOTH, expand=True)
-        scrollbar.config(command=self.listbox.yview)
-
-        for name in self.image_names:
-            self.listbox.insert(tk.END, name)
+        # height of each row, as Tk lays them out
+        self.row_height = (
+            list_font.metrics("linespace") + 1 + 2 * int(self.listbox.cget("selectborderwidth"))
+        )
 
+        self.listbox.bind("<Configure>", self.on_resize_list)
         self.listbox.bind("<<ListboxSelect>>", self.on_select)
+        self.listbox.bind(
+            "<MouseWheel>", lambda e: self.scroll_to(self.top_index + (-3 if e.delta > 0 else 3))
+        )
+        self.listbox.bind("<Button-4>", lambda e: self.scroll_to(self.top_index - 3))
+        self.listbox.bind("<Button-5>", lambda e: self.scroll_to(self.top_index + 3))
+        for key, step in [("<Up>", -1), ("<Down>", 1), ("<Prior>", None), ("<Next>", None)]:
+            self.listbox.bind(key, lambda e, step=step, key=key: self._on_key(key, step))
+        self.listbox.bind("<Home>", lambda e: self.show_image(0) or "break")
+        self.listbox.bind("<End>", lambda e: self.show_image(len(self.image_names) - 1) or "break")
 
         # ---- Right: Image display ----
         right_frame = ttk.Frame(paned)
@@ -145,41 +216,120 @@ class ImageBrowser(tk.Tk):
         self.image_label = ttk.Label(right_frame, anchor="center")
         self.image_label.pack(fill=tk.BOTH, expand=True)
 
+    def _on_key(self, key: str, step: int | None) -> str:
+        if step is None:
+            step = self.visible_rows if key == "<Next>" else -self.visible_rows
+        self.show_image(self.current_index + step)
+        # stops the listbox moving its own selection
+        return "break"
+
+    def on_scroll(self, action: str, amount: str, unit: str | None = None):
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * len(self.image_names)))
+        else:
+            step = self.visible_rows if unit == "pages" else 1
+            self.scroll_to(self.top_index + int(amount) * step)
+
+    def on_resize_list(self, event):
+        self.visible_rows = max(1, event.height // self.row_height)
+        self.scroll_to(self.top_index)
+
+    def scroll_to(self, top_index: int):
+        self.top_index = max(0, min(top_index, len(self.image_names) - self.visible_rows))
+        self._fill_list()
+
+    def _fill_list(self):
+        """Shows the names from `top_index` in the listbox"""
+        names = self.image_names[self.top_index : self.top_index + self.visible_rows]
+        self.listbox.delete(0, tk.END)
+        if names:
+            self.listbox.insert(tk.END, *names)
+        row = self.current_index - self.top_index
+        if 0 <= row < len(names):
+            self.listbox.selection_set(row)
+            self.listbox.activate(row)
+        total = max(len(self.image_names), 1)
+        self.scrollbar.set(self.top_index / total, (self.top_index + len(names)) / total)
+
     def on_select(self, event):
         if not self.listbox.curselection():
             return
-        index = self.listbox.curselection()[0]
-        self.show_image(index)
+        self.show_image(self.top_index + self.listbox.curselection()[0])
 
     def show_image(self, index):
+        if not self.image_names:
+            return
         index = max(0, min(index, len(self.image_names) - 1))
-        self.listbox.selection_clear(self.current_index)
         self.current_index = index
+        # keeping the selected name in view
+        if index < self.top_index:
+            self.scroll_to(index)
+        elif index >= self.top_index + self.visible_rows:
+            self.scroll_to(index - self.visible_rows + 1)
+        else:
+            self._fill_list()
+
+        size = self._label_size()
+        self.wanted = (index, size)
+        if self.wanted in self.images:
+            self.images.move_to_end(self.wanted)
+            self._display(self.images[self.wanted])
+        else:
+            self._request(self.wanted)
+        for offset in range(1, self.prefetch + 1):
+            for near in (index + offset, index - offset):
+                if 0 <= near < len(self.image_names):
+                    self._request((near, size))
+
+    def _label_size(self) -> tuple[int, int]:
+        w = self.image_label.winfo_width()
+        h = self.image_label.winfo_height()
+        if w > 1 and h > 1:
+            return (w, h)
+        return self.default_size
 
-        self.listbox.selection_set(index)
-        self.listbox.activate(index)
-        self.listbox.see(index)
-
-        img_name = self.image_names[index]
-        img = self.get_img(img_name)
-        # Optional resize to fit window
-        img = self._resize_to_label(img)
+    def _request(self, key: tuple[int, tuple[int, int]]):
+        """Renders an image in the background, unless it's already rendered or being rendered"""
+        if key in self.images or key in self.pending:
+            return
+        self.pending.add(key)
+        self.executor.submit(self._render, key, self.image_names[key[0]])
 
+    def _render(self, key: tuple[int, tuple[int, int]], name: str):
+        """Runs on a background thread, so it can't touch any widgets"""
+        try:
+            img = self.get_img(name, key[1])
+            img.thumbnail(key[1], Image.Resampling.LANCZOS)
+            self.rendered.put((key, img))
+        except Exception as e:
+            self.rendered.put((key, e))
+
+    def _poll_rendered(self):
+        """Takes in the images rendered since the last poll, showing the wanted one"""
+        while not self.rendered.empty():
+            key, img = self.rendered.get()
+            self.pending.discard(key)
+            if isinstance(img, Exception):
+                print(f"Failed to render {self.image_names[key[0]]}: {img}")
+                continue
+            self.images[key] = img
+            if len(self.images) > self.cache_len:
+                self.images.popitem(last=False)
+            if key == self.wanted:
+                self._display(img)
+        self.after(30, self._poll_rendered)
+
+    def _display(self, img: Image.Image):
         self.tk_image = ImageTk.PhotoImage(img)
         self.image_label.configure(image=self.tk_image)
 
-    def _resize_to_label(self, img):
-        self.update_idletasks()
-        w = self.image_label.winfo_width()
-        h = self.image_label.winfo_height()
-        if w > 1 and h > 1:
-            img = img.copy()
-            img.thumbnail((w, h), Image.LANCZOS)  # type: ignore
-        return img
+    def _close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.destroy()
 
     @classmethod
     def from_img_folder(cls, dir: Path):
-        def getter(mosaic):
+        def getter(mosaic, size):
             return Image.open(dir / f"{mosaic}.png")
 
         mosaics = [p.stem for p in dir.iterdir()]
@@ -188,26 +338,29 @@ class ImageBrowser(tk.Tk):
     @classmethod
     def from_mosaic_file(cls, file: Path | None, parser):
         if not file:
-            file = Path(askopenfilename(initialdir="./data"))
-            if not file:
+            name = askopenfilename(initialdir="./data")
+            if not name:
                 exit()
+            file = Path(name)
 
-        with open(file) as f:
-            mosaics = [l.strip() for l in f.readlines()]
-
-        def getter(mosaic_str: str):
-            mosaic: NormMosaic = parser(mosaic_str)
-            return build_img(mosaic)
-
-        return ImageBrowser(mosaics, getter)
+        # only the offset of each line is read up front
+        return ImageBrowser(util.MosaicFile(file), _mosaic_getter(parser))
 
     @classmethod
     def from_strings(cls, strs: list[str], parser):
-        def getter(mosaic_str: str):
-            mosaic: NormMosaic = parser(mosaic_str)
+        return ImageBrowser(strs, _mosaic_getter(parser))
+
+
+def _mosaic_getter(parser) -> Callable[[str, tuple[int, int]], Image.Image]:
+    def getter(mosaic_str: str, size: tuple[int, int]):
+        mosaic: NormMosaic = parser(mosaic_str)
+        # rendered close to the size it's shown at, rather than shrinking a full size image
+        tile_px = min(size[0] // mosaic.width, size[1] // mosaic.height)
+        if tile_px >= tile_atlas().shape[1]:
             return build_img(mosaic)
+        return build_img(mosaic, max(tile_px, 1))
 
-        return ImageBrowser(strs, getter)
+    return getter
 
 
 if __name__ == "__main__":
@@ -0,0 +1,146 @@
+from dataclasses import dataclass
+import hashlib
+from pathlib import Path
+import sqlite3
+
+import mosaic_util as util
+import mosaics as M
+
+
+@dataclass(frozen=True)
+class CachedKnot:
+    """What we know about the knot for a PD code"""
+
+    knotID: str | None  # None when the polynomial isn't in the KnotIDDB
+    polynomial: str
+
+    def is_definite(self) -> bool:
+        """False for ambiguous/errored IDs, which may resolve differently on another run"""
+        if self.knotID is None:
+            return True
+        return "," not in self.knotID and not self.knotID.startswith("E_SAGE")
+
+
+class PDCodeCache:
+    """Maps PD codes to knot IDs. Backed by an append-only SQLite file that is
+    shared by every worker process, and kept between runs and mosaic sizes.
+    Entries are keyed by the canonical form of the PD codes, so the same diagram
+    traversed from a different start shares an entry.
+    The knot IDs come from one KnotIDDB, named by `knot_db_digest`. When it changes
+    (ex. the table is extended) every entry is dropped, so that knots which
+    weren't in the old table are looked up again"""
+
+    def __init__(
+        self, knot_db_digest: str, path: Path = util.pd_cache_path, flush_every: int = 1000
+    ):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # long timeout, as other workers may be holding the write lock
+        self.db = sqlite3.connect(path, timeout=120)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS pd_knots (
+                key BLOB PRIMARY KEY, knot_id TEXT, polynomial TEXT NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+            """
+        )
+        self.db.commit()
+        self._check_knot_db(knot_db_digest)
+        self.flush_every = flush_every
+        # everything this process has looked up, saves repeated disk reads.
+        # keyed by the PD codes as traversed, so hits skip canonicalization
+        self.local: dict[str, CachedKnot] = {}
+        # same, keyed by canonical PD codes
+        self.local_canonical: dict[str, CachedKnot] = {}
+        self.pending: list[tuple[bytes, str | None, str]] = []
+        # (raw, canonical) key of the last miss, as it's usually `put` next
+        self._last_miss: tuple[str, str] = ("", "")
+
+        self.local_hits = 0
+        # hits that only happened because of canonicalization
+        self.canonical_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _check_knot_db(self, knot_db_digest: str):
+        # write-locked first, so only the first worker to see a new table clears the cache
+        with self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            row = self.db.execute("SELECT value FROM meta WHERE name = 'knot_db'").fetchone()
+            if row is not None and row[0] == knot_db_digest:
+                return
+            if row is not None:
+                print("The KnotIDDB has changed, clearing the PD code cache", flush=True)
+            self.db.execute("DELETE FROM pd_knots")
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('knot_db', ?)", (knot_db_digest,)
+            )
+
+    @staticmethod
+    def canonical_key(pd_codes: list[list[int]]) -> str:
+        return str(M.canonical_pd_codes(pd_codes))
+
+    @staticmethod
+    def hash_key(canonical_key: str) -> bytes:
+        return hashlib.blake2b(canonical_key.encode(), digest_size=16).digest()
+
+    def get(self, pd_codes: list[list[int]]) -> CachedKnot | None:
+        raw_key = str(pd_codes)
+        if (res := self.local.get(raw_key)) is not None:
+            self.local_hits += 1
+            return res
+        key = self.canonical_key(pd_codes)
+        if (res := self.local_canonical.get(key)) is not None:
+            self.canonical_hits += 1
+            self.local[raw_key] = res
+            return res
+        row = self.db.execute(
+            "SELECT knot_id, polynomial FROM pd_knots WHERE key = ?",
+            (self.hash_key(key),),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            self._last_miss = (raw_key, key)
+            return None
+        self.disk_hits += 1
+        res = self.local[raw_key] = self.local_canonical[key] = CachedKnot(*row)
+        return res
+
+    def put(self, pd_codes: list[list[int]], knot: CachedKnot):
+        """Caches a result. Only definite results are saved to disk"""
+        raw_key = str(pd_codes)
+        if raw_key == self._last_miss[0]:
+            key = self._last_miss[1]
+        else:
+            key = self.canonical_key(pd_codes)
+        self.local[raw_key] = self.local_canonical[key] = knot
+        if not knot.is_definite():
+            return
+        self.pending.append((self.hash_key(key), knot.knotID, knot.polynomial))
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        with self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO pd_knots VALUES (?, ?, ?)", self.pending
+            )
+        self.pending.clear()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def stats_str(self) -> str:
+        hits = self.local_hits + self.canonical_hits + self.disk_hits
+        total = hits + self.misses
+        hit_rate = hits / total if total else 0
+        return (
+            f"PD cache: {hit_rate:.1%} hits ({self.local_hits:,} local,"
+            f" {self.canonical_hits:,} canonical, {self.disk_hits:,} disk,"
+            f" {self.misses:,} misses)"
+        )
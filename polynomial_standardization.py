@@ -1,16 +1,23 @@
+from array import array
+import bisect
 from dataclasses import dataclass
 import functools
 from pathlib import Path
+import hashlib
+from itertools import accumulate
+import mmap
+import os
 import pickle
+import re
+import struct
 from time import time
 from typing import Iterable
-from sympy import symbols, expand
-from sympy.parsing.sympy_parser import parse_expr
 import mosaic_util as util
 # from sage.all import KnotInfo  # type: ignore
 import mosaics as M
 
-v, z = symbols("v z")
+# number of parsed polynomial strings to keep
+FROM_STRING_CACHE_SIZE = 100_000
 
 
 @dataclass(frozen=True)
@@ -59,15 +66,219 @@ class Term:
         """
         return self.z_pow * 1000 + self.v_pow
 
+
+class LaurentPoly:
+    """A Laurent polynomial in v and z with integer coefficients.
+    Immutable, all operations return a new polynomial"""
+
+    __slots__ = ("coeffs",)
+
+    def __init__(self, coeffs: dict[tuple[int, int], int] | None = None):
+        # maps (v power, z power) to the coefficient, without zero coefficients
+        self.coeffs = {k: c for k, c in (coeffs or {}).items() if c != 0}
+
     @classmethod
-    def from_scipy(cls, term) -> "Term":
-        powers: dict = term.as_powers_dict()
-        v_pow = int(powers.pop(v, 0))
-        z_pow = int(powers.pop(z, 0))
-        coeff = 1
-        if len(powers):
-            coeff = int(list(powers.keys())[0])
-        return Term(coeff, v_pow, z_pow)
+    def monomial(cls, coeff: int, v_pow: int = 0, z_pow: int = 0) -> "LaurentPoly":
+        return cls({(v_pow, z_pow): coeff})
+
+    def shift(self, coeff: int, v_pow: int = 0, z_pow: int = 0) -> "LaurentPoly":
+        """Multiplies by the monomial coeff * v^v_pow * z^z_pow"""
+        return LaurentPoly(
+            {(v + v_pow, z + z_pow): c * coeff for (v, z), c in self.coeffs.items()}
+        )
+
+    def __add__(self, other: "LaurentPoly") -> "LaurentPoly":
+        out = dict(self.coeffs)
+        for key, c in other.coeffs.items():
+            out[key] = out.get(key, 0) + c
+        return LaurentPoly(out)
+
+    def __neg__(self) -> "LaurentPoly":
+        return self.shift(-1)
+
+    def __sub__(self, other: "LaurentPoly") -> "LaurentPoly":
+        return self + (-other)
+
+    def __mul__(self, other: "LaurentPoly") -> "LaurentPoly":
+        out: dict[tuple[int, int], int] = {}
+        for (v1, z1), c1 in self.coeffs.items():
+            for (v2, z2), c2 in other.coeffs.items():
+                key = (v1 + v2, z1 + z2)
+                out[key] = out.get(key, 0) + c1 * c2
+        return LaurentPoly(out)
+
+    def __pow__(self, exp: int) -> "LaurentPoly":
+        if exp < 0:
+            # only monomials can be inverted
+            if len(self.coeffs) != 1:
+                raise ValueError(f"Can't raise {self} to a negative power")
+            [((v, z), c)] = self.coeffs.items()
+            if c not in (1, -1):
+                raise ValueError(f"Can't raise {self} to a negative power")
+            return LaurentPoly.monomial(c**-exp, v * exp, z * exp)
+        out = LaurentPoly.monomial(1)
+        for _ in range(exp):
+            out = out * self
+        return out
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, LaurentPoly) and self.coeffs == other.coeffs
+
+    def __hash__(self) -> int:
+        return hash(frozenset(self.coeffs.items()))
+
+    def terms(self) -> tuple[Term, ...]:
+        """Terms in the canonical order used by HOMFLY"""
+        return HOMFLY.sort(Term(c, v, z) for (v, z), c in self.coeffs.items())
+
+    def __repr__(self) -> str:
+        return " + ".join(str(t) for t in self.terms()) or "0"
+
+    @classmethod
+    def parse(cls, string: str) -> "LaurentPoly":
+        """Parses polynomials in v and z, in the forms that sage, KnotInfo and Term use.
+        Supports +, -, *, parentheses and integer powers (^ or **)"""
+        compact = "".join(string.split())
+        if (coeffs := _parse_monomial_sum(compact)) is not None:
+            return cls(coeffs)
+        tokens = _TOKEN_RE.findall(compact)
+        if "".join(tokens) != compact:
+            raise ValueError(f"Unexpected characters in polynomial: {string}")
+        parser = _PolyParser(tokens, string)
+        res = parser.expr()
+        if parser.pos != len(tokens):
+            raise ValueError(f"Unexpected {tokens[parser.pos]!r} in polynomial: {string}")
+        return cls(res)
+
+
+_TOKEN_RE = re.compile(r"\d+|[vz]|\*\*|[-+*^()]")
+# one term like "+ -2*v^-2*z^4", without whitespace
+_MONOMIAL_RE = re.compile(
+    r"([+-]*)(\d+)?(?:\*?v(?:\^\(?(-?\d+)\)?)?(?=[*+-]|$)(?P<v>))?"
+    r"(?:\*?z(?:\^\(?(-?\d+)\)?)?(?=[+-]|$)(?P<z>))?"
+)
+# coefficient dicts, as used by LaurentPoly
+_Coeffs = dict[tuple[int, int], int]
+
+
+def _parse_monomial_sum(compact: str) -> _Coeffs | None:
+    """Fast path for strings that are just a sum of monomials, which is all
+    that sage and Term produce. Returns None if it's anything else"""
+    coeffs: _Coeffs = {}
+    pos = 0
+    while pos < len(compact):
+        match = _MONOMIAL_RE.match(compact, pos)
+        signs, coeff, v_pow, z_pow = match.group(1, 2, 3, 5)  # type: ignore
+        has_v = match.group("v") is not None  # type: ignore
+        has_z = match.group("z") is not None  # type: ignore
+        # every term after the first needs a sign, and something other than it
+        if (pos and not signs) or not (coeff or has_v or has_z):
+            return None
+        end = match.end()  # type: ignore
+        if end < len(compact) and compact[end] not in "+-":
+            return None
+        key = (
+            (int(v_pow) if v_pow else 1) if has_v else 0,
+            (int(z_pow) if z_pow else 1) if has_z else 0,
+        )
+        val = int(coeff) if coeff else 1
+        if signs.count("-") % 2:
+            val = -val
+        coeffs[key] = coeffs.get(key, 0) + val
+        pos = end
+    return coeffs if coeffs else None
+
+
+class _PolyParser:
+    """Recursive descent parser over the tokens of a polynomial.
+    Works on plain coefficient dicts, which is much faster than building a
+    LaurentPoly for every step"""
+
+    def __init__(self, tokens: list[str], string: str):
+        self.tokens = tokens
+        self.string = string
+        self.pos = 0
+
+    def peek(self) -> str | None:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self) -> str:
+        if self.pos >= len(self.tokens):
+            raise ValueError(f"Polynomial ended unexpectedly: {self.string}")
+        self.pos += 1
+        return self.tokens[self.pos - 1]
+
+    def expr(self) -> _Coeffs:
+        # sum := product (('+'|'-') product)*
+        res = dict(self.product())
+        while (op := self.peek()) in ("+", "-"):
+            self.take()
+            sign = 1 if op == "+" else -1
+            for key, c in self.product().items():
+                res[key] = res.get(key, 0) + sign * c
+        return res
+
+    def product(self) -> _Coeffs:
+        # product := unary ('*' unary)*
+        res = self.unary()
+        while self.peek() == "*":
+            self.take()
+            rhs = self.unary()
+            if len(res) == 1 and len(rhs) == 1:
+                # multiplying monomials, by far the most common
+                [((v1, z1), c1)] = res.items()
+                [((v2, z2), c2)] = rhs.items()
+                res = {(v1 + v2, z1 + z2): c1 * c2}
+            else:
+                res = (LaurentPoly(res) * LaurentPoly(rhs)).coeffs
+        return res
+
+    def unary(self) -> _Coeffs:
+        if (op := self.peek()) in ("+", "-"):
+            self.take()
+            res = self.unary()
+            return {k: -c for k, c in res.items()} if op == "-" else res
+        # power := atom (('^'|'**') exponent)?
+        res = self.atom()
+        if self.peek() in ("^", "**"):
+            self.take()
+            exp = self.exponent()
+            if len(res) == 1:
+                [((v, z), c)] = res.items()
+                if exp < 0 and c not in (1, -1):
+                    raise ValueError(f"Can't invert {c} in polynomial: {self.string}")
+                res = {(v * exp, z * exp): c ** abs(exp)}
+            else:
+                res = (LaurentPoly(res) ** exp).coeffs
+        return res
+
+    def exponent(self) -> int:
+        tok = self.take()
+        if tok == "(":
+            exp = self.exponent()
+            if self.take() != ")":
+                raise ValueError(f"Unclosed parentheses in polynomial: {self.string}")
+            return exp
+        if tok == "-":
+            return -self.exponent()
+        if not tok.isdigit():
+            raise ValueError(f"Bad exponent {tok!r} in polynomial: {self.string}")
+        return int(tok)
+
+    def atom(self) -> _Coeffs:
+        tok = self.take()
+        if tok == "v":
+            return {(1, 0): 1}
+        if tok == "z":
+            return {(0, 1): 1}
+        if tok.isdigit():
+            return {(0, 0): int(tok)}
+        if tok == "(":
+            res = self.expr()
+            if self.take() != ")":
+                raise ValueError(f"Unclosed parentheses in polynomial: {self.string}")
+            return res
+        raise ValueError(f"Unexpected {tok!r} in polynomial: {self.string}")
 
 
 @dataclass(frozen=True)
@@ -77,16 +288,26 @@ class HOMFLY:
     terms: tuple[Term, ...]
 
     @classmethod
-    @functools.cache
-    def from_string(cls, string):
+    def from_string(cls, string: str) -> "HOMFLY":
         """
-        Parse HOMFLY polynomial string into standard form using SymPy.
+        Parse HOMFLY polynomial string into standard form.
         """
-        string = string.replace("^", "**").strip()
-        expr = parse_expr(string, local_dict={"v": v, "z": z})
-        poly = expand(expr)
-        terms = [Term.from_scipy(t) for t in poly.as_ordered_terms()]
-        return HOMFLY(cls.sort(terms))
+        return _homfly_from_string(string)
+
+    @classmethod
+    def from_poly(cls, poly: LaurentPoly) -> "HOMFLY":
+        return HOMFLY(poly.terms())
+
+    @staticmethod
+    def cache_stats_str() -> str:
+        """Hit rate of the from_string cache"""
+        info = _homfly_from_string.cache_info()
+        total = info.hits + info.misses
+        hit_rate = info.hits / total if total else 0
+        return (
+            f"HOMFLY parse cache: {hit_rate:.1%} hits ({info.hits:,} hits,"
+            f" {info.misses:,} misses, {info.currsize:,}/{info.maxsize:,} entries)"
+        )
 
     @classmethod
     def from_knot(cls, knot):
@@ -111,6 +332,11 @@ class HOMFLY:
         return " + ".join(str(t) for t in self.terms)
 
 
+@functools.lru_cache(maxsize=FROM_STRING_CACHE_SIZE)
+def _homfly_from_string(string: str) -> HOMFLY:
+    return HOMFLY.from_poly(LaurentPoly.parse(string))
+
+
 class KnotIDDB:
     """A lookup table from homfly to knotID(s)"""
 
@@ -134,6 +360,29 @@ class KnotIDDB:
         with path.open("wb") as file:
             pickle.dump(self, file)
 
+    def dump_packed(self, path: Path):
+        """Writes the table in the format read by PackedKnotIDDB.
+        Written to a temp file first, so readers never see a partial file"""
+        entries = sorted(
+            (PackedKnotIDDB.hash_key(key := _pack_terms(poly)), key, ",".join(ids))
+            for poly, ids in self.lookup_table.items()
+        )
+        hashes = array("Q", [h for h, _, _ in entries])
+        terms = b"".join(key for _, key, _ in entries)
+        ids = [ids.encode() for _, _, ids in entries]
+        # offsets in # of terms, and bytes
+        term_offsets = array("I", accumulate((len(k) // 12 for _, k, _ in entries), initial=0))
+        id_offsets = array("I", accumulate((len(i) for i in ids), initial=0))
+
+        tmp_path = path.with_suffix(f".tmp{os.getpid()}")
+        with tmp_path.open("wb") as file:
+            file.write(PackedKnotIDDB.header(len(entries)))
+            for arr in (hashes, term_offsets, id_offsets):
+                file.write(arr.tobytes())
+            file.write(terms)
+            file.write(b"".join(ids))
+        tmp_path.replace(path)
+
     def __init__(
         self, LUT_file: Path = Path("homflys/knotsToHOMFLY.txt"), max_size: int = 14
     ):
@@ -152,6 +401,98 @@ class KnotIDDB:
             self.lookup_table[key] = knots
 
 
+def _pack_terms(poly: HOMFLY) -> bytes:
+    """(coeff, v_pow, z_pow) of each term as little-endian int32s"""
+    flat = [x for t in poly.terms for x in (t.coeff, t.v_pow, t.z_pow)]
+    return struct.pack(f"<{len(flat)}i", *flat)
+
+
+class PackedKnotIDDB:
+    """Read-only KnotIDDB, memory-mapped from a file written by KnotIDDB.dump_packed.
+    Opening it doesn't deserialize anything, and the pages are shared between processes.
+    Layout (native-endian arrays), after a 16 byte header of magic, version, and entry count:
+    ```text
+    hashes        u64[n]     sorted hashes of each polynomial's packed terms
+    term_offsets  u32[n+1]   start of each polynomial's terms, in terms
+    id_offsets    u32[n+1]   start of each polynomial's knot IDs, in bytes
+    terms         i32[3*t]   (coeff, v_pow, z_pow) for every term
+    ids           bytes      comma-separated knot IDs
+    ```"""
+
+    MAGIC = b"KIDB"
+    VERSION = 1
+    HEADER_LEN = 16
+
+    def __init__(self, path: Path):
+        with path.open("rb") as file:
+            self.buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n = struct.unpack_from("<4sIQ", self.buf)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f"{path} is not a packed KnotIDDB")
+        view = memoryview(self.buf)
+        pos = self.HEADER_LEN
+        # memoryview casts are native-endian, which is little-endian everywhere we run
+        self.hashes = view[pos : (pos := pos + 8 * n)].cast("Q")
+        self.term_offsets = view[pos : (pos := pos + 4 * (n + 1))].cast("I")
+        self.id_offsets = view[pos : (pos := pos + 4 * (n + 1))].cast("I")
+        self.terms_start = pos
+        self.ids_start = pos + 12 * self.term_offsets[-1]
+
+    @classmethod
+    def header(cls, entry_ct: int) -> bytes:
+        return struct.pack("<4sIQ", cls.MAGIC, cls.VERSION, entry_ct)
+
+    @staticmethod
+    def hash_key(packed_terms: bytes) -> int:
+        digest = hashlib.blake2b(packed_terms, digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    @functools.cached_property
+    def digest(self) -> str:
+        """Hash of the whole file, to tell which table results were looked up in"""
+        return hashlib.blake2b(self.buf, digest_size=16).hexdigest()
+
+    def lookup(self, poly: str | HOMFLY) -> tuple[str, ...] | None:
+        if type(poly) is str:
+            poly = HOMFLY.from_string(poly)
+        res = self._get(poly)  # type: ignore
+        if res is not None:
+            return res
+        return self._get(poly.invert_v())  # type: ignore
+
+    def _get(self, poly: HOMFLY) -> tuple[str, ...] | None:
+        key = _pack_terms(poly)
+        hash = self.hash_key(key)
+        ind = bisect.bisect_left(self.hashes, hash)
+        # checking the terms, in case of hash collisions
+        while ind < len(self.hashes) and self.hashes[ind] == hash:
+            start = self.terms_start + 12 * self.term_offsets[ind]
+            end = self.terms_start + 12 * self.term_offsets[ind + 1]
+            if self.buf[start:end] == key:
+                start = self.ids_start + self.id_offsets[ind]
+                end = self.ids_start + self.id_offsets[ind + 1]
+                return tuple(self.buf[start:end].decode().split(","))
+            ind += 1
+        return None
+
+
+@functools.cache
+def load_knot_db(
+    path: Path = util.knot_db_path, pickle_path: Path = util.knot_db_pickle_path
+) -> PackedKnotIDDB:
+    """Opens the packed KnotIDDB, building it from the pickle the first time,
+    and again whenever the pickle is newer. Cached, so each process only maps it once"""
+    if not path.is_file() or (
+        pickle_path.is_file() and pickle_path.stat().st_mtime > path.stat().st_mtime
+    ):
+        print(f"Building {path} from {pickle_path}", flush=True)
+        KnotIDDB.load_from_file(pickle_path).dump_packed(path)
+    return PackedKnotIDDB(path)
+
+
 def build_lookup():
     """Constructs a Lookup-file - each line is a list of knot IDs, and their homfly in a standardized form"""
     master_dict: dict[HOMFLY, list[str]] = {}
@@ -174,6 +515,7 @@ def build_lookup():
         for key, vals in master_dict.items():
             # if len(vals) > 1:
             print(", ".join(vals), "|", key, file=f)
+    print(HOMFLY.cache_stats_str())
 
 
 def main():
@@ -184,15 +526,15 @@ def main():
     # # list of all knots that correspond to a specific polynomial
 
     # knots = KnotIDDB(max_size=14)
-    pkl_file = Path("data/knotIDDB.pkl")
     # print("loaded")
 
     s_time = time()
-    knots = KnotIDDB.load_from_file(pkl_file)
+    knots = load_knot_db()
     print(f"Load Time: {time()-s_time:.4g}")
     mosaic = M.NormMosaic.build_mobius("2125a9a1639a4034")
     knot_poly = HOMFLY.from_knot(mosaic)
     print(knots.lookup(knot_poly))
+    print(HOMFLY.cache_stats_str())
 
 
 if __name__ == "__main__":
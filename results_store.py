@@ -0,0 +1,142 @@
+from dataclasses import dataclass
+from pathlib import Path
+import sqlite3
+from time import time
+from typing import Iterable, Iterator
+
+import mosaic_util as util
+
+
+@dataclass(frozen=True)
+class ResultTask:
+    """Identifies the results of one catalog task in the ResultStore"""
+
+    variant: str
+    cubic_type: str | None
+    name: str  # ex. 5_pt0012, named like the result file it replaces
+
+
+class ResultStore:
+    """The best result for each knot found by each catalog task, in an SQLite file
+    shared by every worker process. Each task's results are committed in one transaction,
+    so a task is either recorded completely or not at all.
+    Results are indexed so the best result of each knot can be found without reading them all"""
+
+    def __init__(self, path: Path = util.results_db_path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # long timeout, as other workers may be holding the write lock
+        self.db = sqlite3.connect(path, timeout=120)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        # cubic_type is '' for other variants, as NULLs are never equal
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                variant TEXT NOT NULL, cubic_type TEXT NOT NULL, name TEXT NOT NULL,
+                result_ct INTEGER NOT NULL, finished REAL NOT NULL,
+                PRIMARY KEY (variant, cubic_type, name)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS results (
+                variant TEXT NOT NULL, cubic_type TEXT NOT NULL, task TEXT NOT NULL,
+                knot_id TEXT NOT NULL, crossings INTEGER, size INTEGER NOT NULL,
+                tile_ct INTEGER NOT NULL, mosaic TEXT NOT NULL, polynomial TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS results_best
+                ON results (variant, cubic_type, knot_id, size, tile_ct, mosaic);
+            CREATE INDEX IF NOT EXISTS results_crossings
+                ON results (variant, cubic_type, crossings);
+            CREATE INDEX IF NOT EXISTS results_task ON results (variant, cubic_type, task);
+            """
+        )
+        self.db.commit()
+
+    def save(self, task: ResultTask, results: Iterable[util.KnotResult]):
+        """Replaces the results of a task"""
+        key = (task.variant, task.cubic_type or "", task.name)
+        rows = [
+            (*key, r.knotID, _crossings(r.knotID), r.size, r.tile_ct, r.mosaic_str, r.polynomial)
+            for r in results
+        ]
+        with self.db:
+            self.db.execute(
+                "DELETE FROM results WHERE variant = ? AND cubic_type = ? AND task = ?", key
+            )
+            self.db.executemany(
+                "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?)", (*key, len(rows), time())
+            )
+
+    def task_names(self, variant: str, cubic_type: str | None = None) -> set[str]:
+        """Names of the finished tasks of a variant"""
+        rows = self.db.execute(
+            "SELECT name FROM tasks WHERE variant = ? AND cubic_type = ?",
+            (variant, cubic_type or ""),
+        )
+        return {name for (name,) in rows}
+
+    def best_results(
+        self,
+        variant: str,
+        cubic_type: str | None = None,
+        max_crossings: int | None = None,
+    ) -> list[util.KnotResult]:
+        """The best result of each knot, as `KnotResult.better_than` picks them.
+        Mosaics of one size have strings of the same length, so they sort like their values"""
+        crossing_filter = "" if max_crossings is None else "AND crossings <= :max_crossings"
+        rows = self.db.execute(
+            f"""
+            SELECT size, mosaic, tile_ct, polynomial, knot_id FROM (
+                SELECT *, ROW_NUMBER() OVER (
+                    PARTITION BY knot_id ORDER BY size, tile_ct, mosaic
+                ) AS rank
+                FROM results
+                WHERE variant = :variant AND cubic_type = :cubic_type {crossing_filter}
+            ) WHERE rank = 1
+            """,
+            {"variant": variant, "cubic_type": cubic_type or "", "max_crossings": max_crossings},
+        )
+        return [util.KnotResult(*row) for row in rows]
+
+    def iter_results(
+        self, variant: str, cubic_type: str | None = None
+    ) -> Iterator[util.KnotResult]:
+        """Every result of a variant, from every task"""
+        rows = self.db.execute(
+            "SELECT size, mosaic, tile_ct, polynomial, knot_id FROM results"
+            " WHERE variant = ? AND cubic_type = ?",
+            (variant, cubic_type or ""),
+        )
+        for row in rows:
+            yield util.KnotResult(*row)
+
+    def import_result_files(self, variant: str, cubic_type: str | None = None):
+        """Saves the text result files written before results were kept here.
+        Files whose task is already in the store are skipped, as are incomplete files"""
+        results_folder = util.results_dir_knotID(variant, cubic_type)
+        if not results_folder.is_dir():
+            return
+        done = self.task_names(variant, cubic_type)
+        for file in sorted(results_folder.glob("*.txt")):
+            if file.stem in done:
+                continue
+            results, complete = util.load_result_file(file)
+            if not complete:
+                print(f"{file} is incomplete")
+                continue
+            self.save(ResultTask(variant, cubic_type, file.stem), results)
+            print(f"Imported {file}")
+
+    def close(self):
+        self.db.close()
+
+
+def _crossings(knotID: str) -> int | None:
+    """Crossing number of a knot ID, the smallest if it's ambiguous (ex. `8_1,8_3`)"""
+    try:
+        return min(
+            util.knot_order_from_id(id.removeprefix("E_SAGE")) for id in knotID.split(",")
+        )
+    except ValueError:
+        return None
@@ -0,0 +1,68 @@
+import pytest
+
+import homfly
+from polynomial_standardization import HOMFLY
+
+# from homflys/knotsToHOMFLY.txt
+TREFOIL = HOMFLY.from_string("v^2*z^2 + -1*v^4 + 2*v^2")
+FIGURE_EIGHT = HOMFLY.from_string("-1*z^2 + v^2 + -1 + v^-2")
+UNKNOT = HOMFLY.from_string("1")
+
+# KnotInfo's PD codes
+TREFOIL_PD = [[1, 5, 2, 4], [3, 1, 4, 6], [5, 3, 6, 2]]
+FIGURE_EIGHT_PD = [[4, 2, 5, 1], [8, 6, 1, 5], [6, 3, 7, 4], [2, 7, 3, 8]]
+# the other trefoil, traversed from mosaic 2125166624639a162a8434340
+MIRROR_TREFOIL_PD = [[2, 5, 3, 6], [4, 1, 5, 2], [6, 3, 1, 4]]
+
+
+@pytest.mark.parametrize(
+    "pd_codes, expected",
+    [
+        (TREFOIL_PD, TREFOIL),
+        (FIGURE_EIGHT_PD, FIGURE_EIGHT),
+        ([], UNKNOT),
+        ([[1, 1, 2, 2]], UNKNOT),
+    ],
+)
+def test_known_knots(pd_codes, expected):
+    assert homfly.homfly_from_pd(pd_codes) == expected
+
+
+def test_mirror_pair():
+    mirror = homfly.homfly_from_pd(MIRROR_TREFOIL_PD)
+    assert mirror != TREFOIL
+    assert mirror == TREFOIL.invert_v()
+    # the figure eight is its own mirror image
+    assert FIGURE_EIGHT.invert_v() == FIGURE_EIGHT
+
+
+@pytest.mark.parametrize(
+    "pd_codes, expected, crossings",
+    [
+        # a kink on a trefoil, mosaic 0025125a546295139a5403400
+        ([[1, 8, 2, 1], [3, 7, 4, 6], [5, 3, 6, 2], [7, 5, 8, 4]], TREFOIL, 3),
+        # a kink and a bigon on a trefoil, mosaic 255513121629a943aaa103434
+        (
+            [[2, 10, 3, 9], [3, 8, 4, 9], [4, 12, 5, 11], [6, 8, 7, 7], [10, 2, 11, 1], [12, 6, 1, 5]],
+            TREFOIL,
+            3,
+        ),
+        # a bigon on a figure eight, mosaic 021002991039a912898434340
+        (
+            [[3, 10, 4, 11], [5, 1, 6, 12], [6, 1, 7, 2], [7, 3, 8, 2], [9, 4, 10, 5], [11, 9, 12, 8]],
+            FIGURE_EIGHT,
+            4,
+        ),
+        # an unknot with no kinks, only bigons, mosaic 0210289139940340
+        ([[1, 5, 2, 4], [2, 5, 3, 6], [3, 1, 4, 6]], UNKNOT, 0),
+        (TREFOIL_PD, TREFOIL, 3),
+    ],
+)
+def test_reduced_diagrams(pd_codes, expected, crossings):
+    assert homfly.reduced_crossing_count(pd_codes) == crossings
+    assert homfly.homfly_from_pd(pd_codes) == expected
+
+
+def test_max_crossings():
+    assert homfly.homfly_from_pd(FIGURE_EIGHT_PD, max_crossings=3) is None
+    assert homfly.homfly_from_pd(FIGURE_EIGHT_PD, max_crossings=4) == FIGURE_EIGHT
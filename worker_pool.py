@@ -0,0 +1,254 @@
+"""
+A pool of long-lived worker processes.
+Unlike ProcessPoolExecutor, each worker sets up its state once (sage, the KnotIDDB, caches)
+and keeps it between tasks. Workers are recycled when their memory grows too large,
+rather than after a fixed number of tasks.
+"""
+
+from collections import deque
+from dataclasses import dataclass
+import multiprocessing as mp
+from multiprocessing import connection, current_process
+from multiprocessing.connection import Connection
+from pathlib import Path
+import resource
+import threading
+import traceback
+from typing import Any, Callable
+
+
+@dataclass
+class TaskResult:
+    """Sent back to the parent for each finished task"""
+
+    index: int
+    worker: str
+    error: str | None  # traceback if the task raised
+    rss_mb: float  # memory of the worker after the task
+    recycled: bool  # the worker exits after this task
+    value: Any = None  # returned by the task
+
+
+def rss_mb() -> float:
+    """Current resident memory of this process"""
+    try:
+        pages = int(Path("/proc/self/statm").read_text().split()[1])
+        return pages * resource.getpagesize() / 2**20
+    except OSError:
+        # no /proc, use the peak instead (KB on linux, bytes on mac)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+# sent by workers once init() is done
+_READY = "ready"
+
+
+def _worker_main(
+    conn: Connection,
+    init: Callable[[], Any],
+    work: Callable[..., Any],
+    max_rss_mb: float,
+):
+    """Main loop of each worker. `init` and `work` must be picklable, ie. module level functions"""
+    state = init()
+    name = current_process().name
+    conn.send(_READY)
+    while (task := conn.recv()) is not None:
+        index, args = task
+        error = None
+        value = None
+        try:
+            value = work(state, *args)
+        except Exception:
+            error = traceback.format_exc()
+        mem = rss_mb()
+        recycled = mem > max_rss_mb
+        conn.send(TaskResult(index, name, error, mem, recycled, value))
+        if recycled:
+            break
+    # let the state clean up, ex. flushing caches
+    if hasattr(state, "close"):
+        state.close()
+
+
+@dataclass
+class _Worker:
+    proc: Any  # a Process of the pool's context
+    conn: Connection
+    task: int | None = None  # index of the running task
+    ready: bool = False  # init() finished
+
+
+class PersistentPool:
+    """Runs `work(state, *args)` for each submitted task, where `state = init()`
+    is created once per worker process. What `work` returns is sent back in the TaskResult. `on_done` is called from a background
+    thread of the parent process when each task finishes.
+    Each worker has its own pipe, so one being killed can't break the others."""
+
+    def __init__(
+        self,
+        workers: int,
+        init: Callable[[], Any],
+        work: Callable[..., Any],
+        on_done: Callable[[TaskResult], None],
+        max_rss_mb: float = 4096,
+        max_queue: int = 8,
+    ):
+        # workers are started from a background thread, and forking a
+        # threaded process can deadlock, so start them from a clean server process
+        self.ctx = mp.get_context("forkserver")
+        self.init = init
+        self.work = work
+        self.on_done = on_done
+        self.max_rss_mb = max_rss_mb
+        # tasks submitted but not finished, limits how far ahead we queue
+        self.slots = threading.BoundedSemaphore(max_queue)
+        self.cond = threading.Condition()
+        self.pending: set[int] = set()
+        self.backlog: deque[tuple[int, tuple]] = deque()
+        self.workers: dict[str, _Worker] = {}
+        self.closing = False
+        # every worker failed to start, so nothing will run new tasks
+        self.no_workers = False
+        self.spawn_ct = 0
+        # wakes the listener when close() is called
+        self.wake_recv, self.wake_send = mp.Pipe(duplex=False)
+        for _ in range(workers):
+            self._spawn()
+        self.listener = threading.Thread(target=self._listen, daemon=True)
+        self.listener.start()
+
+    def _spawn(self):
+        self.spawn_ct += 1
+        parent_conn, child_conn = self.ctx.Pipe()
+        proc = self.ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.init, self.work, self.max_rss_mb),
+            name=f"CatalogWorker-{self.spawn_ct}",
+        )
+        proc.start()
+        child_conn.close()
+        with self.cond:
+            self.workers[proc.name] = _Worker(proc, parent_conn)
+        self._dispatch()
+
+    def submit(self, index: int, *args):
+        """Queues a task, blocking while too many are already queued.
+        If there are no workers left to run it, the task fails"""
+        self.slots.acquire()
+        with self.cond:
+            self.pending.add(index)
+            self.backlog.append((index, args))
+            no_workers = self.no_workers
+        if no_workers:
+            # failed by the listener, so on_done is always called from there
+            self.wake_send.send(None)
+        else:
+            self._dispatch()
+
+    def oldest_pending(self) -> int | None:
+        with self.cond:
+            return min(self.pending, default=None)
+
+    def _dispatch(self):
+        """Hands queued tasks to idle workers"""
+        with self.cond:
+            for worker in self.workers.values():
+                if not self.backlog:
+                    break
+                if worker.task is None:
+                    worker.task, args = self.backlog.popleft()
+                    try:
+                        worker.conn.send((worker.task, args))
+                    except OSError:
+                        pass  # it died, the listener will fail the task
+
+    def _finish(self, res: TaskResult):
+        with self.cond:
+            self.pending.discard(res.index)
+            if (worker := self.workers.get(res.worker)) is not None:
+                worker.task = None
+        self.slots.release()
+        self.on_done(res)
+        with self.cond:
+            self.cond.notify_all()
+
+    def _listen(self):
+        while True:
+            with self.cond:
+                if self.closing and not self.workers:
+                    return
+                conns = {w.conn: w for w in self.workers.values()}
+                sentinels = {w.proc.sentinel: w for w in self.workers.values()}
+            ready = connection.wait([*conns, *sentinels, self.wake_recv])
+            if self.wake_recv in ready:
+                self.wake_recv.recv()
+                self._fail_stranded()
+            # results first, a recycled worker may have exited already
+            for conn in (c for c in ready if c in conns):
+                try:
+                    res: TaskResult | str = conn.recv()
+                except (EOFError, OSError):
+                    continue  # died, handled with the sentinel
+                if res == _READY:
+                    conns[conn].ready = True
+                    continue
+                self._finish(res)  # type: ignore
+                if res.recycled:
+                    self._retire(conns[conn], respawn=True)
+                else:
+                    self._dispatch()
+            for sentinel in (s for s in ready if s in sentinels):
+                worker = sentinels[sentinel]
+                if worker.proc.name in self.workers:
+                    self._worker_died(worker)
+
+    def _worker_died(self, worker: _Worker):
+        """A worker exited without reporting back, ex. killed for memory, or asked to by close()"""
+        # removed first, so _dispatch can't hand it another task after this one is failed
+        with self.cond:
+            self.workers.pop(worker.proc.name, None)
+            task = worker.task
+        if task is not None:
+            error = f"{worker.proc.name} died with exit code {worker.proc.exitcode}"
+            self._finish(TaskResult(task, worker.proc.name, error, 0, True))
+        # if init failed, a new worker would just fail again
+        if not worker.ready:
+            print(f"ERR: {worker.proc.name} failed to start", flush=True)
+        self._retire(worker, respawn=worker.ready)
+        with self.cond:
+            self.no_workers = not self.workers
+        self._fail_stranded()
+
+    def _fail_stranded(self):
+        """If every worker failed to start, fails the queued tasks, as nothing will run them"""
+        with self.cond:
+            if not self.no_workers:
+                return
+            stranded = list(self.backlog)
+            self.backlog.clear()
+        for index, _ in stranded:
+            self._finish(TaskResult(index, "", "no workers left", 0, False))
+
+    def _retire(self, worker: _Worker, respawn: bool):
+        with self.cond:
+            self.workers.pop(worker.proc.name, None)
+        worker.proc.join()
+        worker.conn.close()
+        if respawn and not self.closing:
+            self._spawn()
+
+    def close(self):
+        """Waits for all queued tasks to finish, then stops the workers.
+        Tasks that can't run, as there are no workers left, are failed rather than waited on"""
+        with self.cond:
+            self.cond.wait_for(lambda: not self.pending)
+            self.closing = True
+            workers = list(self.workers.values())
+        for worker in workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass  # already exited
+        self.wake_send.send(None)
+        self.listener.join()